@@ -1,28 +1,806 @@
 url = 'https://redcap.nyu.edu/api/'
+#test, dummy and staff records left out of every export (see exclude_records)
+default_exclusions = {
+    'patterns': ['TEST', 'test', 'D'],
+    'record_ids': ['497', '498', '499'],
+}
+
+#visit notes layout for each timepoint. Field names are prefix + name + '_' + suffix, e.g. richards_start_4m / mc_visit_date_4m
+#tasks are listed in form order and have start/end markers and comp/why completion fields; data_range is the first and last data-presence field
+#mailing_form holds package_mailed / ra_mailed for timepoints where the movesense package is mailed out
+_orca_8m_tasks = ['richards', 'vpc', 'srt', 'pa', 'social', 'relational_memory', 'cecile']
+_orca_12m_tasks = ['richards', 'gap', 'srt', 'pa', 'vpc', 'relational_memory', 'cecile']
+_freeplay_markers = ['notoy_start_real', 'notoy_end_real', 'toy_start_real', 'toy_end_real']
+timepoints = {
+    'orca_4month_arm_1': {
+        'form': 'visit_notes_4m', 'suffix': '4m', 'prefix': '',
+        'tasks': ['richards', 'vpc', 'srt', 'cecile', 'relational_memory'],
+        'freeplay_markers': _freeplay_markers + ['fp_nt_break_start_real', 'fp_nt_break_end_real', 'fp_t_break_start_real', 'fp_t_break_end_real'],
+        'mp4_markers': ['notoy_start', 'notoy_end', 'toy_start', 'toy_end', 'fp_nt_break_start', 'fp_nt_break_end', 'fp_t_break_start', 'fp_t_break_end'],
+        'completion_tasks': ['richards', 'vpc', 'srt', 'cecile', 'relational_memory', 'freeplay'],
+        'data_range': ('richards_ecg_cg_data', 'fp_video_data'),
+        'mailing_form': 'mailing_information_4m',
+    },
+    'orca_8month_arm_1': {
+        'form': 'visit_notes_8m', 'suffix': '8m', 'prefix': '',
+        'tasks': _orca_8m_tasks, 'freeplay_markers': _freeplay_markers, 'mp4_markers': [],
+        'completion_tasks': _orca_8m_tasks + ['freeplay'],
+        'data_range': ('richards_ecg_cg_data', 'fp_video_data'),
+    },
+    'orca_12month_arm_1': {
+        'form': 'visit_notes_12m', 'suffix': '12m', 'prefix': '',
+        'tasks': _orca_12m_tasks, 'freeplay_markers': _freeplay_markers, 'mp4_markers': [],
+        'completion_tasks': _orca_12m_tasks + ['freeplay'],
+        'data_range': ('richards_ecg_cg_data', 'fp_video_data'),
+    },
+    'mice_4month_arm_4': {
+        'form': 'mice_visit_notes_4m', 'suffix': '4m', 'prefix': 'mc_',
+        'tasks': [], 'freeplay_markers': [], 'mp4_markers': [],
+        'completion_tasks': [], 'data_range': None,
+    },
+    'mice_8month_arm_4': {
+        'form': 'visit_notes_8m', 'suffix': '8m', 'prefix': '',
+        'tasks': _orca_8m_tasks, 'freeplay_markers': _freeplay_markers, 'mp4_markers': [],
+        'completion_tasks': _orca_8m_tasks + ['freeplay'],
+        'data_range': ('richards_ecg_cg_data', 'fp_video_data'),
+    },
+    'mice_12month_arm_4': {
+        'form': 'visit_notes_12m', 'suffix': '12m', 'prefix': '',
+        'tasks': _orca_12m_tasks, 'freeplay_markers': _freeplay_markers, 'mp4_markers': [],
+        'completion_tasks': _orca_12m_tasks + ['freeplay'],
+        'data_range': ('richards_ecg_cg_data', 'fp_video_data'),
+    },
+}
+#short names accepted anywhere a timepoint is
+timepoint_aliases = {
+    '4m': 'orca_4month_arm_1', '8m': 'orca_8month_arm_1', '12m': 'orca_12month_arm_1',
+    'mice_4m': 'mice_4month_arm_4', 'mice_8m': 'mice_8month_arm_4', 'mice_12m': 'mice_12month_arm_4',
+}
+
 #ORCA Redcap Functions
 #all these functions are used for working with orca data projects in REDCap 
 #e.g. pulling, cleaning, importing data
 
-
-#1-----------------------
-def get_all_data(token):
+#0-----------------------
+class OrcaClient:
     """
-    Pulls all data within a redcap project
+    Holds the api url, project token and a pool of keep-alive connections to the REDCap API.
+    Can be passed to any function in place of a raw token so that repeated calls reuse the same connection
 
     Args:
         token (str): The API token for the project.
+        api_url (str): The REDCap api url. Default is the NYU REDCap api
+        pool_size (int): The number of keep-alive connections to hold open. Default is 10
+        cache_dir (str): Folder to cache parsed exports in. Default is None (no caching)
+        cache_ttl (int): Number of seconds a cached export stays valid. Default is 3600. None never expires
+        mirror_dir (str): Folder holding a local mirror of the project built by sync_project. Once synced,
+            exports are served from the mirror instead of the api. Default is None
+        typed (bool): Parse every export with the dtypes from the project's data dictionary (see get_dtype_map). Default is False
+
+    Example:
+        client = OrcaClient(token, cache_dir='~/.orca_cache')
+        visit_notes = get_orca_data(client, form='visit_notes_4m')
+    """
+    def __init__(self, token, api_url = url, pool_size = 10, cache_dir = None, cache_ttl = 3600, mirror_dir = None, typed = False):
+        import os
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.token = token
+        self.url = api_url
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir is not None else None
+        self.cache_ttl = cache_ttl
+        self.mirror_dir = os.path.expanduser(mirror_dir) if mirror_dir is not None else None
+        self.typed = typed
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def post(self, data, **kwargs):
+        """
+        Sends a request to the REDCap api over the pooled session. The project token is added to the payload
+
+        Args:
+            data (dict): The api payload, without the token
+
+        Returns:
+            requests.Response: The api response
+        """
+        data = dict(data)
+        data['token'] = self.token
+        return self.session.post(self.url, data=data, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return f"OrcaClient(url='{self.url}')"
+
+_shared_session = None
+
+def _redcap_post(token, data, **kwargs):
+    """
+    Sends a request to the REDCap api. Uses the client's pooled session if an OrcaClient is passed,
+    otherwise a module-wide keep-alive session so that raw tokens also reuse connections
+
+    Args:
+        token (str or OrcaClient): The API token for the project, or an OrcaClient.
+        data (dict): The api payload, without the token
 
     Returns:
-        pandas.DataFrame: A DataFrame with the retrieved data.
+        requests.Response: The api response
+    """
+    global _shared_session
+    if isinstance(token, OrcaClient):
+        return token.post(data, **kwargs)
+
+    if _shared_session is None:
+        import requests
+        _shared_session = requests.Session()
+    data = dict(data)
+    data['token'] = token
+    return _shared_session.post(url, data=data, **kwargs)
+
+def _api_credentials(token):
+    """
+    Returns the (api url, raw token) pair for a raw token or an OrcaClient
+    """
+    if isinstance(token, OrcaClient):
+        return token.url, token.token
+    return url, token
+
+def _project_key(token):
+    """
+    Returns a short hash of the api url and token identifying a project, so the token itself is never written to disk
+    """
+    import hashlib
+
+    api_url, api_token = _api_credentials(token)
+    return hashlib.sha256((api_url + api_token).encode()).hexdigest()[:16]
+
+def _project_cache_dir(token):
+    """
+    Returns the cache folder for the client's project, or None if the client has no cache
+    """
+    import os
+
+    if not isinstance(token, OrcaClient) or token.cache_dir is None:
+        return None
+    return os.path.join(token.cache_dir, _project_key(token))
+
+def _cache_path(token, data):
+    """
+    Returns the cache file path for an export payload. Files are prefixed with the exported form(s)
+    so a single form can be invalidated, and keyed by a hash of every other payload entry
+    (fields, events, records, filter, raw/label)
+    """
+    import os
+    import json
+    import hashlib
+
+    project_dir = _project_cache_dir(token)
+    if project_dir is None:
+        return None
+    forms = sorted(value for key, value in data.items() if key.startswith('forms['))
+    if forms:
+        prefix = '+'.join(forms)
+    else:
+        prefix = 'fields' if data.get('content') == 'record' else data.get('content')
+    payload = {key: value for key, value in data.items() if key != 'token'}
+    key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:24]
+    return os.path.join(project_dir, prefix + '__' + key + _cache_extension())
+
+def _cache_extension():
+    import importlib.util
+    return '.parquet' if importlib.util.find_spec('pyarrow') is not None else '.pkl'
+
+def _tmp_path(path):
+    """
+    Returns a temporary path next to path that no other process or thread writing the same file will pick,
+    to write to before os.replace-ing it onto path
+    """
+    import os
+    import uuid
+
+    return f'{path}.{os.getpid()}.{uuid.uuid4().hex[:12]}.tmp'
+
+def _read_cache(path, ttl):
+    """
+    Returns the cached export at path (or the pickle saved in its place, see _write_cache) if it is younger than ttl seconds,
+    otherwise None. A cache file that can't be read counts as a miss
+    """
+    import os
+    import time
+    import pandas as pd
+
+    for cached_path in dict.fromkeys([path, os.path.splitext(path)[0] + '.pkl']):
+        if not os.path.exists(cached_path):
+            continue
+        try:
+            if ttl is None or time.time() - os.path.getmtime(cached_path) < ttl:
+                return pd.read_parquet(cached_path) if cached_path.endswith('.parquet') else pd.read_pickle(cached_path)
+        except (OSError, ValueError) as e:
+            print('could not read cached export: ' + str(e))
+    return None
+
+def _write_cache(df, path):
+    """
+    Saves an export to the cache at path. Exports pyarrow can't store (e.g. a column parsed as a mix of numbers and text)
+    are pickled next to it instead, and an export that can't be written at all is left uncached, so caching never fails an export
+    """
+    import os
+
+    pickle_path = os.path.splitext(path)[0] + '.pkl'
+    target = path
+    tmp_path = _tmp_path(path)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if target.endswith('.parquet'):
+            from pyarrow import ArrowException
+            try:
+                df.to_parquet(tmp_path, index=False)
+            except ArrowException:
+                target = pickle_path
+        if target.endswith('.pkl'):
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, target)
+        #only the latest copy of an export is kept
+        for stale_path in {path, pickle_path} - {target}:
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+    except OSError as e:
+        print('could not cache export: ' + str(e))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _export_records(token, data, refresh = False, typed = None):
+    """
+    Sends a record export and parses it, reading from / writing to the client's on-disk cache when one is set
+
+    Args:
+        token (str or OrcaClient): The API token for the project, or an OrcaClient.
+        data (dict): The export payload, without the token
+        refresh (bool): Skip any cached copy and re-export from REDCap. Default is False
+        typed (bool): Parse with the data dictionary dtypes. Default is None and uses the client's setting
+
+    Returns:
+        pandas.DataFrame: The parsed export
+    """
+    if typed is None:
+        typed = isinstance(token, OrcaClient) and token.typed
+    dtype_map = get_dtype_map(token) if typed and data.get('content') == 'record' and data.get('rawOrLabel', 'raw') == 'raw' else None
+
+    if not refresh:
+        df = _read_mirror(token, data, dtype_map)
+        if df is not None:
+            return df
+
+    path = _cache_path(token, dict(data, typed='true') if dtype_map is not None else data)
+    if path is not None and not refresh:
+        df = _read_cache(path, token.cache_ttl)
+        if df is not None:
+            return df
+
+    r = _redcap_post(token, data)
+    print('HTTP Status: ' + str(r.status_code))
+    df = _read_export(r, dtype_map)
+
+    if path is not None and r.status_code == 200:
+        _write_cache(df, path)
+    return df
+
+def _selection_payload(record_id = None, timepoint = 'all', fields = None, forms = None, filter_logic = None):
+    """
+    Builds the records[] / events[] / fields[] / forms[] / filterLogic part of a REDCap export payload
+    so the selection is applied server side
+
+    Args:
+        record_id (str or list): record id(s) to export. None exports all records
+        timepoint (str or list): redcap event name(s) to export. 'all' exports all events
+        fields (list): field names to export
+        forms (list): form names to export
+        filter_logic (str): REDCap filter logic
+
+    Returns:
+        dict: payload entries to merge into the export request
+    """
+    def as_list(value):
+        return [value] if isinstance(value, str) else list(value)
+
+    payload = {}
+    selections = {
+        'records': None if record_id is None else as_list(record_id),
+        'events': None if timepoint is None or timepoint == 'all' else as_list(timepoint),
+        'fields': None if fields is None else as_list(fields),
+        'forms': None if forms is None else as_list(forms),
+    }
+    for key, values in selections.items():
+        for i, value in enumerate(values or []):
+            payload[f'{key}[{i}]'] = str(value)
+
+    if filter_logic:
+        payload['filterLogic'] = filter_logic
+    return payload
+
+def _read_export(r, dtype_map = None):
+    """
+    Parses a csv export response into a DataFrame. record_id is always read as a string and an
+    export with no matching rows returns an empty DataFrame
+
+    Args:
+        r (requests.Response): The api response
+        dtype_map (dict): column -> dtype (see get_dtype_map) passed to the parser. Default is None (inferred)
+
+    Returns:
+        pandas.DataFrame: The parsed export
     """
-    import requests
     import pandas as pd
     import io
-   
 
-    
+    if not r.text.strip():
+        return pd.DataFrame(columns=['record_id', 'redcap_event_name'])
+    if dtype_map is None:
+        return pd.read_csv(io.StringIO(r.text), dtype={'record_id': str})
+
+    dates = {column: dtype for column, dtype in dtype_map.items() if dtype.startswith('datetime')}
+    parser_dtypes = {column: dtype for column, dtype in dtype_map.items() if column not in dates}
+    try:
+        df = pd.read_csv(io.StringIO(r.text), dtype=parser_dtypes)
+    except (ValueError, TypeError):
+        #values that don't match the data dictionary (e.g. legacy text in an integer field) are coerced to missing instead
+        return _apply_dtypes(pd.read_csv(io.StringIO(r.text), dtype=str), dtype_map)
+    return _apply_dtypes(df, dates)
+
+def _apply_dtypes(df, dtype_map):
+    """
+    Converts the columns of df that appear in dtype_map, coercing values that can't be converted to missing
+    """
+    import pandas as pd
+
+    df = df.copy()
+    for column in df.columns.intersection(list(dtype_map)):
+        dtype = dtype_map[column]
+        values = df[column]
+        if dtype.startswith('datetime'):
+            df[column] = pd.to_datetime(values, errors='coerce')
+        elif dtype in ('Int64', 'Float64'):
+            numeric = pd.to_numeric(values, errors='coerce')
+            if dtype == 'Int64' and not (numeric.dropna() % 1 == 0).all():
+                dtype = 'Float64'
+            df[column] = numeric.astype(dtype)
+        else:
+            df[column] = values.astype(dtype)
+    return df
+
+def _stream_export(token, data, chunksize, dtype = None):
+    """
+    Streams a csv export and parses it in chunks as the response arrives, so the full response body is never held in memory
+
+    Args:
+        token (str or OrcaClient): The API token for the project, or an OrcaClient.
+        data (dict): The export payload, without the token
+        chunksize (int): Number of rows per chunk
+        dtype (type or dict): dtype(s) passed to the parser. Default is None (record_id as string, everything else inferred per chunk)
+
+    Yields:
+        pandas.DataFrame: chunks of the export
+    """
+    import pandas as pd
+
+    r = _redcap_post(token, data, stream=True)
+    print('HTTP Status: ' + str(r.status_code))
+    try:
+        if r.status_code != 200:
+            raise RuntimeError('REDCap export failed: ' + r.text)
+        r.raw.decode_content = True
+        try:
+            reader = pd.read_csv(r.raw, chunksize=chunksize, encoding='utf-8-sig', dtype=dtype if dtype is not None else {'record_id': str})
+        except pd.errors.EmptyDataError:
+            return
+        with reader:
+            for chunk in reader:
+                yield chunk
+    finally:
+        r.close()
+
+def _write_export_parquet(token, data, path, chunksize = 50000):
+    """
+    Streams a csv export straight into a parquet file chunk by chunk. Every column is stored as a string so that
+    the schema is the same for every chunk
+
+    Returns:
+        str: the parquet file path
+    """
+    import os
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    tmp_path = _tmp_path(path)
+    try:
+        for chunk in _stream_export(token, data, chunksize, dtype=str):
+            if writer is None:
+                schema = pa.schema([(column, pa.string()) for column in chunk.columns])
+                writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+    if writer is not None:
+        writer.close()
+    if writer is None:
+        pq.write_table(pa.table({'record_id': pa.array([], pa.string())}), tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+def _project_mirror_dir(token, mirror_dir = None):
+    """
+    Returns the local mirror folder for a project, or None if no mirror folder is set
+    """
+    import os
+
+    if mirror_dir is None and isinstance(token, OrcaClient):
+        mirror_dir = token.mirror_dir
+    if mirror_dir is None:
+        return None
+    return os.path.join(os.path.expanduser(mirror_dir), _project_key(token))
+
+def _infer_types(df):
+    """
+    Converts the all-string columns stored in the mirror back to numbers where every value is numeric,
+    matching what pandas infers when parsing an api export. record_id is left as a string
+    """
+    import pandas as pd
+
+    df = df.copy()
+    for column in df.columns:
+        if column == 'record_id':
+            continue
+        values = df[column]
+        numeric = pd.to_numeric(values, errors='coerce')
+        if numeric.notna().sum() == values.notna().sum():
+            df[column] = numeric.astype('int64') if numeric.notna().all() and (numeric % 1 == 0).all() else numeric
+    return df
+
+def _apply_filter_logic(df, filter_logic):
+    """
+    Applies simple REDCap filter logic ([field]=value / [field]<>value joined by 'and') to the string-typed mirror
+
+    Returns:
+        pandas.DataFrame: The filtered rows, or None if the logic is not supported locally
+    """
+    import re
+
+    for condition in re.split(r'\s+and\s+', filter_logic.strip(), flags=re.IGNORECASE):
+        match = re.fullmatch(r"\[(\w+)\]\s*(=|<>|!=)\s*(['\"]?)(.*?)\3", condition.strip())
+        if match is None or match.group(1) not in df.columns:
+            return None
+        field, operator, value = match.group(1), match.group(2), match.group(4)
+        column = df[field].fillna('')
+        df = df[column == value] if operator == '=' else df[column != value]
+    return df
+
+def _read_mirror(token, data, dtype_map = None):
+    """
+    Serves a record export from the local project mirror, applying the payload's record, event, field,
+    form and filter selection locally. Only the needed columns are read from disk. Returns None when there
+    is no mirror or the export can't be answered from it (e.g. label exports or filter logic that isn't
+    simple field comparisons)
+    """
+    import os
+    import re
+    import pandas as pd
+
+    project_dir = _project_mirror_dir(token)
+    if data.get('content') != 'record' or project_dir is None:
+        return None
+    records_path = os.path.join(project_dir, 'records.parquet')
+    metadata_path = os.path.join(project_dir, 'metadata.parquet')
+    if not os.path.exists(records_path) or not os.path.exists(metadata_path):
+        return None
+    if data.get('rawOrLabel', 'raw') != 'raw' or data.get('dateRangeBegin'):
+        return None
+
+    import pyarrow.parquet as pq
+
+    selected = {}
+    for key, value in data.items():
+        if '[' in key:
+            selected.setdefault(key.split('[')[0], []).append(value)
+
+    metadata = pd.read_parquet(metadata_path)
+    forms = selected.get('forms', [])
+    survey_columns = {form + '_timestamp' for form in metadata['form_name'].unique()} | {'redcap_survey_identifier'}
+    all_columns = pq.read_schema(records_path).names
+
+    if 'fields' in selected or 'forms' in selected:
+        wanted = set(selected.get('fields', [])) | set(metadata[metadata['form_name'].isin(forms)]['field_name'])
+        wanted |= {form + '_complete' for form in forms} | {form + '_timestamp' for form in forms}
+        id_columns = ['record_id', 'redcap_event_name', 'redcap_repeat_instrument', 'redcap_repeat_instance']
+        columns = [column for column in all_columns if column in id_columns]
+        columns += [column for column in all_columns if column not in columns and column.split('___')[0] in wanted]
+    else:
+        columns = list(all_columns)
+    if data.get('exportSurveyFields') == 'false':
+        columns = [column for column in columns if column not in survey_columns]
+
+    filter_fields = re.findall(r'\[(\w+)\]', data.get('filterLogic', ''))
+    df = pd.read_parquet(records_path, columns=list(dict.fromkeys(columns + [f for f in filter_fields if f in all_columns])))
+
+    if 'records' in selected:
+        df = df[df['record_id'].isin(selected['records'])]
+    if 'events' in selected and 'redcap_event_name' in df.columns:
+        df = df[df['redcap_event_name'].isin(selected['events'])]
+    if data.get('filterLogic'):
+        df = _apply_filter_logic(df, data['filterLogic'])
+        if df is None:
+            return None
+
+    df = _infer_types(df[columns].reset_index(drop=True))
+    return _apply_dtypes(df, dtype_map) if dtype_map is not None else df
+
+def _resolve_timepoints(timepoint):
+    """
+    Maps a timepoint (event name or alias, or a list of them) to the list of registered event names
+    """
+    events = [timepoint] if isinstance(timepoint, str) else list(timepoint)
+    resolved = []
+    for event in events:
+        event = timepoint_aliases.get(event, event)
+        if event not in timepoints:
+            raise ValueError(f"unknown timepoint '{event}', expected one of {list(timepoints)} or {list(timepoint_aliases)}")
+        resolved.append(event)
+    return resolved
+
+def _timepoint_fields(event, names):
+    """
+    Field names of the registered timepoint for the given unsuffixed names (e.g. 'visit_date' -> 'visit_date_4m')
+    """
+    info = timepoints[event]
+    return [f"{info['prefix']}{name}_{info['suffix']}" for name in names]
+
+def _timepoint_export(token, events, record_id = None):
+    """
+    Exports the visit notes of every requested timepoint in a single request
+    """
+    forms = list(dict.fromkeys(timepoints[event]['form'] for event in events))
+    return get_orca_data(token, form=forms if len(forms) > 1 else forms[0], form_complete=False, timepoint=events, record_id=record_id)
+
+def _timepoint_table(visit_notes, events, names, multi, long = None):
+    """
+    Selects names (a function of the timepoint's registry entry) from each timepoint's rows of visit_notes.
+    For several timepoints the suffixes are dropped so the rows stack, and redcap_event_name is kept.
+    long = (var_name, value_name) melts each timepoint's columns into rows
+    """
+    import pandas as pd
+
+    frames = []
+    for event in events:
+        event_names = names(timepoints[event])
+        columns = _timepoint_fields(event, event_names)
+        rows = visit_notes[visit_notes['redcap_event_name'] == event]
+        frame = rows[['record_id'] + columns]
+        id_columns = ['record_id']
+        if multi:
+            frame = frame.rename(columns=dict(zip(columns, event_names)))
+            frame.insert(1, 'redcap_event_name', event)
+            id_columns.append('redcap_event_name')
+        if long is not None:
+            frame = frame.melt(id_vars=id_columns, var_name=long[0], value_name=long[1])
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+def _timepoint_column(columns, event, name):
+    """
+    The column of a timepoint's field: the registry field name if exported, otherwise the first column containing
+    name and ending with the timepoint suffix (for fields whose names don't follow the prefix + name + suffix layout).
+    None if there is no such column
+    """
+    field = _timepoint_fields(event, [name])[0]
+    if field in columns:
+        return field
+    suffix = '_' + timepoints[event]['suffix']
+    matches = [column for column in columns if name in column and column.endswith(suffix)]
+    return matches[0] if matches else None
+
+def _select_record(visit_notes, record_id):
+    """
+    Keeps the rows of the given record id (or list of ids), if one is given
+    """
+    if record_id is None:
+        return visit_notes
+    record_ids = [record_id] if isinstance(record_id, str) else list(record_id)
+    return visit_notes[visit_notes['record_id'].isin(record_ids)].reset_index(drop=True)
+
+def _time_of_day(times):
+    """
+    Parses a column of REDCap HH:MM(:SS) times to timedeltas since midnight, NaT where missing
+    """
+    import pandas as pd
+
+    times = times.astype('string')
+    times = times.where(times.str.count(':') > 1, times + ':00')
+    return pd.to_timedelta(times, errors='coerce')
+
+def _combine_datetime(dates, times, tz = 'America/New_York'):
+    """
+    Combines a column of REDCap dates and a column of HH:MM(:SS) times (or already parsed times of day) into
+    tz-aware datetimes in one pass. A missing date or time gives NaT
+    """
+    import pandas as pd
+
+    if not pd.api.types.is_timedelta64_dtype(times):
+        times = _time_of_day(times)
+    combined = pd.to_datetime(dates, errors='coerce').dt.normalize() + times
+    return combined.dt.tz_localize(tz)
+
+def _visit_datetime_table(visit_notes, events):
+    """
+    Long table of record_id, redcap_event_name, visit_date, visit_time (time of day) and visit_datetime for the timepoints in visit_notes
+    """
+    import pandas as pd
+
+    present = set(visit_notes['redcap_event_name'])
+    table = _timepoint_table(visit_notes, [event for event in events if event in present], lambda info: ['visit_date', 'visit_time'], True)
+    table = table[table['visit_date'].notna() | table['visit_time'].notna()].reset_index(drop=True)
+    table['visit_date'] = pd.to_datetime(table['visit_date'], errors='coerce')
+    table['visit_time'] = _time_of_day(table['visit_time'])
+    table['visit_datetime'] = _combine_datetime(table['visit_date'], table['visit_time'])
+    return table
+
+def _mmss_to_timedelta(times):
+    """
+    Vectorized convert_to_timedelta: a column of MM:SS video times to timedeltas, NaT where missing
+    """
+    import pandas as pd
+
+    parts = times.astype('string').str.extract(r'^\s*(\d+):(\d+)\s*$').astype(float)
+    return pd.to_timedelta(parts[0] * 60 + parts[1], unit='s')
+
+def _ema_timetable(survey_timetable):
+    """
+    Melts the PEACH survey timetable into one row per participant and scheduled survey (record_id, survey_name, survey_send_time)
+    """
+    import pandas as pd
+
+    timetable = survey_timetable[survey_timetable['redcap_event_name'] == 'initial_data_arm_1']
+    send_columns = [column for column in timetable.columns[12:] if column != 'survey_timetable_complete']
+    timetable = timetable.melt(id_vars='record_id', value_vars=send_columns, var_name='survey_name', value_name='survey_send_time')
+    timetable['survey_send_time'] = pd.to_datetime(timetable['survey_send_time'])
+    timetable['survey_name'] = timetable['survey_name'].str.replace('_send', '', regex=False)
+    return timetable
+
+_ema_domains = ['anxiety_am', 'anxiety_pm', 'attention_am', 'attention_pm', 'stress_am', 'stress_pm', 'depression_am', 'depression_pm', 'loneliness_am']
+
+def _ema_totals(ema_am, ema_pm, timetable, current_dt):
+    """
+    Per participant EMA state, for every participant with am surveys: running sum and count of each domain, the last
+    survey, its date and scores, and how many of the surveys sent before current_dt were completed
+    """
+    import numpy as np
+    import pandas as pd
+
+    ids = pd.Index(ema_am['record_id'].unique(), name='record_id')
+    ema = pd.concat([ema_am, ema_pm], axis=0, join='outer', ignore_index=True)
+    ema = ema[ema['record_id'].isin(ids)].sort_values(by='ema_survey_timestamp', kind='stable')
+    ema[_ema_domains] = ema[_ema_domains].apply(pd.to_numeric, errors='coerce')
+
+    grouped = ema.groupby('record_id')[_ema_domains]
+    totals = pd.concat([grouped.sum().add_suffix('_sum'), grouped.count().add_suffix('_count')], axis=1).reindex(ids)
+
+    #last survey (first of any ties, as idxmax) and the first row of that survey for the last scores
+    latest = ema['ema_survey_timestamp'] == ema.groupby('record_id')['ema_survey_timestamp'].transform('max')
+    last = ema[latest].drop_duplicates('record_id')[['record_id', 'ema_survey', 'ema_survey_timestamp']]
+    last = last.merge(ema.drop_duplicates(['record_id', 'ema_survey']), on=['record_id', 'ema_survey'], how='left', suffixes=('', '_first'))
+    last = last.set_index('record_id').reindex(ids)
+    last_am = last['ema_survey'].str.contains('_am', regex=False).to_numpy()
+
+    totals['last_survey'] = last['ema_survey']
+    totals['last_survey_date'] = last['ema_survey_timestamp']
+    for domain in ['anxiety', 'attention', 'stress', 'depression']:
+        totals[domain + '_last'] = np.where(last_am, last[domain + '_am'], last[domain + '_pm'])
+    totals['loneliness_last'] = np.where(last_am, last['loneliness_am'], np.nan)
+    totals['comment_last'] = last['ema_comments']
+
+    #completion tally: scheduled surveys already sent that have a response
+    past_surveys = timetable[timetable['survey_send_time'] < current_dt]
+    completed = pd.MultiIndex.from_frame(ema[['record_id', 'ema_survey']]).unique()
+    past_surveys = past_surveys.assign(survey_complete=pd.MultiIndex.from_frame(past_surveys[['record_id', 'survey_name']]).isin(completed))
+    totals['surveys_completed'] = past_surveys.groupby('record_id')['survey_complete'].sum().reindex(ids).fillna(0).astype(int)
+    return totals
+
+def _ema_dashboard(totals, timetable, current_dt):
+    """
+    Builds the peach_ema_data_pull survey_info, last_data and mean_data frames from the per participant EMA state
+    """
+    import pandas as pd
+
+    #next survey in queue, participants with none left have finished
+    future_surveys = timetable[timetable['survey_send_time'] > current_dt].sort_values('survey_send_time', kind='stable')
+    next_surveys = future_surveys.drop_duplicates('record_id').set_index('record_id')['survey_name']
+    finished = ~totals.index.isin(next_surveys.index)
+    for id in totals.index[finished]:
+        print('skipping ', id, ' - finished course of study')
+    totals = totals[~finished]
+    ids = totals.index
+
+    surveys_sent = (timetable['survey_send_time'] < current_dt).groupby(timetable['record_id']).sum().reindex(ids)
+    surveys_complete_perc = totals['surveys_completed'] / surveys_sent * 100
+    days_enrolled = (current_dt - timetable.groupby('record_id')['survey_send_time'].min()).dt.days.reindex(ids)
+    time_since_last_survey = (current_dt - pd.to_datetime(totals['last_survey_date'])).dt.days
+
+    #Total Averages
+    mean_data = pd.DataFrame({'record_id': ids})
+    for domain in _ema_domains:
+        mean_data[domain.replace('_am', '_mean_am').replace('_pm', '_mean_pm')] = (totals[domain + '_sum'] / totals[domain + '_count']).round(2).to_numpy()
+
+    #Last Scores
+    last_data = totals[['last_survey_date', 'last_survey', 'anxiety_last', 'attention_last', 'stress_last', 'depression_last', 'loneliness_last', 'comment_last']].reset_index()
+
+    survey_info = pd.DataFrame({
+        'record_id': ids,
+        'todays_date': current_dt.round('s'),
+        'last_survey': totals['last_survey'].to_numpy(),
+        'last_survey_date': totals['last_survey_date'].to_numpy(),
+        'next_survey': next_surveys.reindex(ids).to_numpy(),
+        'days_enrolled': days_enrolled.to_numpy(),
+        'surveys_complete_perc': surveys_complete_perc.round(2).to_numpy(),
+        'missed_surveys_flag': (time_since_last_survey >= 7).to_numpy()
+    })
+    return survey_info, last_data, mean_data
+
+def _ema_pull(token, record_id = None, refresh = False, current_dt = None):
+    """
+    Exports the survey timetable and am/pm EMA surveys (of all participants, or just record_id) and returns the
+    melted timetable and per participant EMA state
+    """
+    import pandas as pd
+
+    current_dt = pd.to_datetime('today') if current_dt is None else current_dt
+    survey_timetable = get_orca_data(token, form='survey_timetable', form_complete=False, record_id=record_id, refresh=refresh)
+    ema_am_domains = get_ema_data(token, am_or_pm='am', record_id=record_id, refresh=refresh)
+    ema_pm_domains = get_ema_data(token, am_or_pm='pm', record_id=record_id, refresh=refresh)
+
+    timetable = _ema_timetable(survey_timetable)
+    return timetable, _ema_totals(ema_am_domains, ema_pm_domains, timetable, current_dt)
+#-----------------------
+
+
+#1-----------------------
+def get_all_data(token, record_id = None, timepoint = 'all', fields = None, forms = None, filter_logic = None, refresh = False, chunksize = None, output_path = None, typed = None):
+    """
+    Pulls all data within a redcap project. Any selection passed is applied by REDCap before export.
+    For large projects, pass chunksize or output_path to parse the response as it streams in so that memory stays
+    bounded by the chunk size rather than the project size (streamed exports always come from the api)
+
+    Args:
+        token (str or OrcaClient): The API token for the project, or an OrcaClient holding a pooled connection.
+        record_id (str or list): record id(s) to export. Default is None and will pull all records
+        timepoint (str or list): redcap event name(s) to export. Default is all
+        fields (list): field names to export. Default is None and will pull all fields
+        forms (list): form names to export. Default is None and will pull all forms
+        filter_logic (str): REDCap filter logic applied to the export, e.g. "[visit_notes_4m_complete]=2"
+        refresh (bool): Ignore any cached copy of this export and pull from REDCap. Default is False
+        typed (bool): Parse with the dtypes from the data dictionary (see get_dtype_map). Default is None and uses the client's setting
+        chunksize (int): Number of rows per chunk. If given, returns an iterator of DataFrame chunks. Default is None
+        output_path (str): Write the export straight to this parquet file (all columns as strings) instead of returning it. Default is None
+
+    Returns:
+        pandas.DataFrame: A DataFrame with the retrieved data.
+        iterator of pandas.DataFrame: if chunksize is given
+        str: the parquet file path, if output_path is given
+    """
     data = {
-    'token': token,
     'content': 'record',
     'action': 'export',
     'format': 'csv',
@@ -35,48 +813,53 @@ def get_all_data(token):
     'exportDataAccessGroups': 'false',
     'returnFormat': 'json'
     }
-    r = requests.post(url,data=data)
-    print('HTTP Status: ' + str(r.status_code))
+    data.update(_selection_payload(record_id=record_id, timepoint=timepoint, fields=fields, forms=forms, filter_logic=filter_logic))
+    if output_path is not None:
+        return _write_export_parquet(token, data, output_path, chunksize=chunksize or 50000)
+    if chunksize is not None:
+        return _stream_export(token, data, chunksize)
 
-    df = pd.read_csv(io.StringIO(r.text))
+    df = _export_records(token, data, refresh=refresh, typed=typed)
 
     return df
 #-----------------------
 
 #2-----------------------
 
-def get_orca_data(token, form, raw_v_label = 'raw', timepoint = 'all',form_complete = True):
+def get_orca_data(token, form, raw_v_label = 'raw', timepoint = 'all',form_complete = True, record_id = None, fields = None, refresh = False, typed = None, exclusions = None):
     """
     Retrieve any ORCA form from a REDCap project using the API.
+    Record, event and completion selection is sent to REDCap so only the matching rows are exported.
 
     Args:
-        token (str): The API token for the project.
-        form (str): The name of the REDCap form to retrieve data from.
+        token (str or OrcaClient): The API token for the project, or an OrcaClient holding a pooled connection.
+        form (str or list): The name of the REDCap form(s) to retrieve data from. Several forms are pulled in a single export
         raw_v_label (str): The label for raw data fields (default is 'raw').
-        timepoint(str): The redcap event name for the event you wish to pull. Default is all
+        timepoint(str or list): The redcap event name(s) for the event you wish to pull. Default is all
         form_complete (bool): Indicating whether to return all responses or just ones marked as complete (default is True).
+            With several forms, rows where any of the forms is complete are returned
+        record_id (str or list): the record id(s) you wish to pull (e.g. '218'). Default is None and will pull all records
+        fields (list): Only export these fields of the form instead of the whole form. Default is None
+        refresh (bool): Ignore any cached copy of this export and pull from REDCap. Default is False
+        typed (bool): Parse with the dtypes from the data dictionary (see get_dtype_map). Default is None and uses the client's setting
+        exclusions (dict): cohort exclusion rules (see exclude_records). Default is None and uses default_exclusions. {} keeps every record
 
     Returns:
         pandas.DataFrame: A DataFrame with the retrieved data.
     """
-    import requests
-    import pandas as pd
-    import io
-   
+    forms = [form] if isinstance(form, str) else list(form)
+    complete_fields = [f"{form}_complete" for form in forms]
     if form_complete:
-        record_filter = f"[{form}_complete]=2"
+        record_filter = ' or '.join(f"[{field}]=2" for field in complete_fields)
     else:
-        record_filter = ""
-    
+        record_filter = None
+
     data = {
-    'token': token,
     'content': 'record',
     'action': 'export',
     'format': 'csv',
     'type': 'flat',
     'csvDelimiter': '',
-    'fields[0]': 'record_id',
-    'forms[0]': form,
     'rawOrLabel': raw_v_label,
     'rawOrLabelHeaders': 'raw',
     'exportCheckboxLabel': 'false',
@@ -84,55 +867,51 @@ def get_orca_data(token, form, raw_v_label = 'raw', timepoint = 'all',form_compl
     'exportDataAccessGroups': 'false',
     'returnFormat': 'json'
     }
-    r = requests.post(url,data=data)
-    print('HTTP Status: ' + str(r.status_code))
-
-    df = pd.read_csv(io.StringIO(r.text))
-    df = df[~df['record_id'].str.contains('TEST')]
-    df = df[~df['record_id'].str.contains('test')]
-    df = df[~df['record_id'].str.contains('D')]
-    #df = df[df['record_id'] != '496']
-    df = df[df['record_id'] != '497']
-    df = df[df['record_id'] != '498']
-    df = df[df['record_id'] != '499']
+    if fields is None:
+        export_fields = ['record_id']
+        export_forms = forms
+    else:
+        export_fields = ['record_id'] + list(fields) + (complete_fields if form_complete else [])
+        export_forms = None
+    data.update(_selection_payload(record_id=record_id, timepoint=timepoint, fields=export_fields, forms=export_forms, filter_logic=record_filter))
+    df = _export_records(token, data, refresh=refresh, typed=typed)
+    df = exclude_records(df, exclusions)
 
-    if form_complete:
-        record_filter = f"{form}_complete"
-        df = df[df[record_filter] == 2]
+    complete_fields = [field for field in complete_fields if field in df.columns]
+    if form_complete and raw_v_label == 'raw' and complete_fields:
+        df = df[(df[complete_fields] == 2).any(axis=1)]
 
     if timepoint != 'all':
-        df = df[df['redcap_event_name'] == timepoint]
+        events = [timepoint] if isinstance(timepoint, str) else list(timepoint)
+        df = df[df['redcap_event_name'].isin(events)]
     
     return df
 #-----------------------
 
 #3-----------------------
-def get_orca_field(token, field, raw_v_label = 'raw'):
+def get_orca_field(token, field, raw_v_label = 'raw', timepoint = 'all', record_id = None, refresh = False, typed = None, exclusions = None):
     """
     Retrieve any ORCA field from a REDCap project using the API.
 
     Args:
-        token (str): The API token for the project.
+        token (str or OrcaClient): The API token for the project, or an OrcaClient holding a pooled connection.
         field (str): The name of the REDCap field to retrieve data from.
         raw_v_label (str): The label for raw data fields (default is 'raw').
+        timepoint(str or list): The redcap event name(s) for the event you wish to pull. Default is all
+        record_id (str or list): the record id(s) you wish to pull (e.g. '218'). Default is None and will pull all records
+        refresh (bool): Ignore any cached copy of this export and pull from REDCap. Default is False
+        typed (bool): Parse with the dtypes from the data dictionary (see get_dtype_map). Default is None and uses the client's setting
+        exclusions (dict): cohort exclusion rules (see exclude_records). Default is None and uses default_exclusions. {} keeps every record
 
     Returns:
         pandas.DataFrame: A DataFrame with the retrieved record id, redcap event name and field.
     """
-    import requests
-    import pandas as pd
-    import io
-
-    #!/usr/bin/env python
     data = {
-        'token': token,
         'content': 'record',
         'action': 'export',
         'format': 'csv',
         'type': 'flat',
         'csvDelimiter': '',
-        'fields[0]': 'record_id',
-        'fields[1]': field,
         'rawOrLabel': 'raw',
         'rawOrLabelHeaders': 'raw',
         'exportCheckboxLabel': 'false',
@@ -140,17 +919,9 @@ def get_orca_field(token, field, raw_v_label = 'raw'):
         'exportDataAccessGroups': 'false',
         'returnFormat': 'json'
     }
-    r = requests.post('https://redcap.nyu.edu/api/',data=data)
-    print('HTTP Status: ' + str(r.status_code))
-    
-    df = pd.read_csv(io.StringIO(r.text))
-    df = df[~df['record_id'].str.contains('TEST')]
-    df = df[~df['record_id'].str.contains('test')]
-    df = df[~df['record_id'].str.contains('D')]
-    #df = df[df['record_id'] != '496']
-    df = df[df['record_id'] != '497']
-    df = df[df['record_id'] != '498']
-    df = df[df['record_id'] != '499']
+    data.update(_selection_payload(record_id=record_id, timepoint=timepoint, fields=['record_id', field]))
+    df = _export_records(token, data, refresh=refresh, typed=typed)
+    df = exclude_records(df, exclusions)
 
     col_number = len(df.columns) - 1
     if col_number > 2:
@@ -160,109 +931,54 @@ def get_orca_field(token, field, raw_v_label = 'raw'):
 #-----------------------
 
 #4-----------------------
-def get_task_timestamps(token, record_id = None, transposed = False, timepoint = 'orca_4month_arm_1', mp4_times = False):
+def get_task_timestamps(token, record_id = None, transposed = False, timepoint = 'orca_4month_arm_1', mp4_times = False, visit_notes = None):
     """
     Retrieve task timestamps for a particular ID in real time (EST).
 
     Args:
         token (str): The API token for the project.
         record_id (str): the record id you wish to pull (e.g. '218'). Default is 'none' and will pull the whole dataset
-        transposed: Whether you want it in long format (for just one id) - default is False. Can only mark as True if you also specify a record id
-        timepoint (str): the redcap event name of the timepoint you wish to pull. Default is orca_4month_arm_1
+        transposed: Whether you want it in long format (record_id, marker, timestamp_est) - default is False. Without a record id the whole cohort is returned in long format
+        timepoint (str or list): the redcap event name(s) or alias(es) (e.g. '4m', see timepoints) of the timepoint(s) you wish to pull. Default is orca_4month_arm_1.
+            Several timepoints are pulled in a single export, the field suffixes are dropped and a redcap_event_name column is added
         mp4_times (boolean): whether to return a second data frame with the mp4 fp / break times. Default is False
+        visit_notes (pandas.DataFrame): an already exported visit notes frame covering the timepoint(s). Default is None and will export it
 
     Returns:
         pandas.DataFrame: A DataFrame with the retrieved record id, task marker, timestamp in est.
     """
-    import requests
     import pandas as pd
-    import io
-    import pytz
-
-    if timepoint == 'orca_4month_arm_1':
-        visit_notes = get_orca_data(token, form = "visit_notes_4m", timepoint=timepoint,form_complete=False)
-
-        if record_id != None:
-            visit_notes = visit_notes[visit_notes['record_id'] == record_id]
-            visit_notes.reset_index(drop=True, inplace=True)
-            visit_date = str(visit_notes['visit_date_4m'])
-            visit_date = visit_date.split()[1]
-
-            markers = visit_notes[['richards_start_4m', 'richards_end_4m', 'vpc_start_4m', 'vpc_end_4m','srt_start_4m', 'srt_end_4m', 'cecile_start_4m', 'cecile_end_4m','relational_memory_start_4m', 'relational_memory_end_4m', 'notoy_start_real_4m','notoy_end_real_4m', 'toy_start_real_4m', 'toy_end_real_4m', 'fp_nt_break_start_real_4m', 'fp_nt_break_end_real_4m', 'fp_t_break_start_real_4m', 'fp_t_break_end_real_4m']]
-        else:
-            markers = visit_notes[['record_id', 'richards_start_4m', 'richards_end_4m', 'vpc_start_4m', 'vpc_end_4m','srt_start_4m', 'srt_end_4m', 'cecile_start_4m', 'cecile_end_4m','relational_memory_start_4m', 'relational_memory_end_4m', 'notoy_start_real_4m','notoy_end_real_4m', 'toy_start_real_4m', 'toy_end_real_4m',  'fp_nt_break_start_real_4m', 'fp_nt_break_end_real_4m', 'fp_t_break_start_real_4m', 'fp_t_break_end_real_4m']]
-
-        if transposed == True and record_id != None:
-            markers = markers.transpose()
-            markers = markers.rename_axis('marker').reset_index()
-            markers.columns = ['marker', 'timestamp_est']
-            markers['record_id'] = record_id
-            markers['timestamp_est'] = pd.to_datetime(visit_date + ' ' + markers['timestamp_est'])
-            markers = markers[['record_id', 'marker', 'timestamp_est']]
-            markers['timestamp_est'] = markers['timestamp_est'].dt.tz_localize('America/New_York')  
-
-        elif transposed == True and record_id == None:
-            print('cannot transpose without selecting a record id')
-
-        if mp4_times == True and record_id != None:
-            mp4_markers = visit_notes[['notoy_start_4m', 'notoy_end_4m', 'toy_start_4m', 'toy_end_4m', 'fp_nt_break_start_4m', 'fp_nt_break_end_4m', 'fp_t_break_start_4m', 'fp_t_break_end_4m']]
-            if transposed == True:
-                mp4_markers = mp4_markers.transpose()
-                mp4_markers = mp4_markers.rename_axis('marker').reset_index()
-                mp4_markers.columns = ['marker', 'timestamp_mp4']
-                mp4_markers['record_id'] = record_id
-                mp4_markers = mp4_markers[['record_id', 'marker', 'timestamp_mp4']]
-
-        elif mp4_times == True and record_id is None:
-            mp4_markers = visit_notes[['record_id', 'notoy_start_4m', 'notoy_end_4m', 'toy_start_4m', 'toy_end_4m', 'fp_nt_break_start_4m', 'fp_nt_break_end_4m', 'fp_t_break_start_4m', 'fp_t_break_end_4m']]
-    
-    elif timepoint == 'orca_8month_arm_1':
-        visit_notes = get_orca_data(token, form="visit_notes_8m", timepoint=timepoint,form_complete=False)
-
-        if record_id != None:
-            visit_notes = visit_notes[visit_notes['record_id'] == record_id]
-            visit_notes.reset_index(drop=True, inplace=True)
-            visit_date = str(visit_notes['visit_date_8m'])
-            visit_date = visit_date.split()[1]
-
-            markers = visit_notes[['richards_start_8m', 'richards_end_8m', 'vpc_start_8m', 'vpc_end_8m','srt_start_8m', 'srt_end_8m', 'pa_start_8m', 'pa_end_8m', 'social_start_8m', 'social_end_8m', 'relational_memory_start_8m', 'relational_memory_end_8m','cecile_start_8m', 'cecile_end_8m', 'notoy_start_real_8m','notoy_end_real_8m', 'toy_start_real_8m', 'toy_end_real_8m']]
-        else:
-            markers = visit_notes[['record_id','richards_start_8m', 'richards_end_8m', 'vpc_start_8m', 'vpc_end_8m','srt_start_8m', 'srt_end_8m', 'pa_start_8m', 'pa_end_8m','social_start_8m', 'social_end_8m', 'relational_memory_start_8m', 'relational_memory_end_8m','cecile_start_8m', 'cecile_end_8m', 'notoy_start_real_8m','notoy_end_real_8m', 'toy_start_real_8m', 'toy_end_real_8m']]
-        
-        if transposed == True and record_id != None:
-            markers = markers.transpose()
-            markers = markers.rename_axis('marker').reset_index()
-            markers.columns = ['marker', 'timestamp_est']
-            markers['record_id'] = record_id
-            markers['timestamp_est'] = pd.to_datetime(visit_date + ' ' + markers['timestamp_est'])
-            markers = markers[['record_id', 'marker', 'timestamp_est']]
-            markers['timestamp_est'] = markers['timestamp_est'].dt.tz_localize('America/New_York')  
-        elif transposed == True and record_id == None:
-            print('cannot transpose without selecting a record id')
-
-    elif timepoint == 'orca_12month_arm_1':
-        visit_notes = get_orca_data(token, form="visit_notes_12m", timepoint=timepoint,form_complete=False)
 
-        if record_id != None:
-            visit_notes = visit_notes[visit_notes['record_id'] == record_id]
-            visit_notes.reset_index(drop=True, inplace=True)
-            visit_date = str(visit_notes['visit_date_12m'])
-            visit_date = visit_date.split()[1]
-
-            markers = visit_notes[['richards_start_12m', 'richards_end_12m', 'gap_start_12m', 'gap_end_12m','srt_start_12m', 'srt_end_12m', 'pa_start_12m', 'pa_end_12m', 'vpc_start_12m', 'vpc_end_12m', 'relational_memory_start_12m', 'relational_memory_end_12m','cecile_start_12m', 'cecile_end_12m', 'notoy_start_real_12m','notoy_end_real_12m', 'toy_start_real_12m', 'toy_end_real_12m']]
-        else:
-            markers = visit_notes[['record_id','richards_start_12m', 'richards_end_12m', 'gap_start_12m', 'gap_end_12m','srt_start_12m', 'srt_end_12m', 'pa_start_12m', 'pa_end_12m', 'vpc_start_12m', 'vpc_end_12m', 'relational_memory_start_12m', 'relational_memory_end_12m','cecile_start_12m', 'cecile_end_12m', 'notoy_start_real_12m','notoy_end_real_12m', 'toy_start_real_12m', 'toy_end_real_12m']]
-        
-        if transposed == True and record_id != None:
-            markers = markers.transpose()
-            markers = markers.rename_axis('marker').reset_index()
-            markers.columns = ['marker', 'timestamp_est']
-            markers['record_id'] = record_id
-            markers['timestamp_est'] = pd.to_datetime(visit_date + ' ' + markers['timestamp_est'])
-            markers = markers[['record_id', 'marker', 'timestamp_est']]
-            markers['timestamp_est'] = markers['timestamp_est'].dt.tz_localize('America/New_York')  
-        elif transposed == True and record_id == None:
-            print('cannot transpose without selecting a record id')
+    events = _resolve_timepoints(timepoint)
+    multi = not isinstance(timepoint, str)
+    if visit_notes is None:
+        visit_notes = _timepoint_export(token, events, record_id)
+    visit_notes = _select_record(visit_notes, record_id)
+
+    marker_names = lambda info: [f"{task}_{end}" for task in info['tasks'] for end in ('start', 'end')] + info['freeplay_markers']
+    mp4_names = lambda info: info['mp4_markers']
+
+    if transposed == True:
+        #every participant is melted at once; the visit date is joined on and combined with the marker times in one pass
+        id_columns = ['record_id', 'redcap_event_name'] if multi else ['record_id']
+        markers = _timepoint_table(visit_notes, events, marker_names, True, long=('marker', 'timestamp_est'))
+        dates = _timepoint_table(visit_notes, events, lambda info: ['visit_date'], True)
+        markers = markers.merge(dates, on=['record_id', 'redcap_event_name'], how='left')
+        if not multi:
+            markers['marker'] = _timepoint_fields(events[0], markers['marker'])
+        markers['timestamp_est'] = _combine_datetime(markers['visit_date'], markers['timestamp_est'])
+        markers = markers[id_columns + ['marker', 'timestamp_est']].sort_values('record_id', kind='stable', ignore_index=True)
+        if mp4_times:
+            mp4_markers = _timepoint_table(visit_notes, events, mp4_names, multi, long=('marker', 'timestamp_mp4'))
+            mp4_markers = mp4_markers.sort_values('record_id', kind='stable', ignore_index=True)
+    else:
+        markers = _timepoint_table(visit_notes, events, marker_names, multi)
+        if mp4_times:
+            mp4_markers = _timepoint_table(visit_notes, events, mp4_names, multi)
+        if record_id != None and not multi:
+            markers = markers.drop(columns='record_id')
+            if mp4_times:
+                mp4_markers = mp4_markers.drop(columns='record_id')
 
     if mp4_times:
         return markers, mp4_markers
@@ -272,7 +988,7 @@ def get_task_timestamps(token, record_id = None, transposed = False, timepoint =
 #-----------------------
 
 #5-----------------------
-def get_task_data(token, record_id = None, transposed = False, timepoint='orca_4month_arm_1'):
+def get_task_data(token, record_id = None, transposed = False, timepoint='orca_4month_arm_1', visit_notes = None):
     """
     Retrieve task data existence status for a particular ID/all ids.
 
@@ -280,65 +996,38 @@ def get_task_data(token, record_id = None, transposed = False, timepoint='orca_4
         token (str): The API token for the project.
         record_id (str): the record id you wish to pull (e.g. '218'). Default is 'none' and will pull the whole dataset
         transposed: Whether you want it in long format (for just one id) - default is False. Can only mark as True if you also specify a record id
-        timepoint (str): the redcap event name of the timepoint you wish to pull. Default is orca_4month_arm_1
+        timepoint (str or list): the redcap event name(s) or alias(es) of the timepoint(s) you wish to pull (see get_task_timestamps). Default is orca_4month_arm_1
+        visit_notes (pandas.DataFrame): an already exported visit notes frame covering the timepoint(s). Default is None and will export it
     Returns:
         pandas.DataFrame: A DataFrame with the retrieved record id, task marker, timestamp in est.
     """
-    import requests
-    import pandas as pd
-    import io
+    events = _resolve_timepoints(timepoint)
+    multi = not isinstance(timepoint, str)
+    if visit_notes is None:
+        visit_notes = _timepoint_export(token, events, record_id)
+    visit_notes = _select_record(visit_notes, record_id)
 
-    if timepoint == 'orca_4month_arm_1':
-        visit_notes = get_orca_data(token, form = "visit_notes_4m", form_complete=False, timepoint=timepoint)
-
-        if record_id != None:
-            visit_notes = visit_notes[visit_notes['record_id'] == record_id]
-            visit_notes.reset_index(drop=True, inplace=True)
-            data_existence = visit_notes.loc[:,'richards_ecg_cg_data_4m':'fp_video_data_4m']
-        else:
-            record_ids = visit_notes['record_id']
-            data_existence1 = visit_notes.loc[:,'richards_ecg_cg_data_4m':'fp_video_data_4m']
-            data_existence = pd.concat([record_ids, data_existence1], ignore_index=True)
-            data_existence = data_existence.rename(columns={data_existence.columns[0]: 'record_id'})
-    elif timepoint == 'orca_8month_arm_1':
-        visit_notes = get_orca_data(token, form = "visit_notes_8m", form_complete=False, timepoint=timepoint)
-
-        if record_id != None:
-            visit_notes = visit_notes[visit_notes['record_id'] == record_id]
-            visit_notes.reset_index(drop=True, inplace=True)
-            data_existence = visit_notes.loc[:,'richards_ecg_cg_data_8m':'fp_video_data_8m']
-        else:
-            record_ids = visit_notes['record_id']
-            data_existence1 = visit_notes.loc[:,'richards_ecg_cg_data_8m':'fp_video_data_8m']
-            data_existence = pd.concat([record_ids, data_existence1], ignore_index=True)
-            data_existence = data_existence.rename(columns={data_existence.columns[0]: 'record_id'})
-    elif timepoint == 'orca_12month_arm_1':
-        visit_notes = get_orca_data(token, form = "visit_notes_12m", form_complete=False, timepoint=timepoint)
-
-        if record_id != None:
-            visit_notes = visit_notes[visit_notes['record_id'] == record_id]
-            visit_notes.reset_index(drop=True, inplace=True)
-            data_existence = visit_notes.loc[:,'richards_ecg_cg_data_12m':'fp_video_data_12m']
-        else:
-            record_ids = visit_notes['record_id']
-            data_existence1 = visit_notes.loc[:,'richards_ecg_cg_data_12m':'fp_video_data_12m']
-            data_existence = pd.concat([record_ids, data_existence1], ignore_index=True)
-            data_existence = data_existence.rename(columns={data_existence.columns[0]: 'record_id'})
+    def data_fields(info):
+        #the data presence fields are the form's columns between the first and last, in export order
+        first, last = [f"{info['prefix']}{name}_{info['suffix']}" for name in info['data_range']]
+        columns = list(visit_notes.loc[:, first:last].columns)
+        return [column[len(info['prefix']):-len(info['suffix']) - 1] for column in columns]
 
+    events = [event for event in events if timepoints[event]['data_range']]
     if transposed == True and record_id != None:
-        data_existence = data_existence.transpose()
-        data_existence = data_existence.rename_axis('task_data').reset_index()
-        data_existence.columns = ['task_data', 'present']
-        data_existence['record_id'] = record_id
-        data_existence = data_existence[['record_id', 'task_data', 'present']]
-    elif transposed == True and record_id == None:
-        print('cannot transpose without selecting a record id')
-    
+        data_existence = _timepoint_table(visit_notes, events, data_fields, multi, long=('task_data', 'present'))
+    else:
+        if transposed == True:
+            print('cannot transpose without selecting a record id')
+        data_existence = _timepoint_table(visit_notes, events, data_fields, multi)
+        if record_id != None and not multi:
+            data_existence = data_existence.drop(columns='record_id')
+
     return data_existence
 #-----------------------
 
 #6-----------------------
-def get_task_completion(token, record_id = None, transposed = False, timepoint='orca_4month_arm_1'):
+def get_task_completion(token, record_id = None, transposed = False, timepoint='orca_4month_arm_1', visit_notes = None):
     """
     Retrieve task data existence status for a particular ID/all ids.
 
@@ -346,62 +1035,31 @@ def get_task_completion(token, record_id = None, transposed = False, timepoint='
         token (str): The API token for the project.
         record_id (str): the record id you wish to pull (e.g. '218'). Default is 'none' and will pull the whole dataset
         transposed: Whether you want it in long format (for just one id) - default is False. Can only mark as True if you also specify a record id
-        timepoint (str): the redcap event name of the timepoint you wish to pull. Default is orca_4month_arm_1
+        timepoint (str or list): the redcap event name(s) or alias(es) of the timepoint(s) you wish to pull (see get_task_timestamps). Default is orca_4month_arm_1
+        visit_notes (pandas.DataFrame): an already exported visit notes frame covering the timepoint(s). Default is None and will export it
     Returns:
         pandas.DataFrame: A DataFrame with the retrieved record id, task, completion status and reason why it's not fully complete.
     """
-    import requests
-    import pandas as pd
-    import io
-
-    if timepoint == 'orca_4month_arm_1':
-        visit_notes = get_orca_data(token, form = "visit_notes_4m", form_complete=False, timepoint=timepoint)
-
-        if record_id != None:
-            visit_notes = visit_notes[visit_notes['record_id'] == record_id]
-            visit_notes.reset_index(drop=True, inplace=True)
-            task_comp = visit_notes[['richards_comp_4m', 'vpc_comp_4m', 'srt_comp_4m', 'cecile_comp_4m', 'relational_memory_comp_4m', 'freeplay_comp_4m']]
-            whys = visit_notes[['richards_why_4m', 'vpc_why_4m', 'srt_why_4m', 'cecile_why_4m', 'relational_memory_why_4m', 'freeplay_why_4m']]
-        else:
-            task_comp = visit_notes[['record_id','richards_comp_4m', 'richards_why_4m','vpc_comp_4m','vpc_why_4m', 'srt_comp_4m', 'srt_why_4m','cecile_comp_4m', 'cecile_why_4m','relational_memory_comp_4m', 'relational_memory_why_4m','freeplay_comp_4m', 'freeplay_why_4m']]
-    elif timepoint == 'orca_8month_arm_1':
-        visit_notes = get_orca_data(token, form = "visit_notes_8m", form_complete=False, timepoint=timepoint)
-
-        if record_id != None:
-            visit_notes = visit_notes[visit_notes['record_id'] == record_id]
-            visit_notes.reset_index(drop=True, inplace=True)
-            task_comp = visit_notes[['richards_comp_8m', 'vpc_comp_8m', 'srt_comp_8m', 'pa_comp_8m', 'social_comp_8m', 'relational_memory_comp_8m', 'cecile_comp_8m', 'freeplay_comp_8m']]
-            whys = visit_notes[['richards_why_8m', 'vpc_why_8m', 'srt_why_8m', 'pa_why_8m', 'social_why_8m', 'relational_memory_why_8m', 'cecile_why_8m', 'freeplay_why_8m']]
-        else:
-            task_comp = visit_notes[['record_id','richards_comp_8m', 'richards_why_8m','vpc_comp_8m','vpc_why_8m', 'srt_comp_8m', 'srt_why_8m','pa_comp_8m', 'pa_why_8m', 'social_comp_8m', 'social_why_8m', 'relational_memory_comp_8m', 'relational_memory_why_8m','cecile_comp_8m', 'cecile_why_8m','freeplay_comp_8m', 'freeplay_why_8m']]
-    elif timepoint == 'orca_12month_arm_1':
-        visit_notes = get_orca_data(token, form = "visit_notes_12m", form_complete=False, timepoint=timepoint)
-
-        if record_id != None:
-            visit_notes = visit_notes[visit_notes['record_id'] == record_id]
-            visit_notes.reset_index(drop=True, inplace=True)
-            task_comp = visit_notes[['richards_comp_12m','gap_comp_12m', 'srt_comp_12m', 'pa_comp_12m', 'vpc_comp_12m', 'relational_memory_comp_12m', 'cecile_comp_12m', 'freeplay_comp_12m']]
-            whys = visit_notes[['richards_why_12m', 'gap_why_12m', 'srt_why_12m', 'pa_why_12m', 'vpc_why_12m', 'relational_memory_why_12m', 'cecile_why_12m', 'freeplay_why_12m']]
-        else:
-            task_comp = visit_notes[['record_id','richards_comp_12m', 'richards_why_12m','gap_comp_12m','gap_why_12m', 'srt_comp_12m', 'srt_why_12m','pa_comp_12m', 'pa_why_12m', 'vpc_comp_12m', 'vpc_why_12m', 'relational_memory_comp_12m', 'relational_memory_why_12m','cecile_comp_12m', 'cecile_why_12m','freeplay_comp_12m', 'freeplay_why_12m']]
+    events = _resolve_timepoints(timepoint)
+    multi = not isinstance(timepoint, str)
+    if visit_notes is None:
+        visit_notes = _timepoint_export(token, events, record_id)
+    visit_notes = _select_record(visit_notes, record_id)
 
     if transposed == True and record_id != None:
-        task_comp = task_comp.transpose()
-        task_comp = task_comp.rename_axis('task').reset_index()
-        task_comp.columns = ['task', 'completion_status']
-        whys = whys.transpose()
-        whys = whys.rename_axis('task').reset_index()
-        whys.columns = ['task', 'incomplete_reason']
-        whys = whys.drop(columns = ['task'])
-
-        task_comp = pd.concat([task_comp, whys], axis=1)
-        task_comp['record_id'] = record_id
-        task_comp = task_comp[['record_id', 'task', 'completion_status', 'incomplete_reason']]
-    elif transposed == True and record_id == None:
-        print('cannot transpose without selecting a record id')
-
-    task_comp['completion_status'] = task_comp['completion_status'].astype('Int64')
-    task_comp['incomplete_reason'] = task_comp['incomplete_reason'].astype('Int64')
+        task_comp = _timepoint_table(visit_notes, events, lambda info: [f"{task}_comp" for task in info['completion_tasks']], multi, long=('task', 'completion_status'))
+        whys = _timepoint_table(visit_notes, events, lambda info: [f"{task}_why" for task in info['completion_tasks']], multi, long=('task', 'incomplete_reason'))
+        task_comp['incomplete_reason'] = whys['incomplete_reason']
+        status_columns = ['completion_status', 'incomplete_reason']
+    else:
+        if transposed == True:
+            print('cannot transpose without selecting a record id')
+        task_comp = _timepoint_table(visit_notes, events, lambda info: [f"{task}_{status}" for task in info['completion_tasks'] for status in ('comp', 'why')], multi)
+        if record_id != None and not multi:
+            task_comp = task_comp.drop(columns='record_id')
+        status_columns = [column for column in task_comp.columns if column not in ('record_id', 'redcap_event_name')]
+
+    task_comp[status_columns] = task_comp[status_columns].astype('Int64')
     return task_comp
 #-----------------------
 
@@ -409,33 +1067,31 @@ def get_task_completion(token, record_id = None, transposed = False, timepoint='
 def get_task_info(token, record_id = None, transposed = False, timepoint='orca_4month_arm_1', mp4_times = False):
     """
     Retrieves 3 data frames - task timestamps, completion status, and data presence for all ids or a particular id.
-    Returns in order of: task_completion, task_data, task_timestamps
+    Returns in order of: task_completion, task_data, task_timestamps. The visit notes are exported once and shared by all three
 
     Args:
         token (str): The API token for the project.
         record_id (str): the record id you wish to pull (e.g. '218'). Default is 'none' and will pull the whole dataset
         transposed: Whether you want it in long format (for just one id) - default is False. Can only mark as True if you also specify a record id
-        timepoint (str): the redcap event name of the timepoint you wish to pull. Default is orca_4month_arm_1
+        timepoint (str or list): the redcap event name(s) or alias(es) of the timepoint(s) you wish to pull (see get_task_timestamps). Default is orca_4month_arm_1
         mp4_times (Boolean): whether to return mp4 times in the get_task_timestamps
 
     Returns:
-        pandas.DataFrame: 3 DataFrames (runs get_task_completion, get_task_timestamps,get_task_data).
+        pandas.DataFrame: 3 DataFrames (runs get_task_completion, get_task_timestamps,get_task_data), and the mp4 timestamps as a 4th if mp4_times is True.
 
     """
-    import requests
-    import pandas as pd
-    import io
+    visit_notes = _timepoint_export(token, _resolve_timepoints(timepoint), record_id)
 
-    task_completion = get_task_completion(token, record_id, transposed, timepoint)
+    task_completion = get_task_completion(token, record_id, transposed, timepoint, visit_notes=visit_notes)
 
-    if mp4_times and timepoint == 'orca_4month_arm_1':
-        task_timestamps, mp4_fp_timestamps = get_task_timestamps(token, record_id, transposed, timepoint, mp4_times)
+    if mp4_times:
+        task_timestamps, mp4_fp_timestamps = get_task_timestamps(token, record_id, transposed, timepoint, mp4_times, visit_notes=visit_notes)
     else:
-        task_timestamps = get_task_timestamps(token, record_id, transposed, timepoint, mp4_times)
+        task_timestamps = get_task_timestamps(token, record_id, transposed, timepoint, mp4_times, visit_notes=visit_notes)
 
-    task_data = get_task_data(token, record_id, transposed, timepoint)
+    task_data = get_task_data(token, record_id, transposed, timepoint, visit_notes=visit_notes)
 
-    if mp4_times and timepoint == 'orca_4month_arm_1':
+    if mp4_times:
         return task_completion, task_data, task_timestamps, mp4_fp_timestamps
     else:
         return task_completion, task_data, task_timestamps
@@ -444,7 +1100,7 @@ def get_task_info(token, record_id = None, transposed = False, timepoint='orca_4
 #8-----------------------
 def get_movesense_numbers(token, record_id = None, timepoint = 'orca_4month_arm_1'):
     """
-    Pulls child and caregiver movesense device numbers for a given timepoint.
+    Pulls child and caregiver movesense device numbers for a given timepoint (see get_movesense_info).
     Args:
         token (str): The API token for the project.
         record_id (str): the record id you wish to pull (e.g. '218'). Default is 'none' and will pull the whole dataset
@@ -452,37 +1108,25 @@ def get_movesense_numbers(token, record_id = None, timepoint = 'orca_4month_arm_
     Returns:
         pandas.DataFrame: A DataFrame with record id, child device number and caregiver device number. If a single record id is specified, will return cg device number first, then child
     """
-    import requests
     import pandas as pd
-    import io
     import numpy as np
 
-    if 'orca' in timepoint or 'mice_8month' in timepoint or 'mice_12month' in timepoint:
-        form_name = "visit_notes_" + timepoint[5:8] if '12' in timepoint else "visit_notes_" + timepoint[5:7]
-    elif 'mice_4month' in timepoint:
-        form_name = 'mice_visit_notes_4m'
-
-    visit_notes = get_orca_data(token, form=form_name, form_complete=False, timepoint=timepoint)
-    child_column_name = [col for col in visit_notes.columns if 'hr_device_child' in col][0]
-    parent_column_name = [col for col in visit_notes.columns if 'hr_device_cg' in col][0]
+    movesense = get_movesense_info(token, timepoint=timepoint, record_id=record_id)
+    parent_column_name, child_column_name = _timepoint_fields(_resolve_timepoints(timepoint)[0], ['hr_device_cg', 'hr_device_child'])
 
     if record_id != None:
-        visit_notes = visit_notes[visit_notes['record_id'] == record_id]
-        visit_notes.reset_index(drop=True, inplace=True)
-        child_number = str(int(visit_notes[child_column_name].iloc[0])) if not visit_notes[child_column_name].empty else np.nan
-        parent_number = str(int(visit_notes[parent_column_name].iloc[0])) if not visit_notes[parent_column_name].empty else np.nan
+        parent_number = str(movesense['cg_device'].iloc[0]) if not movesense.empty and pd.notna(movesense['cg_device'].iloc[0]) else np.nan
+        child_number = str(movesense['child_device'].iloc[0]) if not movesense.empty and pd.notna(movesense['child_device'].iloc[0]) else np.nan
         return parent_number, child_number
     else:
-        visit_notes = visit_notes[['record_id', parent_column_name, child_column_name]]
-        visit_notes[parent_column_name] = visit_notes[parent_column_name].astype('Int64')
-        visit_notes[child_column_name] = visit_notes[child_column_name].astype('Int64')
-        return visit_notes
+        return movesense[['record_id', 'cg_device', 'child_device']].rename(columns={'cg_device': parent_column_name, 'child_device': child_column_name})
 #-----------------------
 
 #9-----------------------
 def check_timestamps(token, record_id, timepoint='orca_4month_arm_1'):
     """
     Pulls task info, and checks to see if there's any incorrectly missing timestamps.
+    Runs the timestamps checks of check_visit_notes on a single export; use check_visit_notes directly for the whole cohort.
 
     Args:
         token (str): The API token for the project.
@@ -490,55 +1134,13 @@ def check_timestamps(token, record_id, timepoint='orca_4month_arm_1'):
         timepoint (str): the redcap event name of the timepoint you wish to pull. Default is orca_4month_arm_1
 
     Returns:
-        pandas.DataFrame: A character vector with the tasks that have incorrect/missing timestamps
+        list: A character vector with the tasks that have incorrect/missing timestamps
 
     """
-    import requests
-    import pandas as pd
-    import io
-    comp, data, timestamps = get_task_info(token, record_id=record_id, transposed=True, timepoint=timepoint)
-
-    missing_timestamps = []
-    #richards
-    if data.iloc[0,2] < 4 or data.iloc[1,2] < 4:
-        if pd.isna(timestamps.iloc[0, 2]) or pd.isna(timestamps.iloc[1, 2]):
-            missing_timestamps.append('richards')
-    #vpc
-    if data.iloc[3,2] < 4 or data.iloc[4,2] < 4:
-        if pd.isna(timestamps.iloc[2, 2]) or pd.isna(timestamps.iloc[3, 2]):
-            missing_timestamps.append('vpc')
-    #srt
-    if data.iloc[6,2] < 4 or data.iloc[7,2] < 4:
-        if pd.isna(timestamps.iloc[4, 2]) or pd.isna(timestamps.iloc[5, 2]):
-            missing_timestamps.append('srt')
-    #cecile
-    if data.iloc[9,2] < 4 or data.iloc[10,2] < 4:
-        if pd.isna(timestamps.iloc[6, 2]) or pd.isna(timestamps.iloc[7, 2]):
-            missing_timestamps.append('cecile')
-    #relational memory
-    if data.iloc[12,2] < 4 or data.iloc[13,2] < 4:
-        if pd.isna(timestamps.iloc[8, 2]) or pd.isna(timestamps.iloc[9, 2]):
-            missing_timestamps.append('relational_memory')
-    
-    #freeplay
-    visit_notes = get_orca_data(token, form = "visit_notes_4m", form_complete=False)
-    visit_notes = visit_notes[visit_notes['record_id'] == record_id]
-    visit_notes.reset_index(drop=True, inplace=True)
-    no_toy = visit_notes['freeplay_conditions_4m___1'].iloc[0]
-    toy = visit_notes['freeplay_conditions_4m___2'].iloc[0]
-
-    #freeplay
-    if data.iloc[15,2] < 4 or data.iloc[16,2] < 4:
-        if no_toy == 1 and toy == 1:
-            if pd.isna(timestamps.iloc[10, 2]) or pd.isna(timestamps.iloc[11, 2]) or pd.isna(timestamps.iloc[12, 2]) or pd.isna(timestamps.iloc[13, 2]):
-                missing_timestamps.append('freeplay')
-        elif no_toy == 1 and toy != 1:
-            if pd.isna(timestamps.iloc[10, 2]) or pd.isna(timestamps.iloc[11, 2]):
-                missing_timestamps.append('notoy_freeplay')
-        elif no_toy != 1 and toy == 1:
-            if pd.isna(timestamps.iloc[12, 2]) or pd.isna(timestamps.iloc[13, 2]):
-                missing_timestamps.append('toy_freeplay')
+    visit_notes = _timepoint_export(token, _resolve_timepoints(timepoint), record_id)
+    issues = check_visit_notes(_select_record(visit_notes, record_id), timepoint, checks=['timestamps'])
 
+    missing_timestamps = list(dict.fromkeys(issues['task']))
     return missing_timestamps
 #-----------------------
 
@@ -546,6 +1148,7 @@ def check_timestamps(token, record_id, timepoint='orca_4month_arm_1'):
 def get_movesense_times(token, record_id, who, timepoint='orca_4month_arm_1'):
     """
     Pulls test recording times for each movesense device in order parent, child.
+    For several participants, get_movesense_info returns every record's times from one export.
 
     Args:
         token (str): The API token for the project.
@@ -557,235 +1160,1071 @@ def get_movesense_times(token, record_id, who, timepoint='orca_4month_arm_1'):
         a character vector with the on time followed by off time
 
     """
-    import requests
     import pandas as pd
-    import io
-    from datetime import datetime
-    import numpy as np
-    import pytz
-
-    timepoint_pre = timepoint[5:8] if '12' in timepoint else timepoint[5:7]
-    form_name = "visit_notes_" + timepoint_pre
-    visit_notes = get_orca_data(token, form=form_name, form_complete=False, timepoint=timepoint)
-    child_on = [col for col in visit_notes.columns if 'child_movesense_on' in col][0]
-    child_off = [col for col in visit_notes.columns if 'child_movesense_off' in col][0]
-    parent_on = [col for col in visit_notes.columns if 'cg_movesense_on' in col][0]
-    parent_off = [col for col in visit_notes.columns if 'cg_movesense_off' in col][0]
 
-    movesense_times = visit_notes[['record_id', parent_on,child_on, parent_off, child_off]]
-    movesense_times = movesense_times[movesense_times['record_id'] == record_id].reset_index(drop=True)
+    movesense = get_movesense_info(token, timepoint=timepoint, record_id=record_id)
 
-    date = get_orca_field(token, field = "visit_date_"+timepoint_pre)
-    date = date[date['record_id'] == record_id]
-    date = date[date['redcap_event_name'] == timepoint]
-    date = str(date["visit_date_"+timepoint_pre])
-    date = date.split()[1]
-
-    if who == 'cg':
-        on_time = str(movesense_times[parent_on]).split()[1]
-        off_time = str(movesense_times[parent_off]).split()[1]
-    elif who == 'child':
-        on_time = str(movesense_times[child_on]).split()[1]
-        off_time = str(movesense_times[child_off]).split()[1]
-
-    on_time = pd.to_datetime(date+ ' ' + on_time) if on_time != 'NaN' else np.nan
-    off_time = pd.to_datetime(date+ ' ' + off_time) if off_time != 'NaN' else np.nan
-
-    on_time = pytz.timezone('America/New_York').localize(on_time) if pd.notna(on_time) else pd.NaT
-    off_time = pytz.timezone('America/New_York').localize(off_time) if pd.notna(off_time) else pd.NaT
+    on_time = movesense[f'{who}_on'].iloc[0] if not movesense.empty else pd.NaT
+    off_time = movesense[f'{who}_off'].iloc[0] if not movesense.empty else pd.NaT
 
     return on_time, off_time
 #-----------------------
 
 #11-----------------------
-def get_visit_datetime(token, record_id = None, merged = True, timepoint = 'orca_4month_arm_1'):
+def get_visit_datetime(token, record_id = None, merged = True, timepoint = 'orca_4month_arm_1', visit_notes = None, refresh = False):
     """
-    Pulls the visit start date time for all ids / a specified ID
+    Pulls the visit start date time for all ids / a specified ID.
+    Served from get_visit_datetimes, so every arm is pulled once per session and per-ID calls don't make new API calls
 
     Args:
         token (str): The API token for the project.
         record_id (str): record_id you want to specify. Default is None and will pull all IDs
         merged (bool): Whether to return the merged datetime or date and time as separate columns. Default is True
-        timepoint (str): the redcap event name of the timepoint you wish to pull. Default is orca_4month_arm_1
+        timepoint (str or list): the redcap event name(s) or alias(es) of the timepoint(s) you wish to pull (see get_task_timestamps). Default is orca_4month_arm_1
+        visit_notes (pandas.DataFrame): an already exported visit notes frame covering the timepoint(s). Default is None and uses get_visit_datetimes
+        refresh (bool): Pull the visit date times from REDCap again instead of using the copy held in memory. Default is False
 
     Returns:
         pandas.DataFrame: if record_id = None or merged = False containing record_id, date, time, datetime
-        datetime value: a tz-conscious datetime variable representing the start of the visit, if record_id != None and merged = True
+        datetime value: a tz-conscious datetime variable representing the start of the visit, if record_id != None and merged = True.
+            With several timepoints, a Series of them indexed by redcap event name
     """
-    import requests
     import pandas as pd
+
+    events = _resolve_timepoints(timepoint)
+    multi = not isinstance(timepoint, str)
+    if visit_notes is None:
+        table, lookup = get_visit_datetimes(token, refresh=refresh)
+        if record_id != None and merged == True and not multi and isinstance(record_id, str):
+            return lookup.get((record_id, events[0]), pd.NaT)
+    else:
+        table = _visit_datetime_table(visit_notes, events)
+
+    data = _select_record(table[table['redcap_event_name'].isin(events)], record_id).reset_index(drop=True)
+    data['visit_time'] = (pd.Timestamp(0) + data['visit_time']).dt.time
+    if merged == False:
+        data = data.drop(columns='visit_datetime')
+    elif record_id != None:
+        if multi:
+            return data.set_index('redcap_event_name')['visit_datetime']
+        return data['visit_datetime'].iloc[0]
+
+    if not multi:
+        data = data.drop(columns='redcap_event_name')
+        data.columns = ['record_id'] + _timepoint_fields(events[0], list(data.columns[1:]))
+    return data
+
+#-----------------------
+
+#12-----------------------
+def import_data(token, data, confirm = True, batch_size = 100, max_workers = 4, retries = 3):
+    """
+    Imports pandas dataframe into redcap. Existing values are checked for conflicts first (only the records,
+    events and fields being imported are exported for the check, see find_conflicts), then the data is imported in concurrent batches
+
+    Args:
+        token (str or OrcaClient): The API token for the project, or an OrcaClient holding a pooled connection.
+        data (pandas.DataFrame): Data you want to import. Column names must be same as field names in codebook. redcap event name must be included.
+        confirm (bool): Whether to ask for confirmation (y/n) after the conflict check. Default is True
+        batch_size (int): Number of records sent per import request. Default is 100
+        max_workers (int): Maximum number of batches sent at the same time. Default is 4
+        retries (int): Number of times a failed batch is retried. Default is 3
+
+    Returns:
+        pandas.DataFrame: one row per import batch (see import_records), or None if the import was terminated
+    """
+    import pandas as pd
+
+    unique_events = data['redcap_event_name'].unique()
+    record_ids = data['record_id'].astype(str).unique()
+    fields = list(dict.fromkeys(col.split('___')[0] for col in data.columns if col not in ['record_id', 'redcap_event_name']))
+    all = get_all_data(token, record_id=list(record_ids), timepoint=list(unique_events), fields=['record_id'] + fields, refresh=True)
+
+    conflicts = find_conflicts(all[all['redcap_event_name'].isin(unique_events)], data)
+
+    if len(conflicts) >= 1:
+        print('\n','conflicts found for fields: ', list(conflicts['field'].unique()))
+        print('\n', conflicts.to_string(index=False))
+        print("\n")
+        print("Check the conflicts above carefully. old represents the existing data contents, new represents the data that will overwrite\n",
+        "If old contains data, this import will OVERWRITE that existing data")
+    else:
+        print("\n", 'no conflicts found. No data will be overwritten. check the import data carefully:',"\n\n",data, "\n")
+
+    response = input("Do you want to continue? (y/n): ") if confirm else 'y'
+
+    if response.lower() == 'y':
+        return import_records(token, data, batch_size=batch_size, max_workers=max_workers, retries=retries)
+    else:
+        print('\n','Data import terminated')
+        return None
+#-----------------------
+
+#13-----------------------
+def clear_cache(token, form = None):
+    """
+    Deletes cached exports for a project, either all of them or just those for one form
+
+    Args:
+        token (OrcaClient): The OrcaClient whose cache you want to clear.
+        form (str): Only clear cached exports of this form, including field exports (e.g. get_orca_field) holding
+            any of its fields. Default is None and clears the whole project.
+
+    Returns:
+        int: The number of cached exports removed
+    """
+    import os
+    import shutil
+    import pandas as pd
+    import pyarrow.parquet as pq
+
+    project_dir = _project_cache_dir(token)
+    if project_dir is None or not os.path.isdir(project_dir):
+        return 0
+
+    cached_files = [file for file in os.listdir(project_dir) if '__' in file and not file.endswith('.tmp')]
+    if form is None:
+        shutil.rmtree(project_dir)
+        return len(cached_files)
+
+    #field exports are keyed by a hash, so check which ones hold the form's fields from their columns
+    metadata = get_metadata(token)
+    form_fields = set(metadata[metadata['form_name'] == form]['field_name']) - {'record_id'}
+    form_fields |= {form + '_complete', form + '_timestamp'}
+
+    removed = 0
+    for file in cached_files:
+        path = os.path.join(project_dir, file)
+        prefix = file.split('__')[0]
+        if prefix == 'fields':
+            columns = pq.read_schema(path).names if file.endswith('.parquet') else pd.read_pickle(path).columns
+            stale = any(str(column).split('___')[0] in form_fields for column in columns)
+        else:
+            stale = form in prefix.split('+')
+        if stale:
+            os.remove(path)
+            removed += 1
+    return removed
+#-----------------------
+
+#14-----------------------
+_metadata_memo = {}
+
+def get_metadata(token, refresh = False):
+    """
+    Pulls the data dictionary (metadata) of a redcap project. It is only pulled once per project per session
+    (or read from the project's local mirror, if one has been synced)
+
+    Args:
+        token (str or OrcaClient): The API token for the project, or an OrcaClient holding a pooled connection.
+        refresh (bool): Ignore any cached copy and pull from REDCap. Default is False
+
+    Returns:
+        pandas.DataFrame: One row per field with field_name, form_name, field_type, text validation etc.
+    """
+    import os
+    import pandas as pd
+
+    project_key = _project_key(token)
+    if not refresh and project_key in _metadata_memo:
+        return _metadata_memo[project_key]
+
+    mirror_dir = _project_mirror_dir(token)
+    if not refresh and mirror_dir is not None and os.path.exists(os.path.join(mirror_dir, 'metadata.parquet')):
+        metadata = pd.read_parquet(os.path.join(mirror_dir, 'metadata.parquet'))
+    else:
+        data = {
+            'content': 'metadata',
+            'format': 'csv',
+            'returnFormat': 'json'
+        }
+        metadata = _export_records(token, data, refresh=refresh)
+    _metadata_memo[project_key] = metadata
+    return metadata
+#-----------------------
+
+#15-----------------------
+def sync_project(token, mirror_dir = None, full = False):
+    """
+    Syncs a local parquet mirror of a redcap project. The first sync exports the whole project, later syncs
+    only export records created or modified since the last sync (using REDCap's dateRangeBegin) and merge
+    them into the mirror. Once a client with mirror_dir has been synced, all get_* functions read from the mirror.
+    Deleted records are only dropped from the mirror on a full sync.
+
+    Args:
+        token (str or OrcaClient): The API token for the project, or an OrcaClient holding a pooled connection.
+        mirror_dir (str): Folder to keep the mirror in. Default is None and uses the client's mirror_dir
+        full (bool): Rebuild the mirror from a full export instead of syncing changes. Default is False
+
+    Returns:
+        dict: sync summary with mode ('full' or 'incremental'), records_updated and last_sync (REDCap server time)
+    """
+    import os
     import io
-    from datetime import datetime
-    import pytz
+    import json
+    import pandas as pd
+
+    project_dir = _project_mirror_dir(token, mirror_dir)
+    if project_dir is None:
+        print('cannot sync: no mirror_dir given and the client has no mirror_dir')
+        return None
+    os.makedirs(project_dir, exist_ok=True)
+    records_path = os.path.join(project_dir, 'records.parquet')
+    metadata_path = os.path.join(project_dir, 'metadata.parquet')
+    watermark_path = os.path.join(project_dir, 'watermark.json')
+
+    #REDCap compares dateRangeBegin against server time
+    sync_start = pd.Timestamp.now(tz='America/New_York').strftime('%Y-%m-%d %H:%M:%S')
+    data = {
+        'content': 'record',
+        'action': 'export',
+        'format': 'csv',
+        'type': 'flat',
+        'csvDelimiter': '',
+        'rawOrLabel': 'raw',
+        'rawOrLabelHeaders': 'raw',
+        'exportCheckboxLabel': 'false',
+        'exportSurveyFields': 'true',
+        'exportDataAccessGroups': 'false',
+        'returnFormat': 'json'
+    }
 
+    def export(payload):
+        r = _redcap_post(token, payload)
+        print('HTTP Status: ' + str(r.status_code))
+        if r.status_code != 200:
+            raise RuntimeError('REDCap export failed: ' + r.text)
+        if not r.text.strip():
+            return pd.DataFrame(columns=['record_id'], dtype=str)
+        return pd.read_csv(io.StringIO(r.text), dtype=str)
+
+    #the data dictionary is written before the records, so a mirror never has records without one
+    metadata = get_metadata(token, refresh=True)
+    tmp_path = _tmp_path(metadata_path)
+    metadata.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, metadata_path)
+
+    incremental = not full and all(os.path.exists(path) for path in [records_path, watermark_path])
+    if incremental:
+        with open(watermark_path) as f:
+            last_sync = json.load(f)['last_sync']
+        changed_ids = export(dict(data, **{'fields[0]': 'record_id', 'dateRangeBegin': last_sync}))['record_id'].unique()
+
+        mirror = pd.read_parquet(records_path)
+        if len(changed_ids) > 0:
+            changes = export(dict(data, **_selection_payload(record_id=list(changed_ids))))
+            mirror = pd.concat([mirror[~mirror['record_id'].isin(changed_ids)], changes], ignore_index=True)
+        records_updated = len(changed_ids)
+    else:
+        #full pulls are streamed straight to disk so the whole project is never held in memory
+        _write_export_parquet(token, data, records_path)
+        records_updated = pd.read_parquet(records_path, columns=['record_id'])['record_id'].nunique()
+
+    if incremental and records_updated > 0:
+        tmp_path = _tmp_path(records_path)
+        mirror.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, records_path)
+
+    summary = {'mode': 'incremental' if incremental else 'full', 'records_updated': int(records_updated), 'last_sync': sync_start}
+    tmp_path = _tmp_path(watermark_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f)
+    os.replace(tmp_path, watermark_path)
+    print(f"{summary['mode']} sync complete: {records_updated} record(s) updated")
+    return summary
+#-----------------------
 
-    if timepoint == 'orca_4month_arm_1':
-        visit_notes = get_orca_data(token, form = "visit_notes_4m", form_complete=False, timepoint=timepoint)
-        data = visit_notes[['record_id', 'visit_date_4m', 'visit_time_4m']]
-        data = data[data['visit_date_4m'].notna() | data['visit_time_4m'].notna()]
-
-        data['visit_date_4m'] = pd.to_datetime(data['visit_date_4m'])
-        data['visit_time_4m'] = pd.to_datetime(data['visit_time_4m'], format='%H:%M').dt.time
-
-        if record_id == None and merged == False:
-            return data
-        elif record_id == None and merged == True:
-            data['visit_datetime_4m'] = data['visit_date_4m'] + pd.to_timedelta(data['visit_time_4m'].astype(str))
-            data['visit_datetime_4m'] = data['visit_datetime_4m'].dt.tz_localize('America/New_York')
-            return data
-        elif record_id != None and merged == False:
-            data = data[data['record_id'] == record_id]
-            return data
-        elif record_id != None and merged == True:
-            data = data[data['record_id'] == record_id]
-            data['visit_datetime_4m'] = data['visit_date_4m'] + pd.to_timedelta(data['visit_time_4m'].astype(str))
-            data['visit_datetime_4m'] = data['visit_datetime_4m'].dt.tz_localize('America/New_York')
-            value = data['visit_datetime_4m'].iloc[0]
-            return value
-        
-    elif timepoint == 'orca_8month_arm_1' or timepoint == 'mice_8month_arm_4':
-        visit_notes = get_orca_data(token, form = "visit_notes_8m", form_complete=False, timepoint=timepoint)
-        data = visit_notes[['record_id', 'visit_date_8m', 'visit_time_8m']]
-        data = data[data['visit_date_8m'].notna() | data['visit_time_8m'].notna()]
-
-        data['visit_date_8m'] = pd.to_datetime(data['visit_date_8m'])
-        data['visit_time_8m'] = pd.to_datetime(data['visit_time_8m'], format='%H:%M').dt.time
-
-        if record_id == None and merged == False:
-            return data
-        elif record_id == None and merged == True:
-            data['visit_datetime_8m'] = data['visit_date_8m'] + pd.to_timedelta(data['visit_time_8m'].astype(str))
-            data['visit_datetime_8m'] = data['visit_datetime_8m'].dt.tz_localize('America/New_York')
-            return data
-        elif record_id != None and merged == False:
-            data = data[data['record_id'] == record_id]
-            return data
-        elif record_id != None and merged == True:
-            data = data[data['record_id'] == record_id]
-            data['visit_datetime_8m'] = data['visit_date_8m'] + pd.to_timedelta(data['visit_time_8m'].astype(str))
-            data['visit_datetime_8m'] = data['visit_datetime_8m'].dt.tz_localize('America/New_York')
-            value = data['visit_datetime_8m'].iloc[0]
-            return value
-        
-    elif timepoint == 'orca_12month_arm_1' or timepoint == 'mice_12month_arm_4':
-        visit_notes = get_orca_data(token, form = "visit_notes_12m", form_complete=False, timepoint=timepoint)
-        data = visit_notes[['record_id', 'visit_date_12m', 'visit_time_12m']]
-        data = data[data['visit_date_12m'].notna() | data['visit_time_12m'].notna()]
-
-        data['visit_date_12m'] = pd.to_datetime(data['visit_date_12m'])
-        data['visit_time_12m'] = pd.to_datetime(data['visit_time_12m'], format='%H:%M').dt.time
-
-        if record_id == None and merged == False:
-            return data
-        elif record_id == None and merged == True:
-            data['visit_datetime_12m'] = data['visit_date_12m'] + pd.to_timedelta(data['visit_time_12m'].astype(str))
-            data['visit_datetime_12m'] = data['visit_datetime_12m'].dt.tz_localize('America/New_York')
-            return data
-        elif record_id != None and merged == False:
-            data = data[data['record_id'] == record_id]
-            return data
-        elif record_id != None and merged == True:
-            data = data[data['record_id'] == record_id]
-            data['visit_datetime_12m'] = data['visit_date_12m'] + pd.to_timedelta(data['visit_time_12m'].astype(str))
-            data['visit_datetime_12m'] = data['visit_datetime_12m'].dt.tz_localize('America/New_York')
-            value = data['visit_datetime_12m'].iloc[0]
-            return value
-    
-    elif timepoint == 'mice_4month_arm_4':
-        visit_notes = get_orca_data(token, form = "mice_visit_notes_4m", form_complete=False, timepoint=timepoint)
-        data = visit_notes[['record_id', 'mc_visit_date_4m', 'mc_visit_time_4m']]
-        data = data[data['mc_visit_date_4m'].notna() | data['mc_visit_time_4m'].notna()]
-
-        data['mc_visit_date_4m'] = pd.to_datetime(data['mc_visit_date_4m'])
-        data['mc_visit_time_4m'] = pd.to_datetime(data['mc_visit_time_4m'], format='%H:%M').dt.time
-
-        if record_id == None and merged == False:
-            return data
-        elif record_id == None and merged == True:
-            data['mc_visit_datetime_4m'] = data['mc_visit_date_4m'] + pd.to_timedelta(data['mc_visit_time_4m'].astype(str))
-            data['mc_visit_datetime_4m'] = data['mc_visit_datetime_4m'].dt.tz_localize('America/New_York')
-            return data
-        elif record_id != None and merged == False:
-            data = data[data['record_id'] == record_id]
-            return data
-        elif record_id != None and merged == True:
-            data = data[data['record_id'] == record_id]
-            data['mc_visit_datetime_4m'] = data['mc_visit_date_4m'] + pd.to_timedelta(data['mc_visit_time_4m'].astype(str))
-            data['mc_visit_datetime_4m'] = data['mc_visit_datetime_4m'].dt.tz_localize('America/New_York')
-            value = data['mc_visit_datetime_4m'].iloc[0]
-            return value
+#16-----------------------
+def get_orca_forms(token, forms, events = 'all', raw_v_label = 'raw', form_complete = True, max_workers = 4):
+    """
+    Retrieve several ORCA forms at once. Forms are exported concurrently (at most max_workers at a time)
+    so the total time is close to the slowest single export rather than the sum of all of them.
 
+    Args:
+        token (str or OrcaClient): The API token for the project, or an OrcaClient holding a pooled connection.
+        forms (list): The names of the REDCap forms to retrieve (e.g. ['visit_notes_4m', 'survey_timetable'])
+        events (str or list): The redcap event name(s) to pull. Default is all
+        raw_v_label (str): The label for raw data fields (default is 'raw').
+        form_complete (bool): Indicating whether to return all responses or just ones marked as complete (default is True).
+        max_workers (int): Maximum number of exports sent at the same time, to stay within REDCap rate limits. Default is 4
+
+    Returns:
+        dict: form name -> pandas.DataFrame, in the order the forms were given
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    forms = [forms] if isinstance(forms, str) else list(dict.fromkeys(forms))
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(forms)))) as executor:
+        futures = {form: executor.submit(get_orca_data, token, form, raw_v_label=raw_v_label, timepoint=events, form_complete=form_complete) for form in forms}
+        return {form: future.result() for form, future in futures.items()}
 #-----------------------
 
-#12-----------------------
-def import_data(token, data):
+#17-----------------------
+def import_records(token, data, batch_size = 100, max_workers = 4, retries = 3):
     """
-    Imports pandas dataframe into redcap
+    Imports a pandas dataframe into redcap without a conflict check. Records are grouped into batches
+    (all rows of a record stay in the same batch) which are sent concurrently. Empty cells are not sent, so they
+    never blank out existing data. Batches that fail with a server or connection error are retried with backoff
 
     Args:
-        token (str): The API token for the project.
+        token (str or OrcaClient): The API token for the project, or an OrcaClient holding a pooled connection.
         data (pandas.DataFrame): Data you want to import. Column names must be same as field names in codebook. redcap event name must be included.
+        batch_size (int): Number of records sent per import request. Default is 100
+        max_workers (int): Maximum number of batches sent at the same time. Default is 4
+        retries (int): Number of times a failed batch is retried. Default is 3
+
+    Returns:
+        pandas.DataFrame: one row per batch with batch, record_ids, n_rows, status ('imported' or 'failed'),
+        count (records REDCap reports as imported), attempts and error
+    """
+    import json
+    import time
+    import pandas as pd
+    from concurrent.futures import ThreadPoolExecutor
+
+    def import_value(value):
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    def send_batch(batch_n, batch):
+        rows = batch.astype(object).to_dict(orient='records')
+        records = [{field: import_value(value) for field, value in row.items() if pd.notna(value)} for row in rows]
+        payload = {
+            'content': 'record',
+            'action': 'import',
+            'format': 'json',
+            'type': 'flat',
+            'overwriteBehavior': 'normal',
+            'forceAutoNumber': 'false',
+            'returnContent': 'count',
+            'returnFormat': 'json',
+            'data': json.dumps(records, default=str)
+        }
+        result = {'batch': batch_n, 'record_ids': list(batch['record_id'].unique()), 'n_rows': len(batch),
+                  'status': 'failed', 'count': 0, 'attempts': 0, 'error': None}
+        for attempt in range(retries + 1):
+            result['attempts'] = attempt + 1
+            try:
+                r = _redcap_post(token, payload)
+            except Exception as e:
+                result['error'] = str(e)
+            else:
+                if r.status_code == 200:
+                    result.update(status='imported', count=int(r.json().get('count', 0)), error=None)
+                    break
+                result['error'] = r.text
+                #validation errors won't succeed on retry
+                if r.status_code < 500 and r.status_code != 429:
+                    break
+            if attempt < retries:
+                time.sleep(0.5 * 2 ** attempt)
+        return result
+
+    batch_numbers = pd.factorize(data['record_id'])[0] // batch_size
+    batches = [batch for _, batch in data.groupby(batch_numbers, sort=True)]
+    if len(batches) == 0:
+        return pd.DataFrame(columns=['batch', 'record_ids', 'n_rows', 'status', 'count', 'attempts', 'error'])
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        results = list(executor.map(send_batch, range(1, len(batches) + 1), batches))
+
+    results = pd.DataFrame(results)
+    failed = results[results['status'] == 'failed']
+    if len(failed) > 0:
+        print(f"{len(failed)} of {len(results)} import batch(es) failed - check the error column")
+    return results
+#-----------------------
+
+#18-----------------------
+def find_conflicts(existing, incoming, keys = ('record_id', 'redcap_event_name')):
+    """
+    Compares data about to be imported with the existing data, all fields at once. A conflict is a cell where both
+    the existing and incoming values are present and differ. Values are compared as numbers when both are numeric
+    (so '2' and 2.0 match), otherwise as stripped strings.
+
+    Args:
+        existing (pandas.DataFrame): The existing redcap data (e.g. from get_all_data)
+        incoming (pandas.DataFrame): The data you want to import
+        keys (list or tuple): Columns identifying a row in both frames. Default is record_id and redcap_event_name
+
+    Returns:
+        pandas.DataFrame: long format conflict table with the key columns, field, old (existing value) and new (incoming value)
+    """
+    import numpy as np
+    import pandas as pd
+
+    keys = list(keys)
+    fields = [col for col in incoming.columns if col not in keys and col in existing.columns]
+    if len(fields) == 0 or len(incoming) == 0:
+        return pd.DataFrame(columns=keys + ['field', 'old', 'new'])
+
+    def keyed(frame):
+        block = frame[fields]
+        block.index = pd.MultiIndex.from_arrays([frame[key].astype(str) for key in keys])
+        return block
+
+    existing = keyed(existing)
+    existing = existing[~existing.index.duplicated()]
+    incoming = keyed(incoming)
+    old = existing.reindex(incoming.index).to_numpy(dtype=object).ravel()
+    new = incoming.to_numpy(dtype=object).ravel()
+
+    def normalize(values):
+        values = pd.Series(values, dtype=object)
+        present = np.array(values.notna(), dtype=bool)
+        numbers = np.array(pd.to_numeric(values, errors='coerce'), dtype=float)
+        text = np.full(len(values), '', dtype=object)
+        is_text = present & np.isnan(numbers)
+        if is_text.any():
+            text[is_text] = values[is_text].astype(str).str.strip().to_numpy()
+            numbers[is_text] = pd.to_numeric(pd.Series(text[is_text]), errors='coerce').to_numpy(dtype=float)
+            present[is_text] = text[is_text] != ''
+        return present, numbers, text
+
+    old_present, old_numbers, old_text = normalize(old)
+    new_present, new_numbers, new_text = normalize(new)
+    both_numeric = ~np.isnan(old_numbers) & ~np.isnan(new_numbers)
+    equal = np.where(both_numeric, old_numbers == new_numbers, old_text == new_text)
+    positions = np.flatnonzero(old_present & new_present & ~equal)
+
+    rows, columns = np.divmod(positions, len(fields))
+    conflicts = incoming.index[rows].to_frame(index=False)
+    conflicts['field'] = np.asarray(fields, dtype=object)[columns]
+    conflicts['old'] = old[positions]
+    conflicts['new'] = new[positions]
+    return conflicts
+#-----------------------
+
+#19-----------------------
+def get_dtype_map(token, refresh = False):
+    """
+    Builds a column -> dtype map for raw exports from the project's data dictionary. Used by exporters when
+    typed=True so types are set once at parse time and are the same across every function:
+        record_id, redcap_event_name -> category
+        integer fields, yes/no, numerically coded radio/dropdown, checkbox options, form complete -> Int64
+        number, calc and slider fields -> Float64
+        date and datetime fields -> datetime64
+        time fields -> string (e.g. '13:05', combine with dates using pd.to_timedelta)
+
+    Args:
+        token (str or OrcaClient): The API token for the project, or an OrcaClient holding a pooled connection.
+        refresh (bool): Re-pull the data dictionary instead of using the copy already pulled. Default is False
+
+    Returns:
+        dict: export column name -> dtype string
+    """
+    metadata = get_metadata(token, refresh=refresh)
+
+    dtype_map = {'record_id': 'category', 'redcap_event_name': 'category', 'redcap_repeat_instrument': 'category', 'redcap_repeat_instance': 'Int64'}
+    for row in metadata.itertuples(index=False):
+        field = row.field_name
+        field_type = row.field_type
+        validation = str(getattr(row, 'text_validation_type_or_show_slider_number', '') or '')
+        choices = str(getattr(row, 'select_choices_or_calculations', '') or '')
+        codes = [choice.split(',')[0].strip() for choice in choices.split('|') if choice.strip()]
+        numeric_codes = len(codes) > 0 and all(code.lstrip('-').isdigit() for code in codes)
+
+        if field == 'record_id':
+            continue
+        elif field_type == 'checkbox':
+            for code in codes:
+                dtype_map[field + '___' + code.lower().replace('-', '_').replace('.', '_')] = 'Int64'
+        elif field_type in ('radio', 'dropdown'):
+            dtype_map[field] = 'Int64' if numeric_codes else 'category'
+        elif field_type in ('yesno', 'truefalse'):
+            dtype_map[field] = 'Int64'
+        elif field_type in ('calc', 'slider'):
+            dtype_map[field] = 'Float64'
+        elif field_type == 'text' and validation == 'integer':
+            dtype_map[field] = 'Int64'
+        elif field_type == 'text' and validation.startswith('number'):
+            dtype_map[field] = 'Float64'
+        elif field_type == 'text' and (validation.startswith('date_') or validation.startswith('datetime_')):
+            dtype_map[field] = 'datetime64[ns]'
+        elif field_type == 'text' and validation.startswith('time'):
+            dtype_map[field] = 'string'
+
+    for form in metadata['form_name'].unique():
+        dtype_map[form + '_complete'] = 'Int64'
+    return dtype_map
+#-----------------------
+
+#20-----------------------
+def exclude_records(df, exclusions = None, column = 'record_id', report = False):
+    """
+    Removes excluded records (e.g. test and staff ids) from a DataFrame in a single pass. The rules are evaluated
+    once per unique record id, and a record is blamed on the first pattern (in list order) that matches it.
+
+    Args:
+        df (pandas.DataFrame): The data to filter, e.g. an export or a read from the local mirror
+        exclusions (dict): rules with any of the keys
+            'patterns' (list): regular expressions - records whose id contains a match are excluded
+            'record_ids' (list): exact record ids to exclude
+            'include' (list): regular expressions - if given, only records whose id contains a match are kept
+            Default is None and uses default_exclusions. {} keeps every record
+        column (str): the name of the record id column. Default is record_id
+        report (bool): Whether to also return which rule excluded each record. Default is False
+
+    Returns:
+        pandas.DataFrame: df without the excluded records
+        pandas.DataFrame: record_id and rule for each excluded record, if report = True
+    """
+    import re
+    import warnings
+    import numpy as np
+    import pandas as pd
+
+    exclusions = default_exclusions if exclusions is None else exclusions
+    patterns = list(exclusions.get('patterns', []))
+    excluded_ids = set(str(record_id) for record_id in exclusions.get('record_ids', []))
+    include = list(exclusions.get('include', []))
+
+    codes, unique_ids = pd.factorize(df[column])
+    unique_ids = pd.Series(np.asarray(unique_ids, dtype=object)).astype(str)
+    rules = pd.Series(np.nan, index=unique_ids.index, dtype=object)
+
+    with warnings.catch_warnings():
+        #capture groups only matter for extracting, not for testing whether a pattern matches
+        warnings.filterwarnings('ignore', message='This pattern is interpreted as a regular expression', category=UserWarning)
+        if include:
+            included = unique_ids.str.contains('|'.join(f'(?:{pattern})' for pattern in include), regex=True)
+            rules[~included] = 'not included'
+        #each pattern is tested on its own, so capture groups inside a pattern can't shift which rule is blamed
+        for pattern in patterns:
+            matched = unique_ids.str.contains(re.compile(pattern)).to_numpy(dtype=bool)
+            rules[rules.isna().to_numpy() & matched] = 'pattern: ' + pattern
+    if excluded_ids:
+        rules[rules.isna() & unique_ids.isin(excluded_ids)] = 'record_id'
+
+    excluded = rules.notna().to_numpy()
+    keep = ~excluded[codes] if len(codes) else np.ones(0, dtype=bool)
+    filtered = df[keep | (codes == -1)]
+
+    if report:
+        excluded_report = pd.DataFrame({'record_id': unique_ids[excluded].to_numpy(), 'rule': rules[excluded].to_numpy()})
+        return filtered, excluded_report
+    return filtered
+#-----------------------
+
+#21-----------------------
+def check_visit_notes(visit_notes, timepoint = None, checks = ('timestamps', 'freeplay')):
+    """
+    Runs the visit notes QC checks (those of check_timestamps and check_freeplay_times) over every participant at once.
+    Takes an already exported visit notes frame, so a whole cohort is checked from a single export, e.g.
+    check_visit_notes(get_orca_data(token, 'visit_notes_4m', form_complete=False, timepoint='orca_4month_arm_1'))
+
+    Checks:
+        missing_timestamps: the task has ecg data (either of its first two data fields < 4) but a start/end marker is missing.
+            Freeplay is reported as freeplay, notoy_freeplay or toy_freeplay depending on the conditions run
+        complete_without_times / times_without_complete: a freeplay condition is marked complete with no times, or incomplete with times
+        missing_marker: some but not all real / mp4 times of a freeplay condition are recorded (or none are for a complete condition)
+        duration_mismatch: the real and mp4 durations of a freeplay condition differ
+        missing_break_marker: some break times are recorded but not all, or the condition ran over 5 minutes with no break times
+        break_duration_mismatch: the real and mp4 durations of a break differ
+        break_not_five_minutes: a break is marked but the condition minus the break isn't 5 minutes (real or mp4)
+
+    Args:
+        visit_notes (pandas.DataFrame): visit notes export (raw) for one or more timepoints
+        timepoint (str or list): the redcap event name(s) or alias(es) to check. Default is None and checks every registered timepoint whose fields are in visit_notes.
+            A requested timepoint whose fields are not in visit_notes is skipped with a message
+        checks (tuple): which groups of checks to run, 'timestamps' and/or 'freeplay'. Freeplay checks only run for timepoints with mp4 markers. Default is both
+
+    Returns:
+        pandas.DataFrame: one row per issue with record_id, redcap_event_name, task, check and detail (the field or durations involved). Empty if there are no issues
+    """
+    import pandas as pd
+
+    #a single form export has (empty) rows for every event, so timepoints are found from the fields actually exported
+    exported = lambda fields: all(field in visit_notes.columns for field in fields)
+    if timepoint is None:
+        present = set(visit_notes['redcap_event_name'])
+        events = [event for event in timepoints if event in present and exported(_timepoint_fields(event, ['visit_date']))]
+    else:
+        events = _resolve_timepoints(timepoint)
+
+    issues = []
+    def add(rows, mask, event, task, check, detail):
+        mask = mask.fillna(False).astype(bool)
+        if mask.any():
+            issues.append(pd.DataFrame({'record_id': rows.loc[mask, 'record_id'], 'redcap_event_name': event, 'task': task,
+                                        'check': check, 'detail': detail[mask] if isinstance(detail, pd.Series) else detail}))
+
+    for event in events:
+        info = timepoints[event]
+        rows = visit_notes[visit_notes['redcap_event_name'] == event]
+        field = lambda name: _timepoint_fields(event, [name])[0]
+
+        checkboxes = [field(name) + f'___{code}' for name in ('freeplay_conditions', 'freeplay_breaks') for code in (1, 2)]
+        timestamp_fields = _timepoint_fields(event, list(info['data_range'] or []) + [f"{task}_{end}" for task in info['tasks'] for end in ('start', 'end')] + _freeplay_markers)
+        freeplay_fields = _timepoint_fields(event, ['visit_date'] + [name for condition in ('notoy', 'toy', 'fp_nt_break', 'fp_t_break')
+                                                                    for name in (f"{condition}_start_real", f"{condition}_end_real", f"{condition}_start", f"{condition}_end")])
+        run_timestamps = 'timestamps' in checks and info['data_range'] and exported(timestamp_fields + checkboxes[:2])
+        run_freeplay = 'freeplay' in checks and info['mp4_markers'] and exported(freeplay_fields + checkboxes)
+        if ('timestamps' in checks and info['data_range'] and not run_timestamps) or ('freeplay' in checks and info['mp4_markers'] and not run_freeplay):
+            print('cannot check ' + event + ': some of its visit notes fields are not in visit_notes')
+
+        if run_timestamps:
+            #the data presence fields come in groups of three per task, in the order of completion_tasks
+            first, last = _timepoint_fields(event, info['data_range'])
+            data_fields = list(rows.loc[:, first:last].columns)
+            for task, group in zip(info['completion_tasks'], [data_fields[i:i + 3] for i in range(0, len(data_fields), 3)]):
+                has_data = (rows[group[:2]] < 4).any(axis=1)
+                if task != 'freeplay':
+                    for marker in _timepoint_fields(event, [f"{task}_start", f"{task}_end"]):
+                        add(rows, has_data & rows[marker].isna(), event, task, 'missing_timestamps', marker)
+                    continue
+                notoy = rows[field('freeplay_conditions') + '___1'] == 1
+                toy = rows[field('freeplay_conditions') + '___2'] == 1
+                notoy_markers = _timepoint_fields(event, ['notoy_start_real', 'notoy_end_real'])
+                toy_markers = _timepoint_fields(event, ['toy_start_real', 'toy_end_real'])
+                for label, ran, markers in [('freeplay', notoy & toy, notoy_markers + toy_markers),
+                                            ('notoy_freeplay', notoy & ~toy, notoy_markers), ('toy_freeplay', ~notoy & toy, toy_markers)]:
+                    for marker in markers:
+                        add(rows, has_data & ran & rows[marker].isna(), event, label, 'missing_timestamps', marker)
+
+        if run_freeplay:
+            dates = rows[field('visit_date')]
+            five_minutes = pd.Timedelta(minutes=5)
+            for condition, code, break_name in [('notoy', 1, 'fp_nt_break'), ('toy', 2, 'fp_t_break')]:
+                complete = rows[field('freeplay_conditions') + f'___{code}'] == 1
+                break_marked = rows[field('freeplay_breaks') + f'___{code}'] == 1
+                phase_fields = _timepoint_fields(event, [f"{condition}_start_real", f"{condition}_end_real", f"{condition}_start", f"{condition}_end"])
+                break_fields = _timepoint_fields(event, [f"{break_name}_start_real", f"{break_name}_end_real", f"{break_name}_start", f"{break_name}_end"])
+                times, break_times = rows[phase_fields], rows[break_fields]
+
+                none, some = times.isna().all(axis=1), times.isna().any(axis=1)
+                add(rows, complete & none, event, condition, 'complete_without_times', None)
+                add(rows, ~complete & ~none, event, condition, 'times_without_complete', None)
+                for marker in phase_fields:
+                    add(rows, ((some & ~none) | (none & complete)) & times[marker].isna(), event, condition, 'missing_marker', marker)
+
+                real = _combine_datetime(dates, times[phase_fields[1]]) - _combine_datetime(dates, times[phase_fields[0]])
+                mp4 = _mmss_to_timedelta(times[phase_fields[3]]) - _mmss_to_timedelta(times[phase_fields[2]])
+                durations = 'real ' + real.astype(str) + ', mp4 ' + mp4.astype(str)
+                add(rows, complete & real.notna() & mp4.notna() & (real != mp4), event, condition, 'duration_mismatch', durations)
+
+                break_none, break_some = break_times.isna().all(axis=1), break_times.isna().any(axis=1)
+                for marker in break_fields:
+                    missing = (break_some & ~break_none) | ((real > five_minutes) & break_none)
+                    add(rows, complete & missing & break_times[marker].isna(), event, condition, 'missing_break_marker', marker)
+
+                break_real = _combine_datetime(dates, break_times[break_fields[1]]) - _combine_datetime(dates, break_times[break_fields[0]])
+                break_mp4 = _mmss_to_timedelta(break_times[break_fields[3]]) - _mmss_to_timedelta(break_times[break_fields[2]])
+                break_durations = 'real ' + break_real.astype(str) + ', mp4 ' + break_mp4.astype(str)
+                measured = break_real.notna() & break_mp4.notna()
+                add(rows, measured & (break_real != break_mp4), event, condition, 'break_duration_mismatch', break_durations)
+                remaining = ((mp4 - break_mp4) != five_minutes) | ((real - break_real) != five_minutes)
+                add(rows, break_marked & measured & real.notna() & mp4.notna() & remaining, event, condition, 'break_not_five_minutes',
+                    'remaining real ' + (real - break_real).astype(str) + ', mp4 ' + (mp4 - break_mp4).astype(str))
+
+    if not issues:
+        return pd.DataFrame(columns=['record_id', 'redcap_event_name', 'task', 'check', 'detail'])
+    return pd.concat(issues).sort_index(kind='stable').reset_index(drop=True)
+#-----------------------
+
+#22-----------------------
+def get_movesense_info(token, timepoint = 'orca_4month_arm_1', record_id = None, visit_notes = None):
+    """
+    Pulls movesense device numbers, test recording on/off times and movesense version for every record at a timepoint
+    from a single export of the visit notes (and mailing information, where the timepoint has it).
 
+    Args:
+        token (str or OrcaClient): The API token for the project, or an OrcaClient holding a pooled connection.
+        timepoint (str or list): the redcap event name(s) or alias(es) of the timepoint(s) you wish to pull (see get_task_timestamps). Default is orca_4month_arm_1
+        record_id (str or list): the record id(s) you wish to pull. Default is None and will pull all records
+        visit_notes (pandas.DataFrame): an already exported visit notes (+ mailing information) frame covering the timepoint(s). Default is None and will export it
+
+    Returns:
+        pandas.DataFrame: one row per record and timepoint with record_id, redcap_event_name, cg_device, child_device,
+            cg_on, cg_off, child_on, child_off (tz-aware, America/New_York), package_mailed, mailed_by and
+            movesense_version (1 if the package was mailed before 2025-01-10, 2 if after, NA where there is no mailing form
+            or package_mailed is missing, as the version isn't known)
+    """
+    import numpy as np
+    import pandas as pd
+
+    events = _resolve_timepoints(timepoint)
+    if visit_notes is None:
+        forms = [timepoints[event]['form'] for event in events] + [timepoints[event]['mailing_form'] for event in events if timepoints[event].get('mailing_form')]
+        forms = list(dict.fromkeys(forms))
+        visit_notes = get_orca_data(token, form=forms if len(forms) > 1 else forms[0], form_complete=False, timepoint=events, record_id=record_id)
+    visit_notes = _select_record(visit_notes, record_id)
+
+    threshold = pd.Timestamp('2025-01-10')
+    frames = []
+    for event in events:
+        rows = visit_notes[visit_notes['redcap_event_name'] == event]
+        #fields missing from the export (e.g. not in this version of the form) come back empty
+        column = lambda name: rows.get(_timepoint_column(rows.columns, event, name), pd.Series(np.nan, index=rows.index))
+        dates = column('visit_date')
+
+        info = pd.DataFrame({'record_id': rows['record_id'], 'redcap_event_name': event})
+        for who in ['cg', 'child']:
+            info[f'{who}_device'] = pd.to_numeric(column(f'hr_device_{who}'), errors='coerce').astype('Int64')
+        for who in ['cg', 'child']:
+            info[f'{who}_on'] = _combine_datetime(dates, column(f'{who}_movesense_on'))
+            info[f'{who}_off'] = _combine_datetime(dates, column(f'{who}_movesense_off'))
+
+        if timepoints[event].get('mailing_form'):
+            mailed = pd.to_datetime(column('package_mailed'), errors='coerce')
+            info['package_mailed'] = mailed
+            info['mailed_by'] = column('ra_mailed')
+            info['movesense_version'] = pd.Series(np.where(mailed < threshold, 1, 2), index=rows.index, dtype='Int64').mask(mailed.isna())
+        else:
+            info['package_mailed'] = pd.NaT
+            info['mailed_by'] = np.nan
+            info['movesense_version'] = pd.Series(pd.NA, index=rows.index, dtype='Int64')
+        frames.append(info)
+
+    return pd.concat(frames, ignore_index=True)
+#-----------------------
+
+#23-----------------------
+_visit_datetime_memo = {}
+
+def get_visit_datetimes(token, refresh = False):
+    """
+    Pulls the visit start date time of every record at every registered timepoint (ORCA and MICE arms) from a single
+    export of just the visit date and time fields. It is only pulled once per project per session, so repeated
+    lookups (e.g. get_visit_datetime for one ID at a time) don't make new API calls
+
+    Args:
+        token (str or OrcaClient): The API token for the project, or an OrcaClient holding a pooled connection.
+        refresh (bool): Ignore the copy held in memory (and any cached export) and pull from REDCap. Default is False
+
+    Returns:
+        pandas.DataFrame: long table with record_id, redcap_event_name, visit_date (datetime), visit_time (time of day as a timedelta) and
+            visit_datetime (tz-aware, America/New_York), for records with a visit date or time
+        dict: visit_datetime keyed by (record_id, redcap_event_name)
+    """
+    import pandas as pd
+
+    project_key = _project_key(token)
+    if not refresh and project_key in _visit_datetime_memo:
+        return _visit_datetime_memo[project_key]
+
+    events = list(timepoints)
+    fields = list(dict.fromkeys(field for event in events for field in _timepoint_fields(event, ['visit_date', 'visit_time'])))
+    forms = list(dict.fromkeys(timepoints[event]['form'] for event in events))
+    visit_notes = get_orca_data(token, form=forms, fields=fields, form_complete=False, refresh=refresh)
+    table = _visit_datetime_table(visit_notes, events)
+
+    lookup = dict(zip(zip(table['record_id'], table['redcap_event_name']), table['visit_datetime']))
+    _visit_datetime_memo[project_key] = (table, lookup)
+    return table, lookup
+#-----------------------
+
+
+
+#ORCA ECG Processing Functions
+#all these functions are used for processing ECG data from ORCA
+#e.g. timestamp calculation, segmenting, etc. 
+
+
+
+#0-----------------------
+#private helpers shared by the ecg functions below
+
+def _sample_offsets(num_samples, sample_rate, method = 'start_time'):
+    """
+    Integer nanosecond offset of every sample from the anchor time. For 'start_time' the first sample sits on the anchor
+    and the offsets count up, for 'end_time' they count down so the last sample sits one sample period before the anchor
+    """
+    import numpy as np
+
+    step = 1e9 / sample_rate
+    if method == 'start_time':
+        return np.rint(np.arange(num_samples) * step).astype('int64')
+    elif method == 'end_time':
+        return -np.rint(np.arange(num_samples, 0, -1) * step).astype('int64')
+    raise ValueError(f"unknown method '{method}': use 'start_time' or 'end_time'")
+
+def _sample_timestamps(anchor, offsets):
+    """
+    Materializes anchor + offsets (in ns) as a datetime64 index, keeping the anchor's timezone
+    """
+    import pandas as pd
+
+    return pd.Timestamp(anchor) + pd.to_timedelta(offsets, unit='ns')
+
+def _time_values(values):
+    """
+    Returns times as a numeric numpy array for searching: datetimes (tz-aware are compared in UTC) and timedeltas as int64 nanoseconds,
+    anything else as float. Also returns whether the values were datetime-like
+    """
+    import pandas as pd
+
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if values.dt.tz is not None:
+            values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+        return values.to_numpy().astype('datetime64[ns]').view('int64'), True
+    if pd.api.types.is_timedelta64_dtype(values):
+        return values.to_numpy().astype('timedelta64[ns]').view('int64'), True
+    return values.to_numpy(dtype='float64'), False
+
+def _ibi_jobs(tasks, timepoints, method, input_root, output_root, layout):
+    """
+    Lists the Kubios matlab files to process for every task and timepoint, matched to their raw ecg file, and creates the ibi output folders.
+    Returns the jobs for _ibi_file_summary and a failure row for every folder that could not be read
+    """
+    import os
+
+    folders = {
+        'matlab': os.path.join('{timepoint} Months', 'Heart Rate Data', '{task}', 'Beat Corrected Matlab Files'),
+        'ecg': os.path.join('{timepoint} Months', 'Heart Rate Data', '{task}', 'Raw ECG Data'),
+        'ibi': os.path.join('{timepoint} Months', 'Heart Rate Data', '{task}', 'IBI Files')
+    }
+    folders.update(layout or {})
+    output_root = input_root if output_root is None else output_root
+
+    jobs, failures = [], []
+    for timepoint in timepoints:
+        for task in tasks:
+            matlab_dir, ecg_dir = [os.path.join(input_root, folders[folder].format(timepoint=timepoint, task=task)) for folder in ('matlab', 'ecg')]
+            ibi_dir = os.path.join(output_root, folders['ibi'].format(timepoint=timepoint, task=task))
+            try:
+                files = sorted(file for file in os.listdir(matlab_dir) if 'processed' not in file and '.DS_Store' not in file and '.mat' in file)
+                ecg_files = sorted(file for file in os.listdir(ecg_dir) if file.endswith('.csv'))
+            except OSError as e:
+                failures.append({'file': None, 'task': task, 'timepoint': timepoint, 'record_id': None, 'who': None, 'error': str(e)})
+                continue
+            os.makedirs(ibi_dir, exist_ok=True)
+
+            for file in files:
+                who = 'child' if 'child' in file else 'cg'
+                id = file.split("_")[0]
+                ecg_file = [ecg_file for ecg_file in ecg_files if id in ecg_file and "_"+who in ecg_file]
+                jobs.append({
+                    'file': file, 'task': task, 'timepoint': timepoint, 'record_id': id, 'who': who, 'method': method,
+                    'matlab_path': os.path.join(matlab_dir, file),
+                    'ecg_path': os.path.join(ecg_dir, ecg_file[0]) if ecg_file else None,
+                    'ibi_path': os.path.join(ibi_dir, id+"_" + timepoint + "m_" + who + "_ibi_" + task.lower() + ".csv"),
+                    'write_index': True
+                })
+    return jobs, failures
+
+def _ibi_file_summary(job):
+    """
+    Extracts the ibi series of one Kubios matlab file, places its task markers and conditions, saves the ibi csv and returns the
+    file's log row, or the reason it failed. Takes a single job from _ibi_jobs and never prompts, so it can run in worker processes
+    (with the job's write_index off, as several jobs can share one raw ecg file). Any error in a file is returned as its error
+    rather than raised, so one bad file never stops a batch
+    """
+    result = {key: job[key] for key in ('file', 'task', 'timepoint', 'record_id', 'who')}
+    try:
+        result['log'], result['error'] = _ibi_file_log(job)
+    except Exception as e:
+        result['log'], result['error'] = None, f'{type(e).__name__}: {e}'
+    return result
+
+def _ibi_file_log(job):
+    """
+    Processes one job for _ibi_file_summary. Returns the file's log row and None, or None and the reason the file was skipped
     """
+    import numpy as np
     import pandas as pd
-    from redcap import Project, RedcapError
-    unique_events = data['redcap_event_name'].unique()
-    all = get_all_data(token)
+    from datetime import date as dt
 
-    all = all[all['redcap_event_name'].isin(unique_events)]
+    task, timepoint, who, id = job['task'], job['timepoint'], job['who'], job['record_id']
 
-    all = all[data.columns.intersection(all.columns)]
-    test = pd.merge(all, data, on=['record_id', 'redcap_event_name'], how='right')
-    columns = [col for col in all.columns if col not in ['record_id', 'redcap_event_name']]
+    try:
+        data = extract_ibi(job['matlab_path'], method=job['method'])
+    except Exception as e:
+        return None, 'could not extract ibi, please reprocess in kubios'
+    if job['ecg_path'] is None:
+        return None, 'no raw ecg file found'
+
+    #finding ecg markers
+    ecg_data = read_ecg_markers(job['ecg_path'], write_index=job['write_index'])
+    recording_n = ecg_data.attrs['recording_ids'] or [1]
+
+    ecg_data = (ecg_data
+                .loc[:, ['marker', 'timestamp_relative']]
+                .dropna(subset=['marker'])
+                .reset_index(drop=True))
+    if ecg_data.empty:
+        return None, 'no markers in raw ecg file'
+
+    if 'notoy_start_real' in ecg_data['marker'].iloc[0]:
+        ecg_data = ecg_data.sort_values(
+            by='marker',
+            key=lambda x: ~x.str.contains('^notoy', regex=True)
+        ).reset_index(drop=True)
+    elif 'toy_start_real' in ecg_data['marker'].iloc[0]:
+        ecg_data = ecg_data.sort_values(
+            by='marker',
+            key=lambda x: ~x.str.contains('^toy', regex=True)
+        ).reset_index(drop=True)
+
+    #each marker gets its closest beat, or the next free beat after it if that one is already taken
+    closest_beats = match_timestamps(ecg_data['timestamp_relative'], data['time_s'], unique=True)
+    if (closest_beats < 0).any():
+        return None, "couldn't reconcile timestamps"
+
+    ecg_data['time_s'] = data['time_s'].to_numpy()[closest_beats]
+    ecg_data = ecg_data[['time_s', 'marker']]
+    data = pd.merge(data,ecg_data, on='time_s', how='left')
+
+    #adding continuous conditions column to the ibi_file
+    markers = data[pd.notna(data['marker'])].reset_index(drop=True)
+    markers = markers[['time_s', 'marker']]
+    markers['condition'] = markers['marker'].str.split('_').str[0]
+
+    data['condition'] = label_intervals(data['time_s'], markers)
+    #saving IBI csv
+    data.to_csv(job['ibi_path'], index=False)
+
+    #Calculating Descriptives
+    log = {
+        'record_id': id,
+        'who': who,
+        'task': task,
+        'timepoint': timepoint,
+        'date': dt.today(),
+        'ibi_mean': np.nanmean(data['ibi_ms']),
+        'ibi_sd': np.nanstd(data['ibi_ms']),
+        'max_ibi': np.nanmax(data['ibi_ms']),
+        'min_ibi': np.nanmin(data['ibi_ms']),
+        'perc_noise': data['ibi_ms'].isna().sum() / len(data) * 100
+    }
+    if task.lower() == 'freeplay':
+        for condition, suffix in [('notoy', 'nt'), ('toy', 't')]:
+            condition_data = data[data['condition'] == condition]
+            log.update({
+                'ibi_mean_' + suffix: np.nanmean(condition_data['ibi_ms']) if not condition_data.empty else np.nan,
+                'ibi_sd_' + suffix: np.nanstd(condition_data['ibi_ms']) if not condition_data.empty else np.nan,
+                'max_ibi_' + suffix: np.nanmax(condition_data['ibi_ms']) if not condition_data.empty else np.nan,
+                'min_ibi_' + suffix: np.nanmin(condition_data['ibi_ms']) if not condition_data.empty else np.nan,
+                'perc_noise_' + suffix: condition_data['ibi_ms'].isna().sum() / len(condition_data) * 100 if not condition_data.empty else np.nan
+            })
+    log.update({'check_file_order': np.nan, 'check_mult_rec': np.nan if len(recording_n) == 1 else 1})
+    return log, None
 
-    #checking conflicts
-    conflicts_for = []
-    for column in columns:
-        column_data = test[['record_id', 'redcap_event_name', column+'_x', column+'_y']]
-        column_data = column_data.dropna(subset=[column_data.columns[2], column_data.columns[3]])
-        column_data = column_data[column_data.iloc[:, 2] != column_data.iloc[:, 3]]
+def _ibi_summaries(results):
+    """
+    Assembles the per file results into the log (flagging switched cg / child files) and the wide redcap import, once for the whole batch
+    """
+    import numpy as np
+    import pandas as pd
 
-        if len(column_data) >= 1:
-            print('\n','conflict found for field: ', column)
-            print('\n', column_data.to_string())
-            print("\n")
-            conflicts_for.append(column)
-    
-    if len(conflicts_for) >= 1:
-        print("Check the datasets above carefully. columns x represent the existing data contents, column y represents the data that will overwrite\n",
-        "If column x contains data, this import will OVERWRITE that existing data\n",
-        "If the cell contents are the same, there is no new data to import")
-    else:
-        print("\n", 'no conflicts found. No data will be overwritten. check the import data carefully:',"\n\n",data, "\n")
+    log = pd.DataFrame([result['log'] for result in results if result['log'] is not None])
+    if log.empty:
+        return log, pd.DataFrame()
+
+    #checking cg / child ibi values: a child mean ibi larger than the cg's suggests the files are switched
+    keys = [log['record_id'], log['task'], log['timepoint']]
+    pair = log.groupby(keys)['who'].transform('size') == 2
+    cg_ibi = log['ibi_mean'].where(log['who'] == 'cg').groupby(keys).transform('max')
+    child_ibi = log['ibi_mean'].where(log['who'] == 'child').groupby(keys).transform('max')
+    log['check_file_order'] = pd.Series('1', index=log.index).where(pair & (child_ibi > cg_ibi))
+
+    #creating import file, one row per record and timepoint
+    imports = []
+    for row in log.itertuples(index=False):
+        prefix, tp = row.who + "_" + row.task.lower(), row.timepoint + 'm'
+        import_row = {
+            'record_id': row.record_id,
+            'redcap_event_name': 'orca_' + row.timepoint + 'month_arm_1',
+            prefix + "_ibi_date_" + tp: str(row.date),
+            prefix + "_ibi_m_" + tp: row.ibi_mean,
+            prefix + "_ibi_sd_" + tp: row.ibi_sd
+        }
+        if row.task.lower() == 'freeplay':
+            import_row.update({
+                row.who + "_notoy_ibi_m_" + tp: row.ibi_mean_nt,
+                row.who + "_notoy_ibi_sd_" + tp: row.ibi_sd_nt,
+                row.who + "_toy_ibi_m_" + tp: row.ibi_mean_t,
+                row.who + "_toy_ibi_sd_" + tp: row.ibi_sd_t
+            })
+        imports.append(import_row)
+    task_import = pd.DataFrame(imports).groupby(['record_id', 'redcap_event_name'], sort=False).first().reset_index()
+    return log, task_import
 
-    response = input("Do you want to continue? (y/n): ")
+def _marker_index_path(path):
+    """
+    Path of the marker index kept next to a raw ecg csv
+    """
+    import os
 
-    if response.lower() == 'y':
-        project = Project(url, token)
+    return os.path.splitext(path)[0] + '_markers.json'
 
-        for id in data['record_id']:
-            filtered = data[data['record_id'] == id]
-            filtered = filtered.dropna(axis=1)
+def _ecg_marker_table(ecg_data, marker_column = 'marker', first_sample = 0):
+    """
+    The marker rows of an ecg frame as marker, sample_index (row position, counted from first_sample), timestamp_relative and recording_id
+    """
+    import numpy as np
+    import pandas as pd
 
-        # Convert DataFrame to a list of dictionaries (one dictionary per row)
-            records = filtered.to_dict(orient='records')
+    positions = np.flatnonzero(ecg_data[marker_column].notna().to_numpy()) if marker_column in ecg_data.columns else np.array([], dtype='int64')
+    rows = ecg_data.iloc[positions]
+    column = lambda name: rows[name].to_numpy() if name in rows.columns else np.full(len(rows), np.nan)
+    return pd.DataFrame({
+        'marker': column(marker_column),
+        'sample_index': positions + first_sample,
+        'timestamp_relative': column('timestamp_relative'),
+        'recording_id': column('recording_id')
+    })
 
-            try:
-                import_status = project.import_records(records)
-                print("Data import completed for ", import_status['count'], " record(s)")
-            except RedcapError as e:
-                print(f"Error importing data: {e}")
-    else:
-        print('\n','Data import terminated')
-#-----------------------
+def _write_marker_index(path, markers, n_samples, recording_ids):
+    """
+    Writes the marker index of the ecg csv at path (after the csv, so it is never older than it). The index is only a speed-up,
+    so it is skipped with a message where it can't be written (e.g. a read-only data share)
+    """
+    import os
+    import json
 
+    index = {
+        'source_size': os.path.getsize(path),
+        'n_samples': int(n_samples),
+        'recording_ids': recording_ids,
+        'markers': {column: markers[column].tolist() for column in markers.columns}
+    }
+    index_path = _marker_index_path(path)
+    tmp_path = _tmp_path(index_path)
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        print('could not write marker index: ' + str(e))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
+def _ecg_frame(ecg_data, columns = None):
+    """
+    Returns ecg_data itself, or the recording loaded (memory-mapped) from an ecg store if ecg_data is a store path (see write_ecg_store)
+    """
+    if isinstance(ecg_data, str):
+        return read_ecg_store(ecg_data, columns=columns)
+    return ecg_data
 
-#ORCA ECG Processing Functions
-#all these functions are used for processing ECG data from ORCA
-#e.g. timestamp calculation, segmenting, etc. 
+def _ecg_marker_index(ecg_file, marker_column = 'marker'):
+    """
+    The marker table (see read_ecg_markers) of an ecg frame, found in one scan of the marker column, or of an ecg store path.
+    None if the recording has no marker_column
+    """
+    import os
+    import json
 
+    if isinstance(ecg_file, str):
+        with open(os.path.join(ecg_file, 'meta.json')) as f:
+            stored_column = json.load(f)['marker_column']
+        return read_ecg_markers(ecg_file) if stored_column == marker_column else None
+    if marker_column not in ecg_file.columns:
+        return None
+    return _ecg_marker_table(ecg_file, marker_column)
 
+def _ecg_rows(ecg_file, start, stop):
+    """
+    Rows start:stop (by position) of an ecg frame, or of an ecg store without loading the rest of the recording
+    """
+    if isinstance(ecg_file, str):
+        return read_ecg_store(ecg_file, rows=slice(start, stop))
+    return ecg_file.iloc[start:stop]
+#-----------------------
 
 #1-----------------------
 def find_closest_timestamp(timestamp, timestamps, type = 'numeric'):
@@ -810,14 +2249,12 @@ def find_closest_timestamp(timestamp, timestamps, type = 'numeric'):
 
 #2-----------------------
 def segment_full_ecg(ecg_file, marker_column, start_marker, end_marker):
-    import pandas as pd
-    from datetime import datetime
-    pd.options.mode.chained_assignment = None  # default='warn'
     """
     Segments a file based on markers within a particular column
 
     Args:
-        ecg_file (pandas.DataFrame): the name of a pandas dataframe in your environment to segment
+        ecg_file (pandas.DataFrame or str): the name of a pandas dataframe in your environment to segment, or the path of an ecg store (see write_ecg_store),
+            in which case only the rows of the segment are loaded
         marker_column (str): the name of the column in ecg_file containing your markers. Must be a string
         start_marker (str): the marker of the row you wish to segment after. Must be a string
         end_marker (str): the marker of the row you wish to segment until. Must be a string
@@ -825,15 +2262,18 @@ def segment_full_ecg(ecg_file, marker_column, start_marker, end_marker):
     Returns:
         pandas.DataFrame: DF containing all rows between your two markers
     """
+    import pandas as pd
+
     segmented_signals = None
-    if marker_column in ecg_file.columns:
-        if start_marker in ecg_file[marker_column].values and end_marker in ecg_file[marker_column].values:
-            first_index = ecg_file.index[ecg_file[marker_column] == start_marker][0]
-            last_index = ecg_file.index[ecg_file[marker_column] == end_marker][0]
-            segmented_signals = ecg_file.iloc[first_index:last_index+1]
-        elif start_marker not in ecg_file[marker_column].values and end_marker in ecg_file[marker_column].values:
+    markers = _ecg_marker_index(ecg_file, marker_column)
+    if markers is not None:
+        #first row of every marker, from a single scan of the marker column
+        first_rows = markers.drop_duplicates('marker').set_index('marker')['sample_index']
+        if start_marker in first_rows.index and end_marker in first_rows.index:
+            segmented_signals = _ecg_rows(ecg_file, first_rows[start_marker], first_rows[end_marker] + 1)
+        elif start_marker not in first_rows.index and end_marker in first_rows.index:
             print('cannot segment file: ' + start_marker + ' not present in file')
-        elif start_marker in ecg_file[marker_column].values and end_marker not in ecg_file[marker_column].values:
+        elif start_marker in first_rows.index and end_marker not in first_rows.index:
             print('cannot segment file: ' + end_marker + ' not present in file')
         else:
             print('cannot segment file: neither marker present in file')
@@ -843,6 +2283,8 @@ def segment_full_ecg(ecg_file, marker_column, start_marker, end_marker):
 
     if segmented_signals is not None:
         if len(segmented_signals) > 4:
+            #a shallow copy takes the new column without copying the segment's data
+            segmented_signals = segmented_signals.copy(deep=False)
             segmented_signals['timestamp_relative'] = (segmented_signals['timestamp_est_corrected'] - segmented_signals['timestamp_est_corrected'].min()).dt.total_seconds()
             return segmented_signals
         else:
@@ -860,7 +2302,7 @@ def check_ecg_recording_n(ecg_data, column_name = 'timestamp_est'):
     Checks number of ecg recordings within a file
 
     Args:
-        ecg_file (pandas.DataFrame): 
+        ecg_file (pandas.DataFrame or str): your ecg data, or the path of an ecg store (see write_ecg_store), in which case only column_name is loaded
         column_name (str): column name of the timestamp column you wish to check
 
     Returns:
@@ -868,6 +2310,7 @@ def check_ecg_recording_n(ecg_data, column_name = 'timestamp_est'):
     """
     import pandas as pd
 
+    ecg_data = _ecg_frame(ecg_data, columns=[column_name])
     ecg_data['time_diff'] = ecg_data[column_name].diff()
     max_gap = pd.Timedelta(seconds=1)
     ecg_data['new_recording'] = ecg_data['time_diff'] > max_gap
@@ -925,91 +2368,68 @@ def checking_multiple_recordings(ecg_data, column_name = 'recording_id'):
 #-----------------------
 
 #5-----------------------
-def calculate_ecg_timestamps(ecg_data, start_time, end_time, sample_rate=256, method = 'start_time'):
+def calculate_ecg_timestamps(ecg_data, start_time, end_time, sample_rate=256, method = 'start_time', offsets = False):
     """
     Calculates timestamps of a time series ecg dataframe according to either the start time or end time, and sampling rate
 
     Args:
-        ecg_data (pandas.DataFrame): 
+        ecg_data (pandas.DataFrame): Or the path of an ecg store (see write_ecg_store), which is memory-mapped
         start_time (datetime.datetime, optional): Datetime object of the start time of the ecg recording
         end_time (datetime.datetime, optional): Datetime object of the end time of the ecg recording
         sample_rate (int): Sampling rate of your ecg recording. Default is 256
         method (str): whether to use the 'start_time' or 'end_time'
+        offsets (bool): instead of materializing timestamps, add an int64 column 'timestamp_offset_ns' of each sample's offset in
+            nanoseconds from the anchor time, which is stored in ecg_data.attrs['timestamp_anchor']. Default is False
 
     Returns:
         pandas.DataFrame: Your original ecg dataframe with a column 'timestamp_est_corrected' reflecting the new timestamps
         timedelta object: Number or seconds different between the new end_time of timestamp_est_corrected and the end_time provided. Only returned if both start_time and end_time != None
     """
-    from datetime import datetime, timedelta
+    from datetime import timedelta
     import pandas as pd
 
-    #calculating number of samples in df, duration of file and subsequent time incrememnt per sample
-    num_samples = len(ecg_data)
-    duration = num_samples / sample_rate
-    time_increment_per_sample = duration / num_samples
+    ecg_data = _ecg_frame(ecg_data)
 
-    if method == 'start_time':
-        timestamps = [start_time + i * timedelta(seconds=time_increment_per_sample) for i in range(num_samples)]
-        ecg_data['timestamp_est_corrected'] = timestamps
+    #every sample's offset from the anchor is computed at once, in whole nanoseconds
+    anchor = start_time if method == 'start_time' else end_time
+    sample_offsets = _sample_offsets(len(ecg_data), sample_rate, method)
+    if offsets:
+        ecg_data['timestamp_offset_ns'] = sample_offsets
+        ecg_data.attrs['timestamp_anchor'] = pd.Timestamp(anchor)
+    else:
+        ecg_data['timestamp_est_corrected'] = _sample_timestamps(anchor, sample_offsets)
 
-        #if both start and end time present, the new end time is compared to expected end time and 'margin of error' calculated
+    #if both start and end time present, the new end (or start) time is compared to the expected one and 'margin of error' calculated
+    if method == 'start_time':
         if pd.notna(end_time):
-            new_max = max(ecg_data['timestamp_est_corrected'])
+            new_max = pd.Timestamp(anchor) + pd.Timedelta(int(sample_offsets[-1]), unit='ns')
             margin_of_error = abs(end_time-new_max)
             #setting threshold for MOE check
             threshold = timedelta(seconds = 1)
             #if MOE is less than 1s, ecg data & moe is returned. If it is more, they are returned with warning to check the file
             if margin_of_error < threshold:
                 print('Successfully corrected timestamps for this file')
-                return ecg_data, margin_of_error
             else:
                 print('There is more than a 1 second difference between the last sample and expected last sample. Check!')
-                return ecg_data, margin_of_error
         else:
             margin_of_error = None
             print('No margin of error can be returned as only start time or end time was provided')
-            return ecg_data, margin_of_error
-    elif method == 'end_time':
-        timestamps = [end_time - (num_samples - i) * timedelta(seconds=time_increment_per_sample) for i in range(num_samples)]
-        ecg_data['timestamp_est_corrected'] = timestamps
-
+    else:
         if pd.notna(start_time):
-            new_min = min(ecg_data['timestamp_est_corrected'])
+            new_min = pd.Timestamp(anchor) + pd.Timedelta(int(sample_offsets[0]), unit='ns')
             margin_of_error = abs(start_time-new_min)
             #setting threshold for MOE check
             threshold = timedelta(seconds = 1)
             #if MOE is less than 1s, ecg data & moe is returned. If it is more, they are returned with warning to check the file
             if margin_of_error < threshold:
                 print('Successfully corrected timestamps for this file')
-                return ecg_data, margin_of_error
             else:
                 print('There is more than a 1 second difference between the first sample and expected first sample. Check!')
-                return ecg_data, margin_of_error
         else:
             margin_of_error = None
             print('No margin of error can be returned as only end time was provided')
-            return ecg_data, margin_of_error
-
 
-
-    
-    #if both start and end time present, the new end time is compared to expected end time and 'margin of error' calculated
-    if pd.notna(start_time) and pd.notna(end_time):
-        new_max = max(ecg_data['timestamp_est_corrected'])
-        margin_of_error = abs(end_time-new_max)
-        #setting threshold for MOE check
-        threshold = timedelta(seconds = 1)
-        #if MOE is less than 1s, ecg data & moe is returned. If it is more, they are returned with warning to check the file
-        if margin_of_error < threshold:
-            print('Successfully corrected timestamps for this file')
-            return ecg_data, margin_of_error
-        else:
-            print('There is more than a 1 second difference between the last sample and expected last sample. Check!')
-            return ecg_data, margin_of_error
-    else:
-        margin_of_error = None
-        print('No margin of error can be returned as only start time or end time was provided')
-        return ecg_data, margin_of_error
+    return ecg_data, margin_of_error
 #-----------------------
 
 #6-----------------------
@@ -1018,7 +2438,7 @@ def calculate_ecg_drift(ecg_data, incorrect_times = 'timestamp_est_uncorrected',
     Calculates drift within a dataframe between 2 timeseries columns
 
     Args:
-        ecg_data (pandas.DataFrame): dataframe with timeseries data
+        ecg_data (pandas.DataFrame or str): dataframe with timeseries data, or the path of an ecg store (see write_ecg_store), in which case only the two time columns are loaded
         incorrect_times (datetime.datetime): Datetime series 1
         correct_times (datetime.datetime): Datetime series 2
 
@@ -1027,12 +2447,14 @@ def calculate_ecg_drift(ecg_data, incorrect_times = 'timestamp_est_uncorrected',
         drift_at_end (timedelta): time difference between the last samples of each time column
         drift_change (timedelta): change in drift between start and end of file
     """
-    incorrect_start = min(ecg_data[incorrect_times])
-    correct_start = min(ecg_data[correct_times])
+    ecg_data = _ecg_frame(ecg_data, columns=[incorrect_times, correct_times])
+
+    incorrect_start = ecg_data[incorrect_times].min()
+    correct_start = ecg_data[correct_times].min()
     drift_at_start = abs(incorrect_start - correct_start)
 
-    incorrect_end = max(ecg_data[incorrect_times])
-    correct_end = max(ecg_data[correct_times])
+    incorrect_end = ecg_data[incorrect_times].max()
+    correct_end = ecg_data[correct_times].max()
     drift_at_end = abs(incorrect_end - correct_end)
 
     drift_change = abs(drift_at_start - drift_at_end)
@@ -1094,245 +2516,43 @@ def extract_ibi(file,method='interpolated'):
 #-----------------------
 
 #8-----------------------
-def extract_task_ibi(token, task, timepoint = '4', method='interpolated'):
+def extract_task_ibi(token, task, timepoint = '4', method='interpolated', input_root = "/Volumes/ISLAND/Projects/ORCA/ORCA 2.0/Data", output_root = None, layout = None):
     """
-    Batch processes IBI matlab files for a given task
+    Batch processes IBI matlab files for a given task. For several tasks / timepoints without prompts, see batch_extract_ibi
 
     Args:
         task (str): The task you want to process: 'Richards', 'VPC', 'SRT', 'Cecile', 'Relational Memory', 'Freeplay'
         token (str): The API token for the project.
         timepoint(str): Timepoint you wish to process as a string. Default is 4
         method (str): whether to pull raw or interpolated IBIs. Default is interpolated
+        input_root (str): the folder holding the matlab and raw ecg folders. Default is the ORCA 2.0 Data folder on ISLAND
+        output_root (str): the folder to save the IBI files under. Default is None and uses input_root
+        layout (dict): folder templates (with {timepoint} and {task}) for 'matlab', 'ecg' and/or 'ibi' under the roots, see batch_extract_ibi
     Returns:
         temp_log (pandas.DataFrame): A logbook of each file processed and the mean / sd ibi values 
         task_import (pandas.DataFrame): The same info as temp_log but in wide format and with columns renamed for redcap import
     """
-    import h5py
-    import pandas as pd
-    import os
-    import numpy as np
-    from datetime import date as dt
-    #pulling task matlab files
-    #TEMP CODE FOR MAGGIE
-    local_path = "/Users/maggiezhang/Desktop/HR Data"
-    
-    #task_matlab_path = os.path.join("/Volumes/ISLAND/Projects/ORCA/ORCA 2.0/Data", timepoint + ' Months', "Heart Rate Data", task, "Beat Corrected Matlab Files")
-    task_matlab_path = f"{local_path}/{timepoint} Months/Beat Corrected Matlab Files"
-    files = [file for file in os.listdir(task_matlab_path) if 'processed' not in file and '.DS_Store' not in file and '.mat' in file]
+    jobs, failures = _ibi_jobs([task], [timepoint], method, input_root, output_root, layout)
+    for failure in failures:
+        print('cannot read ' + task + ' folders: ' + failure['error'])
+    files = [job['file'] for job in jobs]
 
-    
     print("\n", "The following ", task, " files will be processed:", "\n", "\n", files)
     response = input("\n"+'Continue to process (y/n):')
-    temp_log = pd.DataFrame()
-    task_import_cg = pd.DataFrame()
-    task_import_child = pd.DataFrame()
 
     if response == 'y' and len(files) >= 1:
-        for file in files:
-            #File Info
-            who = 'child' if 'child' in file else 'cg'
-            id = file.split("_")[0]
-
-            try:
-                data = extract_ibi(os.path.join(task_matlab_path, file), method=method)
-            except Exception as e:
-                print('could not extract ibi for ' + file + '\nPlease reprocess in kubios')
-                continue
-            
-            #finding ecg markers
-            ecg_path = os.path.join("/Volumes/ISLAND/Projects/ORCA/ORCA 2.0/Data", timepoint + ' Months', "Heart Rate Data", task, "Raw ECG Data")
-            ecg_file = [ecg_file for ecg_file in os.listdir(ecg_path) if id in ecg_file and "_"+who in ecg_file][0]
-            ecg_data = pd.read_csv(os.path.join(ecg_path, ecg_file))
-
-            recording_n = list(set(ecg_data['recording_id'])) if 'recording_id' in ecg_data.columns else [1]
-
-            ecg_data = (ecg_data
-                        .loc[:, ['marker', 'timestamp_relative']]
-                        .dropna(subset=['marker'])
-                        .reset_index(drop=True))
-
-            if 'notoy_start_real' in ecg_data['marker'].iloc[0]:
-                ecg_data = ecg_data.sort_values(
-                    by='marker',
-                    key=lambda x: ~x.str.contains('^notoy', regex=True)
-                ).reset_index(drop=True)
-            elif 'toy_start_real' in ecg_data['marker'].iloc[0]:
-                ecg_data = ecg_data.sort_values(
-                    by='marker',
-                    key=lambda x: ~x.str.contains('^toy', regex=True)
-                ).reset_index(drop=True)
+        results = [_ibi_file_summary(job) for job in jobs]
+        for result in results:
+            if result['error'] is None:
+                print('extracted ibi and saved csv for ', result['file'])
+            else:
+                print(result['error'] + ' for ' + result['file'] + ', skipping...')
 
-            try:
-                closest_timestamps = []
-                for index in ecg_data.index:
-                    closest_timestamp = find_closest_timestamp(ecg_data.iloc[index, 1], data['time_s'], type='numeric')
-                    
-                    if closest_timestamp in closest_timestamps:
-                        available_times = [t for t in data['time_s'] if t not in closest_timestamps and t >= ecg_data.iloc[index, 1]]
-                        closest_timestamp = find_closest_timestamp(ecg_data.iloc[index, 1], available_times, type='numeric')
-                    
-                    closest_timestamps.append(closest_timestamp)
-            except Exception as e:
-                print(f"Couldn't reconcile timestamps for {file}, skipping...")
-                continue
+        temp_log, task_import = _ibi_summaries(results)
+        temp_log = temp_log.drop(columns=['task', 'timepoint'], errors='ignore')
+        flagged_ids = list(temp_log.loc[temp_log['check_file_order'] == '1', 'record_id'].unique()) if not temp_log.empty else []
+        mult_rec = list(temp_log.loc[temp_log['check_mult_rec'] == 1, 'record_id']) if not temp_log.empty else []
 
-            ecg_data['time_s'] = closest_timestamps
-            ecg_data = ecg_data[['time_s', 'marker']]
-            data = pd.merge(data,ecg_data, on='time_s', how='left')
-
-
-            #adding continuous conditions column to the ibi_file
-            markers = data[pd.notna(data['marker'])].reset_index(drop=True)
-            markers = markers[['time_s', 'marker']]
-            markers['condition'] = markers['marker'].str.split('_').str[0]
-
-            condition_list = []
-
-            for i, time in enumerate(data['time_s']):
-                for i2, marker_time in enumerate(markers['time_s']):
-                    if i2 != (markers.index.stop-1):
-                        if time >= marker_time and time < markers['time_s'][i2+1]:
-                            condition = markers['condition'][i2]
-                            break
-                        else:
-                            condition = np.nan
-                    else:
-                        if time >= marker_time:
-                            condition = markers['condition'][i2]
-                            break
-                        else:
-                            condition = np.nan
-                
-                condition_list.append(condition)
-
-
-            data['condition'] = condition_list
-            #saving IBI csv
-            #ibi_path = os.path.join("/Volumes/ISLAND/Projects/ORCA/ORCA 2.0/Data", timepoint + ' Months',"Heart Rate Data", task, "IBI Files")
-            
-            #temp
-            ibi_path = f"{local_path}/{timepoint} Months/IBI Files"
-            os.makedirs(ibi_path, exist_ok=True)
-            ###
-            
-            ibi_file_name = id+"_" + timepoint + "m_" + who + "_ibi_" + task.lower() + ".csv" 
-            data.to_csv(os.path.join(ibi_path, ibi_file_name), index=False)
-
-            #renaming original matlab file
-            old_matlab = os.path.join(task_matlab_path, file)
-            new_matlab = os.path.join(task_matlab_path, id+"_" + timepoint + "m_"+who+"_ecg_"+task.lower()+"_hrv_processed.mat")
-            #os.rename(old_matlab, new_matlab)
-            print('extracted ibi and saved csv for ', file)
-
-            #Calculating Descriptives
-
-            if task.lower() != 'freeplay':
-                temp_data = pd.DataFrame([{
-                    'record_id': id,
-                    'who': who,
-                    'date': dt.today(),
-                    'ibi_mean': np.nanmean(data['ibi_ms']),
-                    'ibi_sd': np.nanstd(data['ibi_ms']),
-                    'max_ibi': np.nanmax(data['ibi_ms']),
-                    'min_ibi': np.nanmin(data['ibi_ms']),
-                    'perc_noise': data['ibi_ms'].isna().sum() / len(data) * 100,
-                    'check_file_order': np.nan,
-                    'check_mult_rec': np.nan if len(recording_n) == 1 else 1
-                }])
-
-                temp_log = pd.concat([temp_log, temp_data], ignore_index=True)
-
-                #creating import file
-                import_file = temp_data[['record_id', 'date', 'ibi_mean', 'ibi_sd']]
-                import_file = import_file.copy()
-                import_file.rename(columns={
-                    'date': who + "_" + task.lower() + "_ibi_date_" + timepoint + 'm', 
-                    'ibi_mean': who + "_" + task.lower() + "_ibi_m_" + timepoint + 'm', 
-                    'ibi_sd': who + "_" + task.lower() + "_ibi_sd_" + timepoint + 'm'}, inplace=True)
-                import_file['redcap_event_name'] = 'orca_' + timepoint + 'month_arm_1'
-
-                import_file[who + "_" + task.lower() + "_ibi_date_" + timepoint + 'm'] = import_file[who + "_" + task.lower() + "_ibi_date_" + timepoint + 'm'].astype(str)
-
-                if who == 'cg':
-                    task_import_cg = import_file if task_import_cg.empty else task_import_cg.merge(import_file, how = 'outer')
-                elif who == 'child':
-                    task_import_child = import_file if task_import_child.empty else task_import_child.merge(import_file, how = 'outer')
-
-            elif task.lower() == 'freeplay':
-                nt_data = data[data['condition'] == 'notoy']
-                t_data = data[data['condition'] == 'toy']
-        
-                temp_data = pd.DataFrame([{
-                    'record_id': id,
-                    'who': who,
-                    'date': dt.today(),
-                    'ibi_mean': np.nanmean(data['ibi_ms']),
-                    'ibi_sd': np.nanstd(data['ibi_ms']),
-                    'max_ibi': np.nanmax(data['ibi_ms']),
-                    'min_ibi': np.nanmin(data['ibi_ms']),
-                    'perc_noise': data['ibi_ms'].isna().sum() / len(data) * 100,
-                    'ibi_mean_nt': np.nanmean(nt_data['ibi_ms']) if not nt_data.empty else np.nan,
-                    'ibi_sd_nt': np.nanstd(nt_data['ibi_ms']) if not nt_data.empty else np.nan,
-                    'max_ibi_nt': np.nanmax(nt_data['ibi_ms']) if not nt_data.empty else np.nan,
-                    'min_ibi_nt': np.nanmin(nt_data['ibi_ms']) if not nt_data.empty else np.nan,
-                    'perc_noise_nt': nt_data['ibi_ms'].isna().sum() / len(nt_data) * 100,
-                    'ibi_mean_t': np.nanmean(t_data['ibi_ms']) if not t_data.empty else np.nan,
-                    'ibi_sd_t': np.nanstd(t_data['ibi_ms']) if not t_data.empty else np.nan,
-                    'max_ibi_t': np.nanmax(t_data['ibi_ms']) if not t_data.empty else np.nan,
-                    'min_ibi_t': np.nanmin(t_data['ibi_ms']) if not t_data.empty else np.nan,
-                    'perc_noise_t': t_data['ibi_ms'].isna().sum() / len(t_data) * 100,
-                    'check_file_order': np.nan,
-                    'check_mult_rec': np.nan if len(recording_n) == 1 else 1
-                }])
-
-                temp_log = pd.concat([temp_log, temp_data], ignore_index=True)
-
-                #creating import file
-                import_file = temp_data[['record_id', 'date', 'ibi_mean', 'ibi_sd', 'ibi_mean_nt', 'ibi_sd_nt', 'ibi_mean_t', 'ibi_sd_t']]
-                import_file = import_file.copy()
-                import_file.rename(columns={
-                    'date': who + "_" + task.lower() + "_ibi_date_" + timepoint + 'm', 
-                    'ibi_mean': who + "_" + task.lower() + "_ibi_m_" + timepoint + 'm', 
-                    'ibi_sd': who + "_" + task.lower() + "_ibi_sd_" + timepoint + 'm',  
-                    'ibi_mean_nt': who + "_notoy_ibi_m_" + timepoint + 'm', 
-                    'ibi_sd_nt': who +"_notoy_ibi_sd_" + timepoint + 'm', 
-                    'ibi_mean_t': who + "_toy_ibi_m_" + timepoint + 'm', 
-                    'ibi_sd_t': who +"_toy_ibi_sd_" + timepoint + 'm'}, 
-                    inplace=True)
-                
-                import_file['redcap_event_name'] = 'orca_' + timepoint + 'month_arm_1'
-                import_file[who + "_" + task.lower() + "_ibi_date_" +timepoint + 'm'] =import_file[who + "_" + task.lower() + "_ibi_date_" + timepoint + 'm'].astype(str)
-
-                if who == 'cg':
-                    task_import_cg = import_file if task_import_cg.empty else task_import_cg.merge(import_file, how = 'outer')
-                elif who == 'child':
-                    task_import_child = import_file if task_import_child.empty else task_import_child.merge(import_file, how = 'outer')
-                
-        if not task_import_cg.empty and not task_import_child.empty:
-            task_import = task_import_cg.merge(task_import_child, on=['record_id', 'redcap_event_name'], how="outer")
-        elif not task_import_cg.empty and task_import_child.empty:
-            task_import = task_import_cg
-        elif task_import_cg.empty and not task_import_child.empty:
-            task_import = task_import_child
-
-        #checking cg / child ibi values 
-        flagged_ids = []
-
-        temp_log['check_file_order'] = np.nan
-        for id in list(set(temp_log['record_id'])):
-            id_data = temp_log[temp_log['record_id'] == id]
-            if len(id_data) == 2 and 'cg' in id_data['who'].values and 'child' in id_data['who'].values:
-                cg_ibi = id_data[id_data['who'] == 'cg']['ibi_mean'].iloc[0]
-                child_ibi = id_data[id_data['who'] == 'child']['ibi_mean'].iloc[0]
-
-                flag = '1' if child_ibi > cg_ibi else np.nan
-                if flag == '1':
-                    flagged_ids.append(id)
-
-                    temp_log.loc[temp_log['record_id'] == id, 'check_file_order'] = '1'
-
-        mult_rec = [temp_log['record_id'].iloc[i] for i, value in enumerate(temp_log['check_mult_rec']) if value == '1']
-        
         print('The following IDs have a child IBI larger than cg. Check that the files are not switched: ', '\n', flagged_ids)
         print('The following IDs have multiple recordings and need to be checked, potentially re extracted: ', '\n', mult_rec)
         return temp_log, task_import
@@ -1697,24 +2917,26 @@ def overlay_real_time(video_path,output_path, start_time):
 #-----------------------
 
 #12----------------------- #pulls PEACH ema data
-def get_ema_data(token, am_or_pm = 'am'):
+def get_ema_data(token, am_or_pm = 'am', record_id = None, refresh = False):
     """
     Pulls PEACH am or pm ema survey averages for each event and domain
 
     Args:
         token (str): The API token for the PEACH redcap project. 
         am_or_pm (str): whether you want to pull daytime or evening surveys. default is am
+        record_id (str or list): the record id(s) you wish to pull. Default is None and will pull all records
+        refresh (bool): Ignore any cached copy of this export and pull from REDCap. Default is False
 
     Returns:
         pandas.DataFrame: A DataFrame with the retrieved data.
     """
     if am_or_pm == 'am':
-        ema = get_orca_data(token, form='ema_am_survey')
+        ema = get_orca_data(token, form='ema_am_survey', record_id=record_id, refresh=refresh)
         ema = ema[ema['record_id'].str.contains('pch')]
         ema = ema[['record_id', 'redcap_event_name', 'ema_am_survey_timestamp', 'anxiety_am', 'attention_am', 'stress_am', 'depression_am', 'loneliness_am', 'ema_am_extra']]
         ema.rename(columns={'ema_am_survey_timestamp': 'ema_survey_timestamp', 'redcap_event_name': 'ema_survey',  'ema_am_extra': 'ema_comments'}, inplace=True)
     elif am_or_pm == 'pm':
-        ema = get_orca_data(token, form='ema_pm_survey')
+        ema = get_orca_data(token, form='ema_pm_survey', record_id=record_id, refresh=refresh)
         ema = ema[ema['record_id'].str.contains('pch')]
         ema = ema[['record_id', 'redcap_event_name', 'ema_pm_survey_timestamp', 'anxiety_pm', 'attention_pm', 'stress_pm', 'depression_pm', 'ema_pm_extra']]
         ema.rename(columns={'ema_pm_survey_timestamp': 'ema_survey_timestamp', 'redcap_event_name': 'ema_survey', 'ema_pm_extra': 'ema_comments'}, inplace=True)
@@ -1726,131 +2948,30 @@ def get_ema_data(token, am_or_pm = 'am'):
 #-----------------------
 
 #13-----------------------
-def peach_ema_data_pull(token, data_type=None):
+def peach_ema_data_pull(token, data_type=None, state_dir=None):
     """
     Pulls peach daily data checks for ema surveys
 
     Args:
         token (str): The API token for the PEACH redcap project. 
         data_type (str): if you just want to pull one data type. Default is None and pulls all (survey_info, last_data, mean_data)
+        state_dir (str): folder holding the EMA state kept by update_ema_state. If given, the state is updated with only the surveys
+            changed since the last run and the data checks are built from it. Default is None and pulls every survey
 
     Returns:
         pandas.DataFrame: 1 or 3 dataframes (survey_info, last_data, mean_data)
     """
     import pandas as pd
-    import numpy as np
-    import warnings
 
-    #pulling all survey timetables
-
-    survey_timetable = get_orca_data(token, form='survey_timetable', form_complete=False)
-
-    #pulling domain scores for each week
-    ema_am_domains = get_ema_data(token, am_or_pm='am')
-    ema_pm_domains = get_ema_data(token, am_or_pm='pm')
-
-    #creating list of ids to iterate through
-    unique_ids = ema_am_domains['record_id'].unique()
-
-    #creating empty dfs
-    survey_info = pd.DataFrame(columns=['record_id','todays_date','last_survey','last_survey_date','next_survey','days_enrolled','surveys_complete_perc','missed_surveys_flag'])
-    mean_data = pd.DataFrame(columns=['record_id','anxiety_mean_am','anxiety_mean_pm','attention_mean_am','attention_mean_pm','stress_mean_am','stress_mean_pm','depression_mean_am','depression_mean_pm','loneliness_mean_am'])
-    last_data = pd.DataFrame(columns=['record_id', 'last_survey_date', 'last_survey', 'anxiety_last','attention_last', 'stress_last', 'depression_last', 'loneliness_last', 'comment_last'])
-
-    for id in unique_ids:
-        id_data_am = ema_am_domains[ema_am_domains['record_id'] == id].copy().reset_index(drop=True)
-        id_data_pm = ema_pm_domains[ema_pm_domains['record_id'] == id].copy().reset_index(drop=True)
-        id_data = pd.concat([id_data_am, id_data_pm], axis=0, join='outer')
-        id_data = id_data.sort_values(by='ema_survey_timestamp').reset_index(drop=True)
-
-        #cleaning survey timetable
-        id_timetable = survey_timetable[(survey_timetable['record_id'] == id) & (survey_timetable['redcap_event_name'] == 'initial_data_arm_1')].copy().reset_index(drop=True)
-        id_timetable = id_timetable.transpose()
-        id_timetable = id_timetable.rename_axis('survey_name').reset_index()    
-        id_timetable.columns = ['survey_name', 'survey_send_time']
-        id_timetable = id_timetable.drop(id_timetable.index[0:12]).reset_index(drop=True)
-        id_timetable = id_timetable[id_timetable['survey_name'] != 'survey_timetable_complete']
-        id_timetable['survey_send_time'] = pd.to_datetime(id_timetable['survey_send_time'])
-        id_timetable['survey_name'] = id_timetable['survey_name'].str.replace('_send', '', regex=False)
-
-        #finding survey completion stats 
-        last_survey_date = max(id_data['ema_survey_timestamp'])
-        last_survey_name = id_data['ema_survey'].iloc[id_data['ema_survey_timestamp'].idxmax()]
-        last_survey_am_pm = 'am' if '_am' in last_survey_name else 'pm'
-
-        #next survey in queue
-        current_dt = pd.to_datetime('today')
-        future_surveys = id_timetable[id_timetable['survey_send_time'] > current_dt].reset_index(drop=True)
-
-        if future_surveys.empty:
-            print('skipping ', id, ' - finished course of study')
-        else:
-            next_survey_name = future_surveys['survey_name'].iloc[future_surveys['survey_send_time'].idxmin()]
-
-            #% surveys complete / missing data 
-            past_surveys = id_timetable[id_timetable['survey_send_time'] < current_dt].reset_index(drop=True)
-            past_surveys['survey_complete'] = np.nan
-
-            for i, survey in enumerate(past_surveys['survey_name']):
-                past_surveys.loc[i, 'survey_complete'] = 1 if survey in id_data['ema_survey'].values else 0
-
-            surveys_complete_perc = sum(past_surveys['survey_complete'].values) / len(past_surveys) * 100
-            surveys_missed_perc = (past_surveys['survey_complete'] == 0).sum() / len(past_surveys) * 100
-
-            time_since_last_survey = (current_dt - pd.to_datetime(last_survey_date)).days
-
-            #number days enrolled 
-            days_enrolled = (current_dt - id_timetable['survey_send_time'].min()).days
-
-            #Total Averages
-            mean_data_id = pd.DataFrame([{
-                'record_id':id,
-                'anxiety_mean_am': round(id_data['anxiety_am'].mean(), 2),
-                'anxiety_mean_pm': round(id_data['anxiety_pm'].mean(), 2),
-                'attention_mean_am': round(id_data['attention_am'].mean(), 2),
-                'attention_mean_pm': round(id_data['attention_pm'].mean(), 2),
-                'stress_mean_am': round(id_data['stress_am'].mean(), 2),
-                'stress_mean_pm': round(id_data['stress_pm'].mean(), 2),
-                'depression_mean_am': round(id_data['depression_am'].mean(), 2),
-                'depression_mean_pm': round(id_data['depression_pm'].mean(), 2),
-                'loneliness_mean_am': round(id_data['loneliness_am'].mean(), 2),
-            }])
-
-            #Last Scores
-            last_survey_data = id_data[id_data['ema_survey'] == last_survey_name].reset_index(drop=True)
-
-            last_data_id = pd.DataFrame([{
-                'record_id':id,
-                'last_survey_date': last_survey_date,
-                'last_survey': last_survey_name, 
-                'anxiety_last': last_survey_data['anxiety_' + last_survey_am_pm].iloc[0],
-                'attention_last': last_survey_data['attention_' + last_survey_am_pm].iloc[0],
-                'stress_last': last_survey_data['stress_' + last_survey_am_pm].iloc[0],
-                'depression_last': last_survey_data['depression_' + last_survey_am_pm].iloc[0],
-                'loneliness_last': last_survey_data['loneliness_' + last_survey_am_pm].iloc[0] if last_survey_am_pm == 'am' else np.nan,
-                'comment_last': last_survey_data['ema_comments'].iloc[0]
-            }])
-
-            #MAX Scores 
-            #survey_info_data 
-
-            survey_info_id = pd.DataFrame([{
-                'record_id': id,
-                'todays_date': current_dt.round('S'),
-                'last_survey': last_survey_name,
-                'last_survey_date': last_survey_date,
-                'next_survey': next_survey_name,
-                'days_enrolled': days_enrolled,
-                'surveys_complete_perc': round(surveys_complete_perc, 2),
-                'missed_surveys_flag': True if time_since_last_survey >= 7 else False
-            }])
-
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore", FutureWarning)
-
-                survey_info = pd.concat([survey_info, survey_info_id], ignore_index=True)
-                mean_data = pd.concat([mean_data, mean_data_id], ignore_index=True)
-                last_data = pd.concat([last_data, last_data_id], ignore_index=True)
+    current_dt = pd.to_datetime('today')
+
+    #every participant is handled at once: surveys are stacked and sorted by time, the timetable is melted to one row per survey
+    if state_dir is not None:
+        totals, timetable = update_ema_state(token, state_dir)
+    else:
+        timetable, totals = _ema_pull(token, current_dt=current_dt)
+
+    survey_info, last_data, mean_data = _ema_dashboard(totals, timetable, current_dt)
 
     data_map = {
         'survey_info': survey_info,
@@ -1890,7 +3011,8 @@ def convert_to_timedelta(time_str):
 #15-----------------------
 def check_freeplay_times(token, record_id, timepoint='orca_4month_arm_1'):
     """
-    Checks freeplay times for a specific id / timepoint, returns any errors
+    Checks freeplay times for a specific id / timepoint, returns any errors.
+    Runs the freeplay checks of check_visit_notes on a single export; use check_visit_notes directly for the whole cohort.
 
     Args:
         token (str): REDCap API token
@@ -1900,243 +3022,104 @@ def check_freeplay_times(token, record_id, timepoint='orca_4month_arm_1'):
     Returns:
         Boolean: True if no errors present and freeplay can be processed
     """
-    import os
-    import datetime
-    from datetime import datetime, timedelta, date as dt
-    import pandas as pd
-    import pytz
-    import numpy as np
-
-    if timepoint != 'orca_4month_arm_1':
+    event = _resolve_timepoints(timepoint)[0]
+    if not timepoints[event]['mp4_markers']:
         return 'Function not built currently to work with timepoint other than 4m. Talk to amy!'
-    
-    timestamps, mp4 = get_task_timestamps(token, record_id=record_id, transposed=True, timepoint=timepoint, mp4_times=True)  
-    comps = get_orca_field(token, field='freeplay_conditions_4m')
-    comps = comps[comps['record_id'] == record_id].reset_index(drop=True)
-
-    notoy_complete = True if comps.iloc[0,2] == 1 else False
-    toy_complete = True if comps.iloc[0,3] == 1 else False
-
-    #Creating times/breaks data frame for checks
-    times = pd.DataFrame({
-        'condition': ['notoy', 'toy'],
-        'start_real': [timestamps.iloc[10,2], timestamps.iloc[12,2]],
-        'end_real': [timestamps.iloc[11,2], timestamps.iloc[13,2]],
-        'start_mp4': [convert_to_timedelta(mp4.iloc[0,2]), convert_to_timedelta(mp4.iloc[2,2])],
-        'end_mp4': [convert_to_timedelta(mp4.iloc[1,2]), convert_to_timedelta(mp4.iloc[3,2])]
-    })
-
-    breaks = pd.DataFrame({
-        'condition': ['notoy', 'toy'],
-        'break_start_real': [timestamps.iloc[14,2], timestamps.iloc[16,2]],
-        'break_end_real': [timestamps.iloc[15,2], timestamps.iloc[17,2]],
-        'break_start_mp4': [convert_to_timedelta(mp4.iloc[4,2]), convert_to_timedelta(mp4.iloc[6,2])],
-        'break_end_mp4': [convert_to_timedelta(mp4.iloc[5,2]), convert_to_timedelta(mp4.iloc[7,2])]
-    })
-
-    #1) are all the times present for each condition? 
-    nt_times = times.iloc[0, slice(1,5)]
-    t_times = times.iloc[1, slice(1,5)]
-
-
-    #checking notoy 
-    if notoy_complete and nt_times.isna().all():
-        print('notoy is complete but there are no times recorded - check')
-        return False
-    elif not notoy_complete and nt_times.notna().any(): 
-        print('says no toy is incomplete but there have been times recorded - check')
-        return False
-
-    #checking notoy 
-    if toy_complete and t_times.isna().all():
-        print('toy is complete but there are no times recorded - check')
-        return False
-    elif not toy_complete and t_times.notna().any(): 
-        print('says toy is complete but there have been times recorded - check')
-        return False
-
-    #finding any missing markers (including if task is complete and they're all missing)
-    nt_missing = []
-    t_missing = []
-
-    if (nt_times.isna().any() and not nt_times.isna().all()) or (nt_times.isna().all() and notoy_complete):
-        nt_missing = list(times.columns[slice(1,5)][nt_times.isna()])
-    if (t_times.isna().any() and not t_times.isna().all()) or (t_times.isna().all() and toy_complete):
-        t_missing = list(times.columns[slice(1,5)][t_times.isna()])
-
-    if len(nt_missing) > 0 or len(t_missing) > 0:
-        print(f'there is timestamps missing from the following conditions:\n no-toy: {nt_missing} \n toy: {t_missing} \n\n Double check and rerun')
-        return False
-    
-    #2) duration of nt / t 
-    if notoy_complete:
-        nt_duration_real = (times.iloc[0,2] - times.iloc[0,1])
-        nt_duration_mp4 = times.iloc[0,4] - times.iloc[0,3]
-        if nt_duration_real != nt_duration_mp4:
-            print('durations of mp4 and real times do not match, check NO TOY')
-            return False
-    if toy_complete:
-        t_duration_real = (times.iloc[1,2] - times.iloc[1,1])
-        t_duration_mp4 = times.iloc[1,4] - times.iloc[1,3]
-        if t_duration_real != t_duration_mp4:
-            print('durations of mp4 and real times do not match, check TOY')
-            return False
-        
-    #3) are durations over 5 mins? if so, are there breaks present? 
-    breaks_comps = get_orca_field(token, field='freeplay_breaks_4m')
-    breaks_comps = breaks_comps[breaks_comps['record_id'] == record_id].reset_index(drop=True)
-    nt_breaks_comp = True if breaks_comps.iloc[0,2] == 1 else False
-    t_breaks_comp = True if breaks_comps.iloc[0,3] == 1 else False
-
-    nt_breaks = breaks.iloc[0, slice(1,5)]
-    t_breaks = breaks.iloc[1, slice(1,5)]
 
-    nt_breaks_missing = []
-    t_breaks_missing = []
+    visit_notes = _timepoint_export(token, [event], record_id)
+    issues = check_visit_notes(_select_record(visit_notes, record_id), event, checks=['freeplay'])
 
-    if notoy_complete:
-        if (nt_breaks.isna().any() and not nt_breaks.isna().all()) or (nt_duration_real > timedelta(minutes=5) and nt_breaks.isna().all()):
-            nt_breaks_missing = list(breaks.columns[slice(1,5)][nt_breaks.isna()]) 
-    
-    if toy_complete:
-        if (t_breaks.isna().any() and not t_breaks.isna().all()) or (t_duration_real > timedelta(minutes=5) and t_breaks.isna().all()):
-            t_breaks_missing = list(breaks.columns[slice(1,5)][t_breaks.isna()])
-        
-    if len(nt_breaks_missing) > 0 or len(t_breaks_missing) > 0:
-        print(f'there are break timestamps missing from the following conditions:\n no-toy: {nt_breaks_missing} \n toy: {t_breaks_missing} \n\n Double check and rerun')
+    if len(issues) > 0:
+        print(f"there are issues with the freeplay timestamps:\n{issues[['task', 'check', 'detail']].to_string(index=False)}\n\n Double check and rerun")
         return False
 
-    #4) do durations of breaks match each other
-    if nt_breaks.notna().all():
-        nt_breaks_duration_real = (breaks.iloc[0,2] - breaks.iloc[0,1])
-        nt_breaks_duration_mp4 = (breaks.iloc[0,4] - breaks.iloc[0,3])
-        if nt_duration_real != nt_duration_mp4:
-            print('durations of mp4 and real time no toy breaks DO NOT MATCH')
-            return False
-    if t_breaks.notna().all():
-        t_breaks_duration_real = (breaks.iloc[1,2] - breaks.iloc[1,1])
-        t_breaks_duration_mp4 = (breaks.iloc[1,4] - breaks.iloc[1,3])
-        if t_duration_real != t_duration_mp4:
-            print('durations of mp4 and real time toy breaks DO NOT MATCH')
-            return False
-
-    #5) do durations of breaks take the duration of the phase down to 0 
-    if nt_breaks_comp:
-        if (nt_duration_mp4 - nt_breaks_duration_mp4) != timedelta(minutes=5) or (nt_duration_real - nt_breaks_duration_real) != timedelta(minutes=5):
-            print('no toy break durations do not take the task duration down to 5 minutes')
-            return False
-
-    if t_breaks_comp:
-        if (t_duration_mp4 - t_breaks_duration_mp4) != timedelta(minutes=5) or (t_duration_real - t_breaks_duration_real) != timedelta(minutes=5):
-            print('toy break durations do not take the task duration down to 5 minutes')
-            return False
-
     print('no issues with freeplay timestamps!')
     return True
 #-----------------------
 
 #16-----------------------
-def calculate_ecg_timestamps_mult_recordings(ecg_data, start_time, end_time, sample_rate=256, method='start_time'):
+def calculate_ecg_timestamps_mult_recordings(ecg_data, start_time, end_time, sample_rate=256, method='start_time', offsets = False):
     """
-    Calculates timestamps of a time series ecg dataframe according to either the start time or end time, and sampling rate. Accommodates for multiple recordings within the file
+    Calculates timestamps of a time series ecg dataframe according to either the start time or end time, and sampling rate. Accommodates for multiple recordings within the file:
+    each recording is placed after the previous one (or before the next one for 'end_time') with the same gap between them as in timestamp_est_uncorrected
 
     Args:
-        ecg_data (pandas.DataFrame): 
+        ecg_data (pandas.DataFrame): ecg data with 'recording_id' (see check_ecg_recording_n) and 'timestamp_est_uncorrected' columns Or the path of an ecg store (see write_ecg_store), which is memory-mapped
         start_time (datetime.datetime, optional): Datetime object of the start time of the ecg recording
         end_time (datetime.datetime, optional): Datetime object of the end time of the ecg recording
         sample_rate (int): Sampling rate of your ecg recording. Default is 256
         method (str): whether to use the 'start_time' or 'end_time'
+        offsets (bool): instead of materializing timestamps, add an int64 column 'timestamp_offset_ns' of each sample's offset in
+            nanoseconds from the anchor time, which is stored in ecg_data.attrs['timestamp_anchor']. Default is False
 
     Returns:
         pandas.DataFrame: Your original ecg dataframe with a column 'timestamp_est_corrected' reflecting the new timestamps
         timedelta object: Number or seconds different between the new end_time of timestamp_est_corrected and the end_time provided. Only returned if both start_time and end_time != None
     """
-    from datetime import datetime, timedelta
+    from datetime import timedelta
     import pandas as pd
     import numpy as np
-    #creating aggregate df for start and end of each recording
-    recording_times = (
-        ecg_data.groupby('recording_id', as_index=False)
-        .agg(start_time=('timestamp_est_uncorrected', 'min'), end_time=('timestamp_est_uncorrected', 'max'))
-    )
-    recording_times['duration'] = recording_times['end_time'] - recording_times['start_time']
 
+    if method not in ('start_time', 'end_time'):
+        raise ValueError(f"unknown method '{method}': use 'start_time' or 'end_time'")
+    step = 1e9 / sample_rate
+    ecg_data = _ecg_frame(ecg_data)
+
+    #boundary table of every recording (in recording id order) in a single pass over the data
+    codes, recording_ids = pd.factorize(ecg_data['recording_id'], sort=True)
+    uncorrected = ecg_data['timestamp_est_uncorrected']
+    recording_times = uncorrected.groupby(codes).agg(['min', 'max', 'size'])
+    gaps = (recording_times['min'] - recording_times['max'].shift()).iloc[1:].to_numpy().astype('timedelta64[ns]').astype('int64')
+    spans = np.rint((recording_times['size'].to_numpy() - 1) * step).astype('int64')
+
+    #each recording's first sample follows the previous recording's last sample by the gap between them, counted from the first sample
+    recording_offsets = np.concatenate([[0], np.cumsum(spans[:-1] + gaps)])
+    within = ecg_data.groupby(codes).cumcount().to_numpy()
+    sample_offsets = recording_offsets[codes] + np.rint(within * step).astype('int64')
+    if method == 'start_time':
+        anchor = start_time
+    else:
+        #the last sample of the last recording sits one sample period before end_time
+        anchor = end_time
+        sample_offsets = sample_offsets - (recording_offsets[-1] + spans[-1]) - int(np.rint(step))
+
+    if offsets:
+        ecg_data['timestamp_offset_ns'] = sample_offsets
+        ecg_data.attrs['timestamp_anchor'] = pd.Timestamp(anchor)
+    else:
+        ecg_data['timestamp_est_corrected'] = _sample_timestamps(anchor, sample_offsets)
+
+    #if the other end time is present, the new end (or start) time is compared to the expected one and 'margin of error' calculated
     if method == 'start_time':
-        for i, rec_n in enumerate(recording_times['recording_id']):
-            if rec_n == min(recording_times['recording_id']):
-                #for first recording id, set recording start as the start_time parameter 
-                elapsed = np.nan
-                recording_start = start_time
-            elif rec_n > min(recording_times['recording_id']):
-                last_subset = ecg_data[ecg_data['recording_id'] < rec_n]
-                last_duration = max(last_subset['timestamp_est_corrected']) - min(last_subset['timestamp_est_corrected'])
-                current_jump = recording_times['start_time'].iloc[i] - recording_times['end_time'].iloc[i-1]
-
-                elapsed = last_duration + current_jump
-                recording_start = start_time + elapsed
-
-            #subsetting original data by recording id, calculating timestamps based on new start time, and appending back to larger df
-            ecg_subset = ecg_data[ecg_data['recording_id'] == rec_n]
-            ecg_subset, moe = calculate_ecg_timestamps(ecg_subset, start_time=recording_start, end_time=np.nan, sample_rate=256)
-
-            ecg_data.loc[ecg_subset.index, 'timestamp_est_corrected'] = ecg_subset['timestamp_est_corrected']
-
-        #if end time present, the new end time is compared to expected end time and 'margin of error' calculated
         if pd.notna(end_time):
-            new_max = max(ecg_data['timestamp_est_corrected'])
+            new_max = pd.Timestamp(anchor) + pd.Timedelta(int(sample_offsets.max()), unit='ns')
             margin_of_error = abs(end_time-new_max)
             #setting threshold for MOE check
             threshold = timedelta(seconds = 1)
             #if MOE is less than 1s, ecg data & moe is returned. If it is more, they are returned with warning to check the file
             if margin_of_error < threshold:
                 print('Successfully corrected timestamps for this file')
-                return ecg_data, margin_of_error
             else:
                 print('There is more than a 1 second difference between the last sample and expected last sample. Check!')
-                return ecg_data, margin_of_error
         else:
             margin_of_error = None
             print('No margin of error can be returned as only start time was provided')
-            return ecg_data, margin_of_error
-            
-    elif method == 'end_time':
-        for i, rec_n in enumerate(reversed(recording_times['recording_id'])):
-            i = len(recording_times['recording_id']) - 1 - i
-            if rec_n == max(recording_times['recording_id']):
-                #for first recording id, set recording start as the start_time parameter 
-                elapsed = np.nan
-                recording_end = end_time
-            elif rec_n < max(recording_times['recording_id']):
-                last_subset = ecg_data[ecg_data['recording_id'] > rec_n]
-
-                last_duration = max(last_subset['timestamp_est_corrected']) - min(last_subset['timestamp_est_corrected'])
-                current_jump =  recording_times['start_time'].iloc[i+1] - recording_times['end_time'].iloc[i]
-
-                elapsed = last_duration + current_jump
-                recording_end = end_time - elapsed
-            
-            #subsetting original data by recording id, calculating timestamps based on new start time, and appending back to larger df
-            ecg_subset = ecg_data[ecg_data['recording_id'] == rec_n]
-            ecg_subset, moe = calculate_ecg_timestamps(ecg_subset, start_time=np.nan, end_time=recording_end, sample_rate=256, method='end_time')
-
-            ecg_data.loc[ecg_subset.index, 'timestamp_est_corrected'] = ecg_subset['timestamp_est_corrected']
-        
+    else:
         if pd.notna(start_time):
-            new_min = min(ecg_data['timestamp_est_corrected'])
+            new_min = pd.Timestamp(anchor) + pd.Timedelta(int(sample_offsets.min()), unit='ns')
             margin_of_error = abs(start_time-new_min)
             #setting threshold for MOE check
             threshold = timedelta(seconds = 1)
             #if MOE is less than 1s, ecg data & moe is returned. If it is more, they are returned with warning to check the file
             if margin_of_error < threshold:
                 print('Successfully corrected timestamps for this file')
-                return ecg_data, margin_of_error
             else:
                 print('There is more than a 1 second difference between the first sample and expected first sample. Check!')
-                return ecg_data, margin_of_error
         else:
             margin_of_error = None
             print('No margin of error can be returned as only end time was provided')
-            return ecg_data, margin_of_error
+
+    return ecg_data, margin_of_error
 #-----------------------
 
 #17-----------------------
@@ -2263,30 +3246,520 @@ def overlay_time_ms(video_path,output_path):
 #19-----------------------
 def check_movesense_version(token, record_id, timepoint='orca_4month_arm_1'):
     """
-    Pulls child and caregiver movesense device numbers for a given timepoint.
+    Pulls the movesense version used by a record, from when the package was mailed (see get_movesense_info).
     Args:
         token (str): The API token for the project.
         record_id (str): the record id you wish to pull (e.g. '218'). Default is 'none' and will pull the whole dataset
         timepoint (str): the redcap event name of the timepoint you wish to pull. Default is orca_4month_arm_1
     Returns:
-        movesense_version: 1 if package was mailed < 1/10/25, 2 if after
+        movesense_version: 1 if package was mailed < 1/10/25, 2 if after, NA if the mailed date is missing
+    """
+    movesense = get_movesense_info(token, timepoint=timepoint, record_id=record_id)
+    movesense_version = movesense['movesense_version'].iloc[0]
+    who = str(movesense['mailed_by'].iloc[0])
+
+    if 'ah' not in who.lower() and 'jv' not in who.lower():
+        print('The following RA mailed package: ', who, ' - version 1 may have been used!')
+
+    return movesense_version
+#-----------------------
+
+#20-----------------------
+def update_ema_state(token, state_dir = None, full = False):
+    """
+    Keeps the PEACH EMA state on disk: per participant running sums and counts of each domain, the last survey and
+    its scores and the completion tally, plus the melted survey timetable. The first run builds it from full exports,
+    later runs only export participants whose surveys were created or modified since the last run (using REDCap's
+    dateRangeBegin) and replace their entries, so the daily cost follows new surveys rather than the size of the study.
+    Participants deleted from REDCap are only dropped on a full rebuild.
+
+    Args:
+        token (str or OrcaClient): The API token for the PEACH redcap project, or an OrcaClient holding a pooled connection.
+        state_dir (str): Folder to keep the state in. Default is None and uses the client's mirror_dir
+        full (bool): Rebuild the state from full exports instead of updating it. Default is False
+
+    Returns:
+        pandas.DataFrame: the EMA state, one row per participant (indexed by record_id)
+        pandas.DataFrame: the melted survey timetable (record_id, survey_name, survey_send_time)
     """
-    import requests
+    import os
+    import json
     import pandas as pd
-    import io
+
+    project_dir = _project_mirror_dir(token, state_dir)
+    if project_dir is None:
+        print('cannot update ema state: no state_dir given and the client has no mirror_dir')
+        return None
+    os.makedirs(project_dir, exist_ok=True)
+    state_path = os.path.join(project_dir, 'ema_state.parquet')
+    timetable_path = os.path.join(project_dir, 'ema_timetable.parquet')
+    watermark_path = os.path.join(project_dir, 'ema_watermark.json')
+
+    #REDCap compares dateRangeBegin against server time
+    update_start = pd.Timestamp.now(tz='America/New_York').strftime('%Y-%m-%d %H:%M:%S')
+    current_dt = pd.to_datetime('today')
+
+    incremental = not full and all(os.path.exists(path) for path in [state_path, timetable_path, watermark_path])
+    if incremental:
+        with open(watermark_path) as f:
+            last_update = json.load(f)['last_update']
+        data = {
+            'content': 'record',
+            'action': 'export',
+            'format': 'csv',
+            'type': 'flat',
+            'fields[0]': 'record_id',
+            'dateRangeBegin': last_update,
+            'returnFormat': 'json'
+        }
+        changed_ids = list(_export_records(token, data, refresh=True)['record_id'].unique())
+
+        state = pd.read_parquet(state_path)
+        timetable = pd.read_parquet(timetable_path)
+        if changed_ids:
+            changed_timetable, changed_state = _ema_pull(token, record_id=changed_ids, refresh=True, current_dt=current_dt)
+            state = pd.concat([state[~state.index.isin(changed_ids)], changed_state]).sort_index(kind='stable')
+            timetable = pd.concat([timetable[~timetable['record_id'].isin(changed_ids)], changed_timetable], ignore_index=True)
+        participants_updated = len(changed_ids)
+    else:
+        timetable, state = _ema_pull(token, refresh=True, current_dt=current_dt)
+        participants_updated = len(state)
+
+    if not incremental or participants_updated > 0:
+        for frame, path in [(state, state_path), (timetable, timetable_path)]:
+            tmp_path = _tmp_path(path)
+            frame.to_parquet(tmp_path)
+            os.replace(tmp_path, path)
+    tmp_path = _tmp_path(watermark_path)
+    with open(tmp_path, 'w') as f:
+        json.dump({'mode': 'incremental' if incremental else 'full', 'participants_updated': participants_updated, 'last_update': update_start}, f)
+    os.replace(tmp_path, watermark_path)
+    print(f"{'incremental' if incremental else 'full'} ema state update: {participants_updated} participant(s) updated")
+    return state, timetable
+#-----------------------
+
+#21-----------------------
+def match_timestamps(timestamps, reference, unique = False, tolerance = None):
+    """
+    Matches every timestamp to its closest value in a sorted reference series with a binary search, e.g. ecg markers to ibi beat times.
+    Equally close matches go to the earlier reference value (as find_closest_timestamp)
+
+    Args:
+        timestamps (array-like): the times you wish to match (numeric or datetime), in the order they should be assigned
+        reference (array-like): the sorted times to match against. Must be the same format as timestamps
+        unique (bool): whether each reference value can only be matched once. When a timestamp's closest match is already taken it is
+            given the closest free reference value at or after it. Default is False
+        tolerance (float or timedelta): the largest allowed distance between a timestamp and its match. Default is None (no limit)
+
+    Returns:
+        numpy.ndarray: for each timestamp, the position of its match in reference, or -1 where there is none (out of tolerance, or no free value left)
+    """
     import numpy as np
+    import pandas as pd
 
-    threshold = pd.to_datetime('2025-01-10')
-    package_mailed_date = get_orca_data(token, form='mailing_information_4m', form_complete=False)
-    package_mailed_date = package_mailed_date[(package_mailed_date['record_id'] == record_id) & (package_mailed_date['redcap_event_name'] == timepoint)]
-    who = package_mailed_date['ra_mailed_4m'].iloc[0]
-    package_mailed_date = package_mailed_date['package_mailed_4m'].iloc[0]
-    package_mailed_date = pd.to_datetime(package_mailed_date)
+    queries, is_datetime = _time_values(timestamps)
+    reference, _ = _time_values(reference)
+    n = len(reference)
+    if n == 0:
+        return np.full(len(queries), -1, dtype='int64')
+
+    #nearest neighbour from the insertion point: the value before it or at it, whichever is closer (ties go earlier)
+    after = np.searchsorted(reference, queries, side='left')
+    before = np.clip(after - 1, 0, n - 1)
+    at = np.clip(after, 0, n - 1)
+    matches = np.where(np.abs(queries - reference[before]) <= np.abs(reference[at] - queries), before, at)
+
+    if tolerance is not None:
+        tolerance = pd.Timedelta(tolerance).value if is_datetime else tolerance
+    within = lambda query, match: tolerance is None or abs(reference[match] - query) <= tolerance
+
+    if not unique:
+        if tolerance is not None:
+            matches = np.where(np.abs(reference[matches] - queries) <= tolerance, matches, -1)
+        return matches.astype('int64')
+
+    #taken positions point to the next position to try, so each collision walks forward past runs of taken values only once
+    taken = {}
+    def next_free(position):
+        path = []
+        while position in taken:
+            path.append(position)
+            position = taken[position]
+        for step in path:
+            taken[step] = position
+        return position
+
+    assigned = np.full(len(queries), -1, dtype='int64')
+    for i, (query, match) in enumerate(zip(queries, matches)):
+        if match in taken:
+            match = next_free(after[i])
+        if match < n and within(query, match):
+            assigned[i] = match
+            taken[match] = match + 1
+    return assigned
+#-----------------------
 
-    movesense_version = 1 if package_mailed_date < threshold else 2
+#22-----------------------
+def label_intervals(times, markers, label_column = 'condition', start_column = 'time_s', end_column = None, closed = 'left', default = None):
+    """
+    Labels a time series by the marker intervals it falls in, e.g. every ibi beat with its task condition or every epoch with its condition.
+    Each marker starts an interval that runs until its end time (if end_column is given) or until the next marker
 
-    if 'ah' not in who.lower() and 'jv' not in who.lower():
-        print('The following RA mailed package: ', who, ' - version 1 may have been used!')
+    Args:
+        times (pandas.Series): the time column to label (numeric or datetime)
+        markers (pandas.DataFrame): one row per interval, with its start time and label (and optionally end time). Intervals must not overlap
+        label_column (str): the name of the column in markers containing the labels. Default is condition
+        start_column (str): the name of the column in markers containing interval start times. Must be the same format as times. Default is time_s
+        end_column (str): the name of the column in markers containing interval end times. Times between an interval's end and the next start are left unlabelled.
+            Default is None (each interval ends at the next start and the last never ends)
+        closed (str): which interval boundaries are included: 'left' (start <= t < end), 'right' (start < t <= end), 'both' or 'neither'. Default is left
+        default: the label for times outside every interval. Default is None (NaN)
 
-    return movesense_version
-#-----------------------
\ No newline at end of file
+    Returns:
+        pandas.Series: the label of every time, with the same index as times
+    """
+    import numpy as np
+    import pandas as pd
+
+    if closed not in ('left', 'right', 'both', 'neither'):
+        raise ValueError(f"unknown closed '{closed}': use 'left', 'right', 'both' or 'neither'")
+    times = pd.Series(times)
+    default = np.nan if default is None else default
+    if markers.empty:
+        return pd.Series(default, index=times.index, dtype=object)
+    markers = markers.sort_values(start_column, kind='stable')
+    values, _ = _time_values(times)
+    starts, _ = _time_values(markers[start_column])
+    if end_column is None:
+        ends = np.append(starts[1:], np.inf if starts.dtype.kind == 'f' else np.iinfo(starts.dtype).max)
+    else:
+        ends, _ = _time_values(markers[end_column])
+
+    #the interval each time falls in is the last one starting before it (or at it, if starts are included)
+    position = np.searchsorted(starts, values, side='right' if closed in ('left', 'both') else 'left') - 1
+    inside = position >= 0
+    end = ends[np.clip(position, 0, None)]
+    inside &= (values <= end) if closed in ('right', 'both') else (values < end)
+
+    labels = pd.Series(markers[label_column].to_numpy().take(np.clip(position, 0, None)), index=times.index)
+    return labels.where(inside, default)
+#-----------------------
+
+#23-----------------------
+def batch_extract_ibi(tasks, timepoints = '4', method = 'interpolated', input_root = "/Volumes/ISLAND/Projects/ORCA/ORCA 2.0/Data", output_root = None, layout = None, workers = None):
+    """
+    Processes the IBI matlab files of several tasks and timepoints without prompting, spreading the files over a pool of processes.
+    Each file's IBI csv is saved as in extract_task_ibi; failed files are returned in a table instead of printed.
+    In scripts, call it under if __name__ == '__main__': so the worker processes can start
+
+    Args:
+        tasks (str or list): the task(s) to process: 'Richards', 'VPC', 'SRT', 'Cecile', 'Relational Memory', 'Freeplay'
+        timepoints (str or list): the timepoint(s) to process as strings. Default is '4'
+        method (str): whether to pull raw or interpolated IBIs. Default is interpolated
+        input_root (str): the folder holding the matlab and raw ecg folders. Default is the ORCA 2.0 Data folder on ISLAND
+        output_root (str): the folder to save the IBI files under. Default is None and uses input_root
+        layout (dict): folder templates under the roots, with {timepoint} and {task} filled in. Defaults are
+            'matlab': '{timepoint} Months/Heart Rate Data/{task}/Beat Corrected Matlab Files', 'ecg': '{timepoint} Months/Heart Rate Data/{task}/Raw ECG Data'
+            and 'ibi': '{timepoint} Months/Heart Rate Data/{task}/IBI Files'. e.g. {'matlab': '{timepoint} Months/Beat Corrected Matlab Files'}
+        workers (int): number of processes. Default is None and uses every core; 1 processes the files in this process
+
+    Returns:
+        log (pandas.DataFrame): one row per processed file with task, timepoint and the mean / sd ibi values and checks (see extract_task_ibi)
+        task_import (pandas.DataFrame): the redcap import, one row per record and timepoint
+        failures (pandas.DataFrame): file, task, timepoint, record_id, who and error of every file (or folder) that could not be processed
+    """
+    import pandas as pd
+    from concurrent.futures import ProcessPoolExecutor
+
+    tasks = [tasks] if isinstance(tasks, str) else list(tasks)
+    timepoints = [timepoints] if isinstance(timepoints, str) else list(timepoints)
+    jobs, failures = _ibi_jobs(tasks, timepoints, method, input_root, output_root, layout)
+
+    if workers == 1 or len(jobs) <= 1:
+        results = [_ibi_file_summary(job) for job in jobs]
+    else:
+        #workers only read marker indexes, so jobs sharing a raw ecg file never write its index at the same time
+        jobs = [dict(job, write_index=False) for job in jobs]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_ibi_file_summary, jobs))
+
+    log, task_import = _ibi_summaries(results)
+    failures = pd.DataFrame(failures + [{key: result[key] for key in ('file', 'task', 'timepoint', 'record_id', 'who', 'error')} for result in results if result['error'] is not None],
+                            columns=['file', 'task', 'timepoint', 'record_id', 'who', 'error'])
+    print(f"processed {len(log)} of {len(jobs)} ibi files ({len(failures)} failures)")
+    return log, task_import, failures
+#-----------------------
+
+#24-----------------------
+def write_ecg_csv(ecg_data, path, marker_column = 'marker'):
+    """
+    Saves an ecg dataframe as csv along with its marker index (a small json file next to it, see read_ecg_markers),
+    so later marker lookups don't need to parse the whole recording
+
+    Args:
+        ecg_data (pandas.DataFrame): the ecg data, e.g. after calculate_ecg_timestamps or segment_full_ecg
+        path (str): the csv file path
+        marker_column (str): the name of the column containing your markers. Default is marker
+    """
+    ecg_data.to_csv(path, index=False)
+    recording_ids = ecg_data['recording_id'].unique().tolist() if 'recording_id' in ecg_data.columns else None
+    _write_marker_index(path, _ecg_marker_table(ecg_data, marker_column), len(ecg_data), recording_ids)
+#-----------------------
+
+#25-----------------------
+def read_ecg_markers(path, marker_column = 'marker', write_index = False):
+    """
+    Reads the markers of a raw ecg csv from its marker index (written by write_ecg_csv). If the index is missing or out of date, only the marker,
+    timestamp_relative and recording_id columns of the csv are scanned (in chunks). Also reads the markers of an ecg store
+
+    Args:
+        path (str): the raw ecg csv file path, or ecg store path (see write_ecg_store)
+        marker_column (str): the name of the column containing your markers. Default is marker
+        write_index (bool): whether to write the index next to the csv after scanning it, for next time. Skipped if the folder
+            can't be written to. Default is False
+
+    Returns:
+        pandas.DataFrame: one row per marker in file order with marker, sample_index (row in the csv), timestamp_relative and recording_id.
+            attrs['n_samples'] holds the number of samples and attrs['recording_ids'] the recording ids in the file (None without a recording_id column)
+    """
+    import os
+    import json
+    import pandas as pd
+
+    columns = ['marker', 'sample_index', 'timestamp_relative', 'recording_id']
+    index_path = os.path.join(path, 'meta.json') if os.path.isdir(path) else _marker_index_path(path)
+    if os.path.isdir(path):
+        with open(index_path) as f:
+            index = json.load(f)
+        markers = pd.DataFrame(index['markers'], columns=columns)
+        markers.attrs.update(n_samples=index['n_samples'], recording_ids=index['recording_ids'])
+        return markers
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index['source_size'] == os.path.getsize(path):
+            markers = pd.DataFrame(index['markers'], columns=columns)
+            markers.attrs.update(n_samples=index['n_samples'], recording_ids=index['recording_ids'])
+            return markers
+
+    present = pd.read_csv(path, nrows=0).columns
+    usecols = [column for column in (marker_column, 'timestamp_relative', 'recording_id') if column in present] or list(present[:1])
+    chunks, recording_ids, n_samples = [], [], 0
+    for chunk in pd.read_csv(path, usecols=usecols, dtype={marker_column: object}, chunksize=1000000):
+        chunks.append(_ecg_marker_table(chunk, marker_column, first_sample=n_samples))
+        if 'recording_id' in chunk.columns:
+            recording_ids.extend(chunk['recording_id'].unique().tolist())
+        n_samples += len(chunk)
+    markers = pd.concat(chunks, ignore_index=True) if chunks else _ecg_marker_table(pd.DataFrame(columns=usecols), marker_column)
+    recording_ids = list(dict.fromkeys(recording_ids)) if 'recording_id' in usecols else None
+
+    if write_index:
+        _write_marker_index(path, markers, n_samples, recording_ids)
+    markers.attrs.update(n_samples=n_samples, recording_ids=recording_ids)
+    return markers
+#-----------------------
+
+#26-----------------------
+def write_ecg_store(ecg_data, path, marker_column = 'marker', datetime_columns = None):
+    """
+    Saves an ecg recording as an ecg store: a folder with one .npy array per column (datetimes as int64 nanoseconds in UTC) and a meta.json
+    holding the column types, the number of samples, recording ids and the marker table (as in the csv marker index, see read_ecg_markers).
+    Stores are read back near-instantly with read_ecg_store, which memory-maps the columns, and can be passed in place of a dataframe to
+    segment_full_ecg, check_ecg_recording_n, calculate_ecg_timestamps, calculate_ecg_timestamps_mult_recordings and calculate_ecg_drift
+
+    Args:
+        ecg_data (pandas.DataFrame): the ecg recording
+        path (str): the folder to save the store in (e.g. ending in .ecg). Replaced if it exists
+        marker_column (str): the name of the column containing your markers, kept only in the marker table. Default is marker
+        datetime_columns (list): text columns to parse as datetimes (with a UTC offset they are stored as America/New_York).
+            Default is None and parses the columns starting with timestamp_est
+
+    Returns:
+        str: the store path
+    """
+    import os
+    import re
+    import json
+    import shutil
+    import numpy as np
+    import pandas as pd
+
+    if datetime_columns is None:
+        datetime_columns = [column for column in ecg_data.columns if str(column).startswith('timestamp_est')]
+    tmp_path = _tmp_path(path)
+    os.makedirs(tmp_path)
+
+    columns = []
+    for i, name in enumerate(ecg_data.columns):
+        values = ecg_data[name]
+        column = {'name': name, 'file': f'{i}.npy'}
+        if name == marker_column:
+            column.update(kind='marker', file=None)
+        elif name in datetime_columns or pd.api.types.is_datetime64_any_dtype(values):
+            if not pd.api.types.is_datetime64_any_dtype(values):
+                first = values.dropna().astype(str).iloc[0] if values.notna().any() else ''
+                with_offset = re.search(r'([+-]\d{2}:?\d{2}|Z)$', first) is not None
+                values = pd.to_datetime(values, format='ISO8601', utc=with_offset)
+                if with_offset:
+                    values = values.dt.tz_convert('America/New_York')
+            tz = values.dt.tz
+            if tz is not None:
+                values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+            column.update(kind='datetime', tz=str(tz) if tz is not None else None)
+            np.save(os.path.join(tmp_path, column['file']), values.to_numpy().astype('datetime64[ns]').view('int64'))
+        elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_extension_array_dtype(values):
+            column.update(kind='numeric')
+            np.save(os.path.join(tmp_path, column['file']), values.to_numpy())
+        else:
+            column.update(kind='string', missing=f'{i}_missing.npy')
+            np.save(os.path.join(tmp_path, column['file']), values.fillna('').astype(str).to_numpy(dtype='U'))
+            np.save(os.path.join(tmp_path, column['missing']), values.isna().to_numpy())
+        columns.append(column)
+
+    markers = _ecg_marker_table(ecg_data, marker_column)
+    meta = {
+        'n_samples': len(ecg_data),
+        'marker_column': marker_column,
+        'columns': columns,
+        'recording_ids': ecg_data['recording_id'].unique().tolist() if 'recording_id' in ecg_data.columns else None,
+        'markers': {column: markers[column].tolist() for column in markers.columns}
+    }
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    #move the old store aside rather than deleting it first, so path is only missing between two renames
+    old_path = _tmp_path(path)
+    try:
+        os.replace(path, old_path)
+    except FileNotFoundError:
+        pass
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return path
+#-----------------------
+
+#27-----------------------
+def convert_ecg_csv(csv_path, store_path = None, marker_column = 'marker', datetime_columns = None):
+    """
+    Converts a raw ecg csv into an ecg store (see write_ecg_store), so it is parsed once rather than every time it is used
+
+    Args:
+        csv_path (str): the raw ecg csv file path
+        store_path (str): the folder to save the store in. Default is None and uses the csv path with .ecg in place of .csv
+        marker_column (str): the name of the column containing your markers. Default is marker
+        datetime_columns (list): text columns to parse as datetimes. Default is None and parses the columns starting with timestamp_est
+
+    Returns:
+        str: the store path
+    """
+    import os
+    import pandas as pd
+
+    store_path = os.path.splitext(csv_path)[0] + '.ecg' if store_path is None else store_path
+    ecg_data = pd.read_csv(csv_path, dtype={marker_column: object})
+    return write_ecg_store(ecg_data, store_path, marker_column, datetime_columns)
+#-----------------------
+
+#28-----------------------
+def read_ecg_store(path, columns = None, rows = None):
+    """
+    Reads an ecg store (see write_ecg_store). Numeric columns are memory-mapped read-only rather than read, so only the samples you touch
+    are loaded from disk (copy a column before changing its values in place). Timezone-aware datetime columns are copied once to restore their timezone
+
+    Args:
+        path (str): the store path
+        columns (list): the columns to read. Default is None and reads all
+        rows (slice): the rows (by position) to read, e.g. slice(1000, 5000). Default is None and reads all
+
+    Returns:
+        pandas.DataFrame: the recording, indexed by sample position
+    """
+    import os
+    import json
+    import numpy as np
+    import pandas as pd
+
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    start, stop, _ = (rows if rows is not None else slice(None)).indices(meta['n_samples'])
+    stop = max(start, stop)
+
+    data = {}
+    for column in meta['columns']:
+        if columns is not None and column['name'] not in columns:
+            continue
+        if column['kind'] == 'marker':
+            values = np.full(stop - start, np.nan, dtype=object)
+            positions = np.asarray(meta['markers']['sample_index'], dtype='int64')
+            inside = (positions >= start) & (positions < stop)
+            values[positions[inside] - start] = np.asarray(meta['markers']['marker'], dtype=object)[inside]
+        else:
+            values = np.load(os.path.join(path, column['file']), mmap_mode='r')[start:stop].view(np.ndarray)
+            if column['kind'] == 'datetime':
+                values = values.view('datetime64[ns]')
+                if column['tz'] is not None:
+                    values = pd.Series(values, dtype='datetime64[ns, UTC]').dt.tz_convert(column['tz']).array
+            elif column['kind'] == 'string':
+                missing = np.load(os.path.join(path, column['missing']), mmap_mode='r')[start:stop]
+                values = np.where(missing, np.nan, values.astype(object))
+        data[column['name']] = values
+
+    #columns are joined without consolidating them into blocks, which would copy the memory-mapped arrays into memory
+    index = pd.RangeIndex(start, stop)
+    series = [pd.Series(values, index=index, name=name, copy=False) for name, values in data.items()]
+    if not series:
+        return pd.DataFrame(index=index)
+    if int(pd.__version__.split('.')[0]) < 3:
+        return pd.concat(series, axis=1, copy=False)
+    return pd.concat(series, axis=1)
+#-----------------------
+
+#29-----------------------
+def segment_ecg_tasks(ecg_file, segments, marker_column = 'marker', time_column = 'timestamp_est_corrected'):
+    """
+    Segments a recording into every task at once based on a table of start and end markers. The markers are found in a single scan
+    of the marker column (or from the marker table of an ecg store), and each segment is cut as in segment_full_ecg: from the first
+    start marker to the first end marker, with a timestamp_relative column in seconds from its first sample
+
+    Args:
+        ecg_file (pandas.DataFrame or str): the ecg data to segment, or the path of an ecg store (see write_ecg_store), in which case only the rows of the segments are loaded
+        segments (pandas.DataFrame or list): one row per task with task, start_marker and end_marker columns, or a list of (task, start_marker, end_marker)
+            e.g. [('richards', 'richards_start', 'richards_end'), ('vpc', 'vpc_start', 'vpc_end')]
+        marker_column (str): the name of the column in ecg_file containing your markers. Default is marker
+        time_column (str): the name of the datetime column timestamp_relative is counted on. Default is timestamp_est_corrected
+
+    Returns:
+        dict: task -> pandas.DataFrame of the task's rows (an empty DataFrame where a marker is missing or the segment has 4 rows or fewer)
+    """
+    import pandas as pd
+
+    if not isinstance(segments, pd.DataFrame):
+        segments = pd.DataFrame(segments, columns=['task', 'start_marker', 'end_marker'])
+
+    markers = _ecg_marker_index(ecg_file, marker_column)
+    if markers is None:
+        print('cannot segment file: ' + marker_column + " is not present in the file")
+        return {task: pd.DataFrame(columns=[]) for task in segments['task']}
+
+    #first row of every marker, from a single scan of the marker column
+    first_rows = markers.drop_duplicates('marker').set_index('marker')['sample_index']
+    starts = first_rows.reindex(segments['start_marker']).to_numpy()
+    ends = first_rows.reindex(segments['end_marker']).to_numpy()
+
+    segmented = {}
+    for task, start_marker, end_marker, start, end in zip(segments['task'], segments['start_marker'], segments['end_marker'], starts, ends):
+        if pd.isna(start) or pd.isna(end):
+            missing = [marker for marker, row in [(start_marker, start), (end_marker, end)] if pd.isna(row)]
+            print('cannot segment ' + str(task) + ': ' + ' and '.join(missing) + ' not present in file')
+            segmented[task] = pd.DataFrame(columns=[])
+            continue
+        segment = _ecg_rows(ecg_file, int(start), int(end) + 1)
+        if len(segment) > 4:
+            #a shallow copy takes the new column without copying the segment's data
+            segment = segment.copy(deep=False)
+            segment['timestamp_relative'] = (segment[time_column] - segment[time_column].min()).dt.total_seconds()
+            segmented[task] = segment
+        else:
+            segmented[task] = pd.DataFrame(columns=[])
+    return segmented
+#-----------------------
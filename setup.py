@@ -9,4 +9,5 @@ setup(
    description='Pulls REDCap data into python using api',
    url='https://github.com/amyhume/OrcaDataPy',
    python_requires='>=3.6',
+   install_requires=['pandas', 'numpy', 'requests', 'pyarrow'],
 )
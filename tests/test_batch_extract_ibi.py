@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import orca
+
+h5py = pytest.importorskip('h5py')
+
+
+def write_recording(root, record_id, who, rng, task = 'Richards', timepoint = '4'):
+    #a Kubios matlab file and its raw ecg csv, in the default folder layout
+    base = os.path.join(root, timepoint + ' Months', 'Heart Rate Data', task)
+    for folder in ['Beat Corrected Matlab Files', 'Raw ECG Data']:
+        os.makedirs(os.path.join(base, folder), exist_ok=True)
+
+    ibi = rng.uniform(0.4, 0.9, size=500)
+    times = np.cumsum(ibi)
+    with h5py.File(os.path.join(base, 'Beat Corrected Matlab Files', f'{record_id}_{timepoint}m_{who}_ecg_{task.lower()}_hrv.mat'), 'w') as f:
+        for key, values in [('T_RRi', times), ('RRi', ibi), ('RRdti', ibi * 0), ('T_RR', times), ('RR', ibi * 1000), ('RRdt', ibi * 0)]:
+            f['/Res/HRV/Data/' + key] = values[None, :]
+
+    n = int(times[-1] * 32)
+    ecg_data = pd.DataFrame({'ecg': rng.normal(size=n), 'timestamp_relative': np.arange(n) / 32, 'marker': np.nan, 'recording_id': 1})
+    ecg_data = ecg_data.astype({'marker': object})
+    ecg_data.loc[[100, n - 100], 'marker'] = ['richards_start', 'richards_end']
+    ecg_path = os.path.join(base, 'Raw ECG Data', f'{record_id}_{timepoint}m_{who}_ecg_{task.lower()}.csv')
+    ecg_data.to_csv(ecg_path, index=False)
+    return ecg_path
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_a_corrupt_raw_ecg_file_is_a_failure_row(tmp_path, workers):
+    rng = np.random.default_rng(0)
+    write_recording(str(tmp_path), '101', 'cg', rng)
+    corrupt_path = write_recording(str(tmp_path), '102', 'cg', rng)
+    with open(corrupt_path, 'w') as f:
+        #an unterminated quote, so the csv can't be parsed
+        f.write('ecg,timestamp_relative,marker,recording_id\n0.1,0.0,,1\n0.2,0.1,"richards_start,1\n0.3,0.2,,1\n')
+
+    log, task_import, failures = orca.batch_extract_ibi('Richards', input_root=str(tmp_path), workers=workers)
+
+    assert log['record_id'].tolist() == ['101']
+    assert task_import['record_id'].tolist() == ['101']
+    assert failures['record_id'].tolist() == ['102']
+    assert failures['error'].iloc[0].startswith('ParserError: ')
+    assert os.path.exists(os.path.join(str(tmp_path), '4 Months', 'Heart Rate Data', 'Richards', 'IBI Files', '101_4m_cg_ibi_richards.csv'))
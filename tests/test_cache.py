@@ -0,0 +1,64 @@
+import os
+
+import pandas as pd
+import pytest
+
+import orca
+from orca import orca_functions
+
+
+class FakeResponse:
+    status_code = 200
+    text = 'record_id,redcap_event_name,notes\n101,orca_4month_arm_1,1\n102,orca_4month_arm_1,a\n'
+
+
+@pytest.fixture
+def api(monkeypatch):
+    calls = []
+    def post(token, data, **kwargs):
+        calls.append(data)
+        return FakeResponse()
+    #a large export parsed chunk by chunk can leave a free text column holding both ints and strs
+    def read_export(r, dtype_map = None):
+        return pd.DataFrame({
+            'record_id': ['101', '102'],
+            'redcap_event_name': ['orca_4month_arm_1'] * 2,
+            'notes': pd.Series([1, 'a'], dtype=object),
+        })
+    monkeypatch.setattr(orca_functions, '_redcap_post', post)
+    monkeypatch.setattr(orca_functions, '_read_export', read_export)
+    return calls
+
+def cached_files(cache_dir):
+    return [file for folder, _, files in os.walk(cache_dir) for file in files]
+
+
+def test_exports_pyarrow_cannot_store_are_still_cached(api, tmp_path):
+    client = orca.OrcaClient('token', cache_dir=str(tmp_path))
+
+    first = orca.get_orca_field(client, 'notes')
+    second = orca.get_orca_field(client, 'notes')
+
+    assert len(api) == 1
+    pd.testing.assert_frame_equal(first, second)
+    assert second['notes'].tolist() == [1, 'a']
+    assert [os.path.splitext(file)[1] for file in cached_files(tmp_path)] == ['.pkl']
+
+def test_an_unwritable_cache_never_fails_an_export(api, tmp_path):
+    not_a_folder = tmp_path / 'cache'
+    not_a_folder.write_text('')
+    client = orca.OrcaClient('token', cache_dir=str(not_a_folder / 'nested'))
+
+    df = orca.get_orca_field(client, 'notes')
+
+    assert df['record_id'].tolist() == ['101', '102']
+    assert cached_files(tmp_path) == ['cache']
+
+def test_clear_cache_removes_pickled_field_exports(api, tmp_path, monkeypatch):
+    client = orca.OrcaClient('token', cache_dir=str(tmp_path))
+    orca.get_orca_field(client, 'notes')
+    metadata = pd.DataFrame({'field_name': ['record_id', 'notes'], 'form_name': ['visit_notes_4m'] * 2})
+    monkeypatch.setattr(orca_functions, 'get_metadata', lambda token, refresh = False: metadata)
+
+    assert orca.clear_cache(client, 'visit_notes_4m') == 1
+    assert cached_files(tmp_path) == []
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import orca
+from orca import orca_functions
+
+
+@pytest.fixture
+def ecg_csv(tmp_path):
+    ecg_data = pd.DataFrame({'ecg': np.arange(1000.0), 'timestamp_relative': np.arange(1000) / 256, 'marker': np.nan, 'recording_id': 1})
+    ecg_data = ecg_data.astype({'marker': object})
+    ecg_data.loc[[10, 900], 'marker'] = ['richards_start', 'richards_end']
+    path = str(tmp_path / 'recording.csv')
+    ecg_data.to_csv(path, index=False)
+    return path
+
+
+def test_reading_markers_leaves_the_folder_alone(ecg_csv, tmp_path):
+    markers = orca.read_ecg_markers(ecg_csv)
+
+    assert markers['marker'].tolist() == ['richards_start', 'richards_end']
+    assert markers['sample_index'].tolist() == [10, 900]
+    assert os.listdir(tmp_path) == ['recording.csv']
+
+def test_index_is_used_once_written(ecg_csv):
+    scanned = orca.read_ecg_markers(ecg_csv, write_index=True)
+    assert os.path.exists(orca_functions._marker_index_path(ecg_csv))
+
+    pd.testing.assert_frame_equal(orca.read_ecg_markers(ecg_csv), scanned)
+
+def test_an_unwritable_index_does_not_fail_the_read(ecg_csv, tmp_path, monkeypatch):
+    #as on a read-only data share: the index can't be created next to the csv
+    not_a_folder = tmp_path / 'read_only'
+    not_a_folder.write_text('')
+    monkeypatch.setattr(orca_functions, '_marker_index_path', lambda path: str(not_a_folder / 'recording.markers.json'))
+
+    markers = orca.read_ecg_markers(ecg_csv, write_index=True)
+
+    assert markers['marker'].tolist() == ['richards_start', 'richards_end']
+    assert sorted(os.listdir(tmp_path)) == ['read_only', 'recording.csv']
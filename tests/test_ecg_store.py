@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import orca
+
+
+@pytest.fixture
+def recording():
+    n = 5000
+    start = pd.Timestamp('2024-03-01 10:00', tz='America/New_York')
+    ecg_data = pd.DataFrame({
+        'ecg': np.random.default_rng(0).normal(size=n),
+        'timestamp_est_corrected': pd.Series(start + pd.to_timedelta(np.arange(n) / 256, unit='s')),
+        'recording_id': 1,
+        'status': 'ok',
+        'marker': np.nan,
+    }).astype({'marker': object})
+    ecg_data.loc[10, 'status'] = np.nan
+    for i, task in enumerate(['richards', 'vpc', 'srt']):
+        ecg_data.loc[100 + i * 1500, 'marker'] = task + '_start'
+        ecg_data.loc[1000 + i * 1500, 'marker'] = task + '_end'
+    return ecg_data
+
+@pytest.fixture
+def store(recording, tmp_path):
+    return orca.write_ecg_store(recording, str(tmp_path / 'recording.ecg'))
+
+
+def test_round_trip(recording, store):
+    pd.testing.assert_frame_equal(orca.read_ecg_store(store), recording, check_dtype=False)
+
+def test_rows_and_columns(recording, store):
+    part = orca.read_ecg_store(store, columns=['ecg', 'marker'], rows=slice(1000, 1600))
+
+    pd.testing.assert_frame_equal(part, recording.loc[1000:1599, ['ecg', 'marker']], check_dtype=False)
+
+def test_numeric_columns_are_memory_mapped(store):
+    ecg = orca.read_ecg_store(store)['ecg'].to_numpy()
+
+    bases = []
+    while ecg is not None:
+        bases.append(ecg)
+        ecg = getattr(ecg, 'base', None)
+    assert any(isinstance(base, np.memmap) for base in bases)
+    assert not bases[0].flags.writeable
+
+def test_rewriting_a_store_replaces_it(recording, store):
+    orca.write_ecg_store(recording.iloc[:2000], store)
+
+    assert len(orca.read_ecg_store(store)) == 2000
+    assert orca.read_ecg_markers(store)['marker'].tolist() == ['richards_start', 'richards_end', 'vpc_start']
+
+def test_segment_tasks_from_frame_and_store(recording, store):
+    segments = [('richards', 'richards_start', 'richards_end'), ('srt', 'srt_start', 'srt_end'), ('missing', 'nope_start', 'vpc_end')]
+
+    from_frame = orca.segment_ecg_tasks(recording, segments)
+    from_store = orca.segment_ecg_tasks(store, segments)
+
+    assert set(from_frame) == set(from_store) == {'richards', 'srt', 'missing'}
+    assert from_frame['missing'].empty and from_store['missing'].empty
+    for task, start_marker, end_marker in segments[:2]:
+        single = orca.segment_full_ecg(recording, 'marker', start_marker, end_marker)
+        pd.testing.assert_frame_equal(from_frame[task], single)
+        pd.testing.assert_frame_equal(from_store[task], single, check_dtype=False)
+    assert from_store['srt'].index[[0, -1]].tolist() == [3100, 4000]
+    assert from_store['srt']['timestamp_relative'].iloc[-1] == pytest.approx(900 / 256)
+    assert 'timestamp_relative' not in recording.columns
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+import orca
+
+
+def records(ids):
+    return pd.DataFrame({'record_id': ids, 'value': range(len(ids))})
+
+
+def test_default_exclusions_match_the_legacy_filters():
+    df = records(['101', 'TEST1', 'test_2', 'D12', '497', '498', '499', '496', '102', '101'])
+
+    legacy = df[~df['record_id'].str.contains('TEST')]
+    legacy = legacy[~legacy['record_id'].str.contains('test')]
+    legacy = legacy[~legacy['record_id'].str.contains('D')]
+    for record_id in ['497', '498', '499']:
+        legacy = legacy[legacy['record_id'] != record_id]
+
+    pd.testing.assert_frame_equal(orca.exclude_records(df), legacy)
+
+def test_rules_with_capture_groups():
+    df = records(['b_1', 'xy', 'staff9', '101', '200', 'xy'])
+    exclusions = {'patterns': [r'b(_\d)?', '(x)(y)', 'staff'], 'record_ids': ['101']}
+
+    filtered, report = orca.exclude_records(df, exclusions, report=True)
+
+    assert filtered['record_id'].tolist() == ['200']
+    assert dict(zip(report['record_id'], report['rule'])) == {
+        'b_1': r'pattern: b(_\d)?',
+        'xy': 'pattern: (x)(y)',
+        'staff9': 'pattern: staff',
+        '101': 'record_id',
+    }
+
+def test_first_pattern_in_list_order_is_blamed():
+    df = records(['TEST_D1'])
+
+    _, report = orca.exclude_records(df, {'patterns': ['D', 'TEST']}, report=True)
+
+    assert report['rule'].tolist() == ['pattern: D']
+
+def test_include():
+    df = records(['101', '102', 'pilot3'])
+
+    filtered, report = orca.exclude_records(df, {'include': [r'^\d+$'], 'record_ids': ['102']}, report=True)
+
+    assert filtered['record_id'].tolist() == ['101']
+    assert dict(zip(report['record_id'], report['rule'])) == {'102': 'record_id', 'pilot3': 'not included'}
+
+def test_empty_exclusions_and_missing_ids_keep_records():
+    df = records(['101', np.nan, 'TEST1'])
+
+    assert orca.exclude_records(df, {})['record_id'].tolist() == df['record_id'].tolist()
+    assert orca.exclude_records(df)['value'].tolist() == [0, 1]
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import orca
+
+
+def legacy_conditions(times, markers):
+    #the nested loop extract_task_ibi used for the condition column before label_intervals
+    condition_list = []
+    for time in times:
+        for i2, marker_time in enumerate(markers['time_s']):
+            if i2 != (markers.index.stop - 1):
+                if time >= marker_time and time < markers['time_s'][i2 + 1]:
+                    condition = markers['condition'][i2]
+                    break
+                else:
+                    condition = np.nan
+            else:
+                if time >= marker_time:
+                    condition = markers['condition'][i2]
+                    break
+                else:
+                    condition = np.nan
+        condition_list.append(condition)
+    return condition_list
+
+def ibi_with_markers(seed):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({'time_s': np.round(np.cumsum(rng.uniform(0.3, 1.2, 400)), 3), 'marker': np.nan}).astype({'marker': object})
+    names = ['notoy_start', 'notoy_end', 'toy_start', 'toy_end', 'break_start', 'break_end']
+    rows = np.sort(rng.choice(np.arange(5, 395), len(names), replace=False))
+    data.loc[rows, 'marker'] = names
+    markers = data[pd.notna(data['marker'])].reset_index(drop=True)[['time_s', 'marker']]
+    markers['condition'] = markers['marker'].str.split('_').str[0]
+    return data, markers
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_legacy_loop(seed):
+    data, markers = ibi_with_markers(seed)
+
+    labels = orca.label_intervals(data['time_s'], markers)
+
+    expected = pd.Series(legacy_conditions(data['time_s'], markers), index=data.index, dtype=object)
+    pd.testing.assert_series_equal(labels, expected, check_names=False, check_dtype=False)
+
+def test_keeps_the_index_of_times():
+    times = pd.Series([0.5, 1.5, 2.5], index=[10, 11, 12])
+    markers = pd.DataFrame({'time_s': [1.0, 2.0], 'condition': ['a', 'b']})
+
+    labels = orca.label_intervals(times, markers)
+
+    assert labels.index.tolist() == [10, 11, 12]
+    assert labels.isna().tolist() == [True, False, False]
+    assert labels.tolist()[1:] == ['a', 'b']
+
+def test_end_column_and_closed():
+    times = pd.Series([1.0, 1.5, 2.0, 2.5, 3.0, 4.0])
+    markers = pd.DataFrame({'start': [3.0, 1.0], 'end': [4.0, 2.0], 'condition': ['b', 'a']})
+
+    left = orca.label_intervals(times, markers, start_column='start', end_column='end', default='none')
+    both = orca.label_intervals(times, markers, start_column='start', end_column='end', closed='both', default='none')
+
+    assert left.tolist() == ['a', 'a', 'none', 'none', 'b', 'none']
+    assert both.tolist() == ['a', 'a', 'a', 'none', 'b', 'b']
+
+def test_unknown_closed():
+    with pytest.raises(ValueError):
+        orca.label_intervals(pd.Series([1.0]), pd.DataFrame({'time_s': [0.0], 'condition': ['a']}), closed='middle')
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import orca
+
+
+def legacy_find_closest(timestamp, timestamps):
+    #find_closest_timestamp as it was
+    return min(timestamps, key=lambda x: abs(timestamp - x))
+
+def legacy_unique_matches(markers, times):
+    #the marker placement loop extract_task_ibi used before match_timestamps
+    closest_timestamps = []
+    for marker in markers:
+        closest_timestamp = legacy_find_closest(marker, times)
+        if closest_timestamp in closest_timestamps:
+            available_times = [t for t in times if t not in closest_timestamps and t >= marker]
+            closest_timestamp = legacy_find_closest(marker, available_times)
+        closest_timestamps.append(closest_timestamp)
+    return closest_timestamps
+
+def beat_times(rng, n = 300):
+    return np.round(np.cumsum(rng.uniform(0.3, 1.2, n)), 3)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_unique_matches_legacy_loop(seed):
+    rng = np.random.default_rng(seed)
+    times = beat_times(rng)
+    #clustered markers so several of them share a closest beat
+    centres = rng.uniform(times[0], times[-1] * 0.8, 6)
+    markers = np.round(np.concatenate([centre + rng.uniform(-0.5, 0.5, 4) for centre in centres]), 3)
+
+    matches = orca.match_timestamps(markers, times, unique=True)
+
+    assert (matches >= 0).all()
+    assert len(set(matches)) == len(matches)
+    assert times[matches].tolist() == legacy_unique_matches(markers.tolist(), times.tolist())
+
+@pytest.mark.parametrize('seed', range(5))
+def test_closest_matches_find_closest_timestamp(seed):
+    rng = np.random.default_rng(seed)
+    times = beat_times(rng)
+    markers = np.round(rng.uniform(times[0] - 5, times[-1] + 5, 50), 3)
+
+    matches = orca.match_timestamps(markers, times)
+
+    assert times[matches].tolist() == [legacy_find_closest(marker, times.tolist()) for marker in markers]
+
+def test_ties_go_to_the_earlier_value():
+    times = [0.0, 1.0, 2.0]
+
+    assert orca.match_timestamps([0.5, 1.5], times).tolist() == [0, 1]
+    assert [legacy_find_closest(marker, times) for marker in [0.5, 1.5]] == [0.0, 1.0]
+
+def test_unique_matches_run_out():
+    matches = orca.match_timestamps([1.9, 2.0, 2.1], [0.0, 1.0, 2.0], unique=True)
+
+    assert matches.tolist() == [2, -1, -1]
+
+def test_tolerance():
+    matches = orca.match_timestamps([0.1, 0.6, 5.0], [0.0, 1.0, 2.0], tolerance=0.5)
+
+    assert matches.tolist() == [0, 1, -1]
+
+def test_datetimes():
+    start = pd.Timestamp('2024-03-01 10:00', tz='America/New_York')
+    times = pd.Series(start + pd.to_timedelta(np.arange(0, 10, 0.8), unit='s'))
+    markers = pd.Series(start + pd.to_timedelta([0.3, 0.5, 3.9, 20.0], unit='s'))
+
+    matches = orca.match_timestamps(markers, times, tolerance=pd.Timedelta(seconds=1))
+
+    expected = [times.tolist().index(legacy_find_closest(marker, times.tolist())) for marker in markers[:3]]
+    assert matches.tolist() == expected + [-1]
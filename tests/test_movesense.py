@@ -0,0 +1,25 @@
+import pandas as pd
+
+import orca
+
+
+def test_movesense_version_is_unknown_without_a_mailed_date():
+    visit_notes = pd.DataFrame({
+        'record_id': ['101', '102', '103', '104'],
+        'redcap_event_name': 'orca_4month_arm_1',
+        'visit_date_4m': '2025-02-01',
+        'package_mailed_4m': ['2024-12-01', '2025-03-01', None, 'not a date'],
+        'ra_mailed_4m': ['AH', 'JV', None, 'AH'],
+    })
+
+    info = orca.get_movesense_info(None, timepoint='4m', visit_notes=visit_notes)
+
+    assert str(info['movesense_version'].dtype) == 'Int64'
+    assert info['movesense_version'].tolist() == [1, 2, pd.NA, pd.NA]
+
+def test_movesense_version_is_na_without_a_mailing_form():
+    visit_notes = pd.DataFrame({'record_id': ['101'], 'redcap_event_name': 'orca_8month_arm_1', 'visit_date_8m': '2025-02-01'})
+
+    info = orca.get_movesense_info(None, timepoint='8m', visit_notes=visit_notes)
+
+    assert info['movesense_version'].isna().all()